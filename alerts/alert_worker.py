@@ -14,6 +14,7 @@
 
 import json
 import os
+import socket
 import sys
 from configlib import getConfig, OptionParser
 from kombu import Connection, Queue, Exchange
@@ -68,6 +69,12 @@ class alertConsumer(ConsumerMixin):
         except ValueError as e:
             logger.exception("alertworker exception while processing events queue %r" % e)
 
+    def on_iteration(self):
+        # kombu calls this before every drain_events
+        if plugin_set.stats.due(options.pluginstatsinterval):
+            # we've no elastic search connection, so the timings go to the log
+            logger.info(json.dumps(plugin_set.stats.to_event(options.mozdefhostname)))
+
 
 def main():
     # connect and declare the message queue/kombu objects.
@@ -132,6 +139,9 @@ def initConfig():
     options.mqport = getConfig('mqport', 5672, options.configfile)
     # mqack=True sets persistant delivery, False sets transient delivery
     options.mqack = getConfig('mqack', True, options.configfile)
+    # secs between logging per plugin timings, 0 to disable
+    options.pluginstatsinterval = getConfig('pluginstatsinterval', 300, options.configfile)
+    options.mozdefhostname = getConfig('mozdefhostname', socket.gethostname(), options.configfile)
 
 
 if __name__ == '__main__':
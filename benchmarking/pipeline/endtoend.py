@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+# drive sample events through the whole pipeline, all in this one process:
+# http posts -> loginput -> kombu's in memory transport -> esworker_eventtask
+# -> a fake elastic search that only counts what it's sent
+# and report events/sec, per stage latencies and memory use
+
+import copy
+import glob
+import json
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from datetime import datetime, timedelta
+from optparse import OptionParser
+from Queue import Queue
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+import requests
+
+mozdefDir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../..'))
+
+BENCHMARK_ID = re.compile(r'"benchmarkid": (\d+)')
+
+
+class Timings(object):
+    '''when each event was posted, reached the esworker and reached ES'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.posted = dict()
+        self.received = dict()
+        self.indexed = dict()
+        self.requests = list()
+        self.done = threading.Event()
+        self.expected = 0
+
+    def record(self, stage, ids, when=None):
+        if when is None:
+            when = time.time()
+        with self.lock:
+            for eventId in ids:
+                stage[eventId] = when
+            if len(self.indexed) >= self.expected:
+                self.done.set()
+
+    def latencies(self, start, end):
+        return [end[eventId] - start[eventId] for eventId in end if eventId in start]
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+class FakeESHandler(BaseHTTPRequestHandler):
+    '''answers just enough of the elastic search api for the esworker'''
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, body):
+        body = json.dumps(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.respond({})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        self.server.timings.record(self.server.timings.indexed, [int(eventId) for eventId in BENCHMARK_ID.findall(body)])
+        if self.path.split('?')[0].endswith('_bulk'):
+            # every other line is an action line
+            count = (body.count('\n') + 1) // 2
+            items = [{'index': {'_id': str(num), 'status': 201}} for num in range(count)]
+            self.respond(dict(took=1, errors=False, items=items))
+        else:
+            self.respond(dict(_id='1', _version=1, created=True))
+
+    do_PUT = do_POST
+
+
+class FakeES(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, timings):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeESHandler)
+        self.timings = timings
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def writeConfig(settings):
+    configFile = tempfile.NamedTemporaryFile(suffix='.conf', delete=False)
+    configFile.write('[options]\n')
+    for key, value in settings.iteritems():
+        configFile.write('{0}={1}\n'.format(key, value))
+    configFile.close()
+    return configFile.name
+
+
+def startLoginput(options):
+    '''import loginput against the in memory transport and serve it on a free port'''
+    configFile = writeConfig(dict(
+        mqprotocol='memory',
+        batchsize=options.batchsize,
+        eventspermessage=options.eventspermessage))
+    sys.path.insert(0, os.path.join(mozdefDir, 'loginput'))
+    # loginput reads its config file from the command line
+    argv = sys.argv
+    sys.argv = [argv[0], '-c', configFile]
+    try:
+        import index
+    finally:
+        sys.argv = argv
+    server = make_server('127.0.0.1', 0, index.application, server_class=ThreadingWSGIServer, handler_class=QuietWSGIRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name='loginput')
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:{0}'.format(server.server_port)
+
+
+def startESWorker(options, timings, esPort):
+    '''run esworker_eventtask's consumer in a thread against the in memory transport'''
+    configFile = writeConfig(dict(
+        mqprotocol='memory',
+        mqack=False,
+        prefetch=options.prefetch,
+        esservers='http://127.0.0.1:{0}'.format(esPort),
+        esbulksize=options.esbulksize,
+        esbulktimeout=1,
+        esbulksenders=options.esbulksenders))
+    sys.path.insert(0, os.path.join(mozdefDir, 'mq'))
+    # plugins are found relative to the working directory
+    os.chdir(os.path.join(mozdefDir, 'mq'))
+    import esworker_eventtask
+
+    class WorkerOptions(object):
+        pass
+    workerOptions = WorkerOptions()
+    workerOptions.configfile = configFile
+    workerOptions.workers = 0
+    esworker_eventtask.options = workerOptions
+    esworker_eventtask.initConfig()
+    esworker_eventtask.pluginList = list()
+    if options.plugins:
+        esworker_eventtask.pluginList, lastPluginCheck = esworker_eventtask.checkPlugins(list(), datetime.now() - timedelta(minutes=60), 0)
+    esworker_eventtask.es = esworker_eventtask.esConnect()
+
+    ready = threading.Event()
+    consumers = list()
+
+    class timedConsumer(esworker_eventtask.taskConsumer):
+        def __init__(self, *args, **kwargs):
+            super(timedConsumer, self).__init__(*args, **kwargs)
+            consumers.append(self)
+
+        def on_consume_ready(self, *args, **kwargs):
+            super(timedConsumer, self).on_consume_ready(*args, **kwargs)
+            ready.set()
+
+        def on_message(self, body, message):
+            events = body if isinstance(body, list) else [body]
+            timings.record(timings.received, [event['details']['benchmarkid'] for event in events])
+            super(timedConsumer, self).on_message(body, message)
+
+    esworker_eventtask.taskConsumer = timedConsumer
+    thread = threading.Thread(target=esworker_eventtask.main, name='esworker')
+    thread.daemon = True
+    thread.start()
+    if not ready.wait(30):
+        raise Exception('esworker did not start consuming')
+
+    def stop():
+        consumer = consumers[0]
+        consumer.should_stop = True
+        thread.join()
+        # the bulk timer would otherwise keep us running
+        consumer.esConnection.finish_bulk()
+    return stop
+
+
+def loadEvents(path, mix):
+    '''events from the sample files, keyed by file name without .json'''
+    events = dict()
+    for eventFile in sorted(glob.glob(os.path.join(path, '*.json'))):
+        with open(eventFile) as f:
+            events[os.path.basename(eventFile)[:-5]] = json.load(f)
+    weights = dict((name, 1) for name in events)
+    if mix:
+        weights = dict()
+        for part in mix.split(','):
+            name, weight = part.split('=')
+            if name not in events:
+                raise Exception('no sample events called {0}, choose from {1}'.format(name, ', '.join(sorted(events))))
+            weights[name] = float(weight)
+    return events, weights
+
+
+def makeRequests(options, timings):
+    '''the (path, body, ids) of every post to make'''
+    samples, weights = loadEvents(options.events, options.mix)
+    names = sorted(weights)
+    total = sum(weights.values())
+    rand = random.Random(options.seed)
+    requestList = list()
+    bulk = list()
+    for eventId in range(options.count):
+        pick = rand.uniform(0, total)
+        for name in names:
+            pick -= weights[name]
+            if pick <= 0:
+                break
+        event = copy.deepcopy(rand.choice(samples[name]))
+        if not isinstance(event.get('details'), dict):
+            event['details'] = dict()
+        event['details']['benchmarkid'] = eventId
+        if 'cef' in name:
+            # cef has its own endpoint
+            requestList.append(('/cef', json.dumps(event), [eventId]))
+        elif options.bulk:
+            bulk.append(event)
+            if len(bulk) >= options.bulk:
+                requestList.append(bulkRequest(bulk))
+                bulk = list()
+        else:
+            requestList.append(('/events', json.dumps(event), [eventId]))
+    if bulk:
+        requestList.append(bulkRequest(bulk))
+    timings.expected = options.count
+    return requestList
+
+
+def bulkRequest(events):
+    return ('/_bulk', '\n'.join(json.dumps(event) for event in events) + '\n', [event['details']['benchmarkid'] for event in events])
+
+
+def postRequests(url, requestQueue, timings):
+    session = requests.Session()
+    session.trust_env = False
+    while True:
+        request = requestQueue.get()
+        if request is None:
+            return
+        path, body, ids = request
+        started = time.time()
+        timings.record(timings.posted, ids, started)
+        response = session.post(url + path, data=body)
+        if response.status_code >= 300:
+            sys.stderr.write('{0} from {1}\n'.format(response.status_code, path))
+        with timings.lock:
+            timings.requests.append(time.time() - started)
+
+
+def report(options, timings, elapsed, startRSS):
+    indexed = len(timings.indexed)
+    stages = [
+        ('http request', timings.requests),
+        ('loginput -> esworker', timings.latencies(timings.posted, timings.received)),
+        ('esworker -> es', timings.latencies(timings.received, timings.indexed)),
+        ('end to end', timings.latencies(timings.posted, timings.indexed)),
+    ]
+    # ru_maxrss is in KB on linux
+    peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    results = dict(
+        events=options.count,
+        indexed=indexed,
+        seconds=elapsed,
+        eventspersec=indexed / elapsed,
+        latency=dict((name, dict(p50=percentile(values, 50), p99=percentile(values, 99))) for name, values in stages),
+        startrssmb=startRSS,
+        peakrssmb=peakRSS)
+    print('{0} of {1} events indexed in {2:.2f}s, {3:.0f} events/sec'.format(indexed, options.count, elapsed, results['eventspersec']))
+    for name, values in stages:
+        print('{0:>22}: p50 {1:8.1f}ms  p99 {2:8.1f}ms'.format(name, percentile(values, 50) * 1000, percentile(values, 99) * 1000))
+    print('{0:>22}: {1:.1f}MB at start, {2:.1f}MB peak'.format('rss', startRSS, peakRSS))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+def main(options):
+    startRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    timings = Timings()
+    fakeES = FakeES(timings)
+    esThread = threading.Thread(target=fakeES.serve_forever, name='fakees')
+    esThread.daemon = True
+    esThread.start()
+
+    stopESWorker = startESWorker(options, timings, fakeES.server_port)
+    url = startLoginput(options)
+    requestList = makeRequests(options, timings)
+    print('{0} events in {1} posts from {2} clients'.format(options.count, len(requestList), options.clients))
+
+    requestQueue = Queue()
+    for request in requestList:
+        requestQueue.put(request)
+    for num in range(options.clients):
+        requestQueue.put(None)
+    started = time.time()
+    clients = [threading.Thread(target=postRequests, args=(url, requestQueue, timings)) for num in range(options.clients)]
+    for client in clients:
+        client.daemon = True
+        client.start()
+    if not timings.done.wait(options.timeout):
+        sys.stderr.write('timed out waiting for every event to be indexed\n')
+    elapsed = time.time() - started
+    stopESWorker()
+    report(options, timings, elapsed, startRSS)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-e", dest='events', default=os.path.join(mozdefDir, 'examples/demo/sampleevents'), help="directory of sample event json files")
+    parser.add_option("-m", dest='mix', default='', help="event mix as name=weight,... using the file names in the events directory, defaults to an even mix")
+    parser.add_option("-n", dest='count', type='int', default=10000, help="events to send")
+    parser.add_option("-b", dest='bulk', type='int', default=100, help="events per /_bulk post, 0 to post them one at a time to /events")
+    parser.add_option("-c", dest='clients', type='int', default=4, help="concurrent http clients")
+    parser.add_option("--batchsize", dest='batchsize', type='int', default=100, help="loginput batchsize")
+    parser.add_option("--eventspermessage", dest='eventspermessage', type='int', default=100, help="loginput eventspermessage")
+    parser.add_option("--prefetch", dest='prefetch', type='int', default=50, help="esworker prefetch")
+    parser.add_option("--esbulksize", dest='esbulksize', type='int', default=100, help="esworker esbulksize")
+    parser.add_option("--esbulksenders", dest='esbulksenders', type='int', default=0, help="esworker esbulksenders")
+    parser.add_option("--plugins", dest='plugins', action='store_true', default=False, help="run the esworker plugins in mq/plugins too")
+    parser.add_option("--seed", dest='seed', type='int', default=0, help="random seed for picking events")
+    parser.add_option("--timeout", dest='timeout', type='float', default=300, help="secs to wait for everything to be indexed")
+    parser.add_option("-o", dest='output', default='', help="also write the results to this json file")
+    (options, args) = parser.parse_args()
+    main(options)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+# time how many events/sec the esworkers can normalize with keyMapping
+# using the sample events from examples/demo/sampleevents
+
+import glob
+import json
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../mq'))
+from lib.keymapping import keyMapping
+
+
+def loadEvents(path):
+    events = list()
+    for eventFile in sorted(glob.glob(os.path.join(path, '*.json'))):
+        with open(eventFile) as f:
+            events.extend(json.load(f))
+    return events
+
+
+def run(events, seconds):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        for event in events:
+            keyMapping(event, 'benchmark')
+        count += len(events)
+    return count / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-e", dest='events', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../examples/demo/sampleevents'), help="directory of sample event json files")
+    parser.add_option("-s", dest='seconds', type='float', default=5, help="seconds to run each round for")
+    parser.add_option("-r", dest='rounds', type='int', default=3, help="rounds to run")
+    (options, args) = parser.parse_args()
+
+    events = loadEvents(options.events)
+    print('{0} sample events'.format(len(events)))
+    for num in range(options.rounds):
+        print('round {0}: {1:.0f} events/sec'.format(num, run(events, options.seconds)))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+# time how many events/sec the syslog parsing plugins can get through
+# using the events from their unit tests in tests/mq/plugins
+
+import glob
+import imp
+import inspect
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../mq'))
+
+
+def loadFixtures(path, plugins):
+    '''the (plugin name, plugin, event) each test class in the plugins' tests sets up'''
+    fixtures = list()
+    for plugin in plugins:
+        for testFile in sorted(glob.glob(os.path.join(path, 'test_{0}.py'.format(plugin)))):
+            module = imp.load_source(os.path.basename(testFile)[:-3], testFile)
+            for name, testClass in sorted(inspect.getmembers(module, inspect.isclass)):
+                if not name.startswith('Test') or not hasattr(testClass, 'setup'):
+                    continue
+                test = testClass()
+                test.setup()
+                if hasattr(test, 'msgobj') and hasattr(test, 'msg'):
+                    fixtures.append((plugin, test.msgobj, test.msg))
+    return fixtures
+
+
+def run(fixtures, seconds):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        for (name, plugin, event) in fixtures:
+            plugin.onMessage(event, {'doc_type': 'event'})
+        count += len(fixtures)
+    return count / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-t", dest='tests', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../tests/mq/plugins'), help="directory of the plugin tests")
+    parser.add_option("-p", dest='plugins', default='parse_sshd,parse_su', help="comma separated plugins to time")
+    parser.add_option("-s", dest='seconds', type='float', default=5, help="seconds to run each round for")
+    parser.add_option("-r", dest='rounds', type='int', default=3, help="rounds to run")
+    (options, args) = parser.parse_args()
+
+    plugins = options.plugins.split(',')
+    fixtures = loadFixtures(options.tests, plugins)
+    for plugin in plugins:
+        pluginFixtures = [fixture for fixture in fixtures if fixture[0] == plugin]
+        print('{0}: {1} test events'.format(plugin, len(pluginFixtures)))
+        for num in range(options.rounds):
+            print('  round {0}: {1:.0f} events/sec'.format(num, run(pluginFixtures, options.seconds)))
+    print('all: {0} test events'.format(len(fixtures)))
+    for num in range(options.rounds):
+        print('  round {0}: {1:.0f} events/sec'.format(num, run(fixtures, options.seconds)))
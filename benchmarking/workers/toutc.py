@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+# time how many dates/sec toUTC can parse compared to
+# fuzzy parsing every string the way it used to
+
+import os
+import random
+import sys
+import time
+from optparse import OptionParser
+from dateutil.parser import parse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../lib'))
+from utilities.toUTC import toUTC, DATE_STRING_CACHE
+
+
+def realisticDates(count):
+    '''the kind of mix an esworker sees, lots of ISO-8601 and
+       syslog batches sharing second resolution timestamps'''
+    random.seed(42)
+    dates = list()
+    for num in range(count):
+        second = num / 50
+        shape = random.random()
+        if shape < 0.4:
+            dates.append('2017-10-27T14:%02d:%02d.%06dZ' % (second / 60 % 60, second % 60, random.randint(0, 999999)))
+        elif shape < 0.6:
+            dates.append('2017-10-27 14:%02d:%02d-07:00' % (second / 60 % 60, second % 60))
+        elif shape < 0.9:
+            dates.append('Oct 27 14:%02d:%02d' % (second / 60 % 60, second % 60))
+        else:
+            dates.append(1509113000 + second)
+    return dates
+
+
+def fuzzyOnly(suspectedDate):
+    '''what toUTC used to do with every string'''
+    if type(suspectedDate) in (str, unicode):
+        return parse(suspectedDate, fuzzy=True)
+    return toUTC(suspectedDate)
+
+
+def run(function, dates):
+    start = time.time()
+    for date in dates:
+        function(date)
+    return len(dates) / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", dest='dates', type='int', default=5000, help="dates to parse each round")
+    parser.add_option("-r", dest='rounds', type='int', default=3, help="rounds to run")
+    (options, args) = parser.parse_args()
+
+    dates = realisticDates(options.dates)
+    for num in range(options.rounds):
+        DATE_STRING_CACHE.entries.clear()
+        fuzzy = run(fuzzyOnly, dates)
+        fast = run(toUTC, dates)
+        print('round {0}: toUTC {1:.0f} dates/sec, fuzzy parse {2:.0f} dates/sec'.format(num, fast, fuzzy))
@@ -39,23 +39,30 @@ eventTaskExchange = Exchange(name='eventtask', type='direct', durable=True, deli
 eventTaskExchange(mqConn).declare()
 mqproducer = mqConn.Producer(serializer='json')
 
-# make an event
-event = dict()
-# best practice is to send an ISO formatted timestamp
-# so upstream can tell the source time zone
-event['timestamp'] = pytz.timezone('UTC').localize(datetime.utcnow()).isoformat()
-event['summary'] = 'just a test, only a test'
-event['category'] = 'testing'
-event['severity'] = 'INFO'
-event['processid'] = os.getpid()
-event['processname'] = sys.argv[0]
-event['tags'] = list()
-event['tags'].append('test')
-event['details'] = dict()
-event['details']['sourceipaddress'] = '1.2.3.4'
-
-
-# publish it to rabbit mq
+
+def makeEvent(summary):
+    event = dict()
+    # best practice is to send an ISO formatted timestamp
+    # so upstream can tell the source time zone
+    event['timestamp'] = pytz.timezone('UTC').localize(datetime.utcnow()).isoformat()
+    event['summary'] = summary
+    event['category'] = 'testing'
+    event['severity'] = 'INFO'
+    event['processid'] = os.getpid()
+    event['processname'] = sys.argv[0]
+    event['tags'] = list()
+    event['tags'].append('test')
+    event['details'] = dict()
+    event['details']['sourceipaddress'] = '1.2.3.4'
+    return event
+
+
+# publish an event to rabbit mq
 
 ensurePublish = mqConn.ensure(mqproducer, mqproducer.publish, max_retries=10)
-ensurePublish(event, exchange=eventTaskExchange, routing_key='eventtask')
+ensurePublish(makeEvent('just a test, only a test'), exchange=eventTaskExchange, routing_key='eventtask')
+
+# or, if you have lots of events, publish a list of them in one message (an envelope)
+# the esworker unpacks it and saves them as a batch, so rabbitmq only handles one message
+envelope = [makeEvent('just a test, only a test {0}'.format(num)) for num in range(100)]
+ensurePublish(envelope, exchange=eventTaskExchange, routing_key='eventtask')
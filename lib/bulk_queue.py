@@ -1,51 +1,196 @@
-from threading import Timer
+import time
+from Queue import Queue
+from threading import Timer, Condition, Thread
+
+from utilities.logger import logger
 
 
 class BulkQueue():
 
-    def __init__(self, es_client, threshold=10, flush_time=30):
+    def __init__(self, es_client, threshold=10, flush_time=30, byte_threshold=0, senders=0, max_in_flight=1):
         self.es_client = es_client
         self.threshold = threshold
+        # flush once the queued (already serialized) documents add up
+        # to this many bytes, 0 only flushes on the document threshold
+        self.byte_threshold = byte_threshold
         self.list = list()
+        self.bytes = 0
         self.flush_time = flush_time
         self.time_thread = Timer(self.flush_time, self.timer_over)
         self.running = False
+        # add() can be called from the consumer thread while the
+        # timer thread is flushing, so everything touching the list
+        # happens with this held
+        self.condition = Condition()
+        # how many bulk requests can be queued or being sent
+        # before add() has to wait for one to finish
+        self.max_in_flight = max(1, max_in_flight)
+        # every flush gets a generation number so callers can tell
+        # when the documents they added have been sent, list_generation
+        # is the oldest generation with documents still in self.list
+        self.generation = 0
+        self.list_generation = 0
+        self.in_flight = set()
+        # (when, attempt, generation, documents) ES was too busy for,
+        # resent by flush() once their backoff has passed, rather than
+        # anyone sleeping on them
+        self.retries = list()
+        # with senders, full queues are handed off to background
+        # threads so the caller can keep filling a new one,
+        # without, the caller sends them itself
+        self.senders = senders
+        self.send_queue = Queue()
+        for num in range(self.senders):
+            sender = Thread(target=self.sender_loop, name='bulk-sender-{0}'.format(num))
+            sender.daemon = True
+            sender.start()
 
     def timer_over(self):
-        self.flush()
-        self.time_thread = Timer(self.flush_time, self.timer_over)
-        self.start_timer()
+        try:
+            self.flush()
+        finally:
+            with self.condition:
+                # don't reschedule if we were stopped while flushing
+                if self.running:
+                    self.time_thread = Timer(self.flush_time, self.timer_over)
+                    self.start_timer()
 
     def start_timer(self):
         """ Start timer thread that flushes queue every X seconds """
-        self.time_thread.start()
-        self.running = True
+        with self.condition:
+            self.time_thread.start()
+            self.running = True
 
     def stop_timer(self):
         """ Stop timer thread """
-        self.time_thread.cancel()
-        self.running = False
+        with self.condition:
+            self.time_thread.cancel()
+            self.running = False
 
     def started(self):
         return self.running
 
     def add(self, index, doc_type, body, doc_id=None):
-        """ Add event to queue, flushing if we hit the threshold """
+        """ Add event to queue, flushing if we hit the threshold
+            blocks while a previous flush is still being sent
+            returns the generation the event will be flushed with
+        """
         bulk_doc = {
             "_index": index,
             "_type": doc_type,
             "_id": doc_id,
             "_source": body
         }
-        self.list.append(bulk_doc)
-        if self.size() >= self.threshold:
-            self.flush()
+        flush = None
+        with self.condition:
+            self.wait_for_flush()
+            self.list.append(bulk_doc)
+            generation = self.generation
+            if isinstance(body, basestring):
+                self.bytes += len(body)
+            if self.size() >= self.threshold or (self.byte_threshold and self.bytes >= self.byte_threshold):
+                flush = self.take_documents()
+        if flush:
+            self.dispatch(flush)
+        return generation
 
     def size(self):
         """ Size of the queue structure """
         return len(self.list)
 
     def flush(self):
-        """ Write all stored events to ES """
-        self.es_client.save_documents(self.list)
+        """ Write all stored events to ES, and any retries that are due """
+        with self.condition:
+            self.wait_for_flush()
+            flush = self.take_documents()
+        self.dispatch(flush)
+        self.resend_due()
+
+    def resend_due(self):
+        """ Resend the documents ES was too busy for whose backoff has passed """
+        while True:
+            with self.condition:
+                self.wait_for_flush()
+                now = time.time()
+                due = [retry for retry in self.retries if retry[0] <= now]
+                if not due:
+                    return
+                (when, attempt, generation, documents) = retry = min(due, key=lambda retry: retry[0])
+                self.retries.remove(retry)
+                self.in_flight.add(generation)
+            self.dispatch((generation, documents, attempt))
+
+    def confirmed(self):
+        """ The newest generation that, along with every one before it,
+            has been sent
+        """
+        with self.condition:
+            waiting = set(retry[2] for retry in self.retries)
+            return min(self.in_flight | waiting | set([self.list_generation])) - 1
+
+    def join(self):
+        """ Wait for every in flight flush to be sent """
+        with self.condition:
+            while self.in_flight:
+                self.condition.wait()
+
+    def wait_for_flush(self):
+        """ Wait for room for another in flight flush, must hold self.condition """
+        while len(self.in_flight) >= self.max_in_flight:
+            self.condition.wait()
+
+    def take_documents(self):
+        """ Empty the queue and mark a flush as in flight, must hold self.condition
+            returns the (generation, documents, attempt) to send
+        """
+        flush = (self.list_generation, self.list, 0)
         self.list = list()
+        self.bytes = 0
+        self.in_flight.add(self.list_generation)
+        self.generation += 1
+        self.list_generation = self.generation
+        return flush
+
+    def dispatch(self, flush):
+        """ Hand a flush to a sender thread, or send it ourselves """
+        if self.senders:
+            self.send_queue.put(flush)
+        else:
+            self.send_documents(flush)
+
+    def sender_loop(self):
+        while True:
+            flush = self.send_queue.get()
+            try:
+                self.send_documents(flush)
+            except Exception as e:
+                logger.error('Exception sending bulk documents: {0}'.format(e))
+
+    def send_documents(self, flush):
+        """ Send documents to ES without holding the lock,
+            then let anyone waiting on us continue
+            documents that could not be sent go back in the queue
+            to be resent with the next flush, so their generation
+            isn't confirmed. The error isn't raised, whoever added them
+            still has them queued and shouldn't send them again.
+            Documents ES was too busy for wait in self.retries
+        """
+        generation, documents, attempt = flush
+        sent = False
+        retry = None
+        try:
+            if documents:
+                retry = self.es_client.save_documents(documents, attempt)
+            sent = True
+        except Exception as e:
+            logger.error('Exception sending bulk documents, they will be resent with the next flush: {0}'.format(e))
+        finally:
+            with self.condition:
+                self.in_flight.discard(generation)
+                if not sent:
+                    self.list = documents + self.list
+                    self.bytes += sum(len(doc['_source']) for doc in documents if isinstance(doc['_source'], basestring))
+                    self.list_generation = min(self.list_generation, generation)
+                elif retry:
+                    self.retries.append((time.time() + self.es_client.retry_delay(attempt), attempt + 1, generation, retry))
+                self.condition.notify_all()
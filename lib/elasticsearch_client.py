@@ -1,14 +1,17 @@
 import json
+from datetime import datetime
+from threading import Lock
 
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search
 from elasticsearch.exceptions import NotFoundError
-from elasticsearch.helpers import bulk, BulkIndexError
+from elasticsearch.helpers import bulk, streaming_bulk
 
 from query_models import SearchQuery, TermMatch, AggregatedResults, SimpleResults
 from bulk_queue import BulkQueue
 
 from utilities.logger import logger, initLogger
+from utilities.toUTC import toUTC
 from event import Event
 
 
@@ -30,12 +33,29 @@ class ElasticsearchInvalidIndex(Exception):
         return "Invalid index: " + str(self.index_name)
 
 
+# bulk item statuses that mean the cluster is too busy right now,
+# rather than that the document itself is bad
+RETRYABLE_STATUSES = (429, 503)
+
+
 class ElasticsearchClient():
 
-    def __init__(self, servers, bulk_amount=100, bulk_refresh_time=30):
+    def __init__(self, servers, bulk_amount=100, bulk_refresh_time=30, bulk_bytes=0, bulk_senders=0, bulk_max_in_flight=1,
+                 bulk_retries=3, bulk_retry_backoff=1.0, dead_letter_index=None, dead_letter_file=None):
         self.es_connection = Elasticsearch(servers)
         self.es_connection.ping()
-        self.bulk_queue = BulkQueue(self, threshold=bulk_amount, flush_time=bulk_refresh_time)
+        self.bulk_retries = bulk_retries
+        self.bulk_retry_backoff = bulk_retry_backoff
+        self.dead_letter_index = dead_letter_index
+        self.dead_letter_file = dead_letter_file
+        self.dead_letter_lock = Lock()
+        self.bulk_queue = BulkQueue(
+            self,
+            threshold=bulk_amount,
+            flush_time=bulk_refresh_time,
+            byte_threshold=bulk_bytes,
+            senders=bulk_senders,
+            max_in_flight=bulk_max_in_flight)
         initLogger()
 
     def delete_index(self, index_name, ignore_fail=False):
@@ -105,11 +125,69 @@ class ElasticsearchClient():
         result_set = AggregatedResults(results)
         return result_set
 
-    def save_documents(self, documents):
-        try:
-            bulk(self.es_connection, documents)
-        except BulkIndexError as e:
-            logger.error("Error bulk indexing: " + str(e))
+    def save_documents(self, documents, attempt=0):
+        """ Bulk index documents, dead lettering the ones ES won't take
+            returns the ones ES rejected for being busy, for the bulk queue
+            to resend once retry_delay(attempt) has passed, until
+            bulk_retries attempts have been used up
+        """
+        retry_documents = []
+        failed_documents = []
+        # one result per document, in the order they were sent
+        results = streaming_bulk(self.es_connection, documents, raise_on_error=False)
+        for document, (ok, result) in zip(documents, results):
+            if ok:
+                continue
+            item = result.values()[0]
+            if item.get('status') in RETRYABLE_STATUSES and attempt < self.bulk_retries:
+                retry_documents.append(document)
+            else:
+                failed_documents.append((document, item))
+        if failed_documents:
+            self.dead_letter(failed_documents)
+        if retry_documents:
+            logger.warning('Elasticsearch rejected {0} bulk documents, retrying in {1} seconds'.format(len(retry_documents), self.retry_delay(attempt)))
+        return retry_documents
+
+    def retry_delay(self, attempt):
+        """ Seconds to wait before resending documents ES was too busy for, doubling each attempt """
+        return self.bulk_retry_backoff * (2 ** attempt)
+
+    def dead_letter(self, failures):
+        """ Record documents ES would not index, along with why,
+            in the dead letter index and/or file if configured
+        """
+        records = []
+        for document, item in failures:
+            error = item.get('error')
+            if not isinstance(error, basestring):
+                error = json.dumps(error)
+            logger.error('Error bulk indexing document into {0}: {1} {2}'.format(document.get('_index'), item.get('status'), error))
+            source = document.get('_source')
+            if not isinstance(source, basestring):
+                source = json.dumps(source)
+            records.append({
+                'utctimestamp': toUTC(datetime.now()).isoformat(),
+                'index': document.get('_index'),
+                'doc_type': document.get('_type'),
+                'doc_id': document.get('_id'),
+                'status': item.get('status'),
+                'error': error,
+                'document': source
+            })
+
+        if self.dead_letter_index:
+            actions = [{'_index': self.dead_letter_index, '_type': 'deadletter', '_source': record} for record in records]
+            success, errors = bulk(self.es_connection, actions, raise_on_error=False)
+            if errors:
+                logger.error('Error saving {0} documents to dead letter index {1}'.format(len(errors), self.dead_letter_index))
+
+        if self.dead_letter_file:
+            # sender threads can be dead lettering at the same time
+            with self.dead_letter_lock:
+                with open(self.dead_letter_file, 'a') as dead_letter_file:
+                    for record in records:
+                        dead_letter_file.write(json.dumps(record) + '\n')
 
     def start_bulk_timer(self):
         if not self.bulk_queue.started():
@@ -117,19 +195,34 @@ class ElasticsearchClient():
 
     def finish_bulk(self):
         self.bulk_queue.stop_timer()
+        self.bulk_queue.join()
+
+    def flush_bulk(self):
+        self.bulk_queue.flush()
+
+    def bulk_confirmed(self):
+        """ The newest bulk generation known to be written to ES,
+            compare with what the bulk save_* calls return
+        """
+        return self.bulk_queue.confirmed()
 
     def __bulk_save_document(self, index, doc_type, body, doc_id=None):
         self.start_bulk_timer()
-        self.bulk_queue.add(index=index, doc_type=doc_type, body=body, doc_id=doc_id)
+        # serialize the document here, once, the bulk helper
+        # passes already serialized strings through untouched
+        body = self.es_connection.transport.serializer.dumps(body)
+        return self.bulk_queue.add(index=index, doc_type=doc_type, body=body, doc_id=doc_id)
 
     def __save_document(self, index, doc_type, body, doc_id=None, bulk=False):
         if bulk:
-            self.__bulk_save_document(index=index, doc_type=doc_type, body=body, doc_id=doc_id)
+            return self.__bulk_save_document(index=index, doc_type=doc_type, body=body, doc_id=doc_id)
         else:
             return self.es_connection.index(index=index, doc_type=doc_type, id=doc_id, body=body)
 
     def __parse_document(self, body, doc_type):
-        if type(body) is str:
+        # documents can be handed to us as dicts (preferred)
+        # or as json strings, which we have to decode first
+        if isinstance(body, basestring):
             body = json.loads(body)
 
         if '_type' in body:
@@ -1,7 +1,6 @@
-from datetime import datetime
 import socket
 
-from utilities.toUTC import toUTC
+from utilities.utcNow import utcNow
 
 
 class Event(dict):
@@ -13,11 +12,11 @@ class Event(dict):
 
     def add_required_fields(self):
         if 'receivedtimestamp' not in self:
-            self['receivedtimestamp'] = toUTC(datetime.now()).isoformat()
+            self['receivedtimestamp'] = utcNow()
         if 'utctimestamp' not in self:
-            self['utctimestamp'] = toUTC(datetime.now()).isoformat()
+            self['utctimestamp'] = utcNow()
         if 'timestamp' not in self:
-            self['timestamp'] = toUTC(datetime.now()).isoformat()
+            self['timestamp'] = utcNow()
         if 'mozdefhostname' not in self:
             self['mozdefhostname'] = socket.gethostname()
         if 'tags' not in self:
@@ -1,14 +1,17 @@
 import os
 import pynsive
 from operator import itemgetter
-from utilities.dict2List import dict2List
+from utilities.token_set import TokenSet
 from utilities.logger import logger
+from plugin_stats import PluginStats
 
 
 class PluginSet(object):
     def __init__(self, plugin_location, enabled_plugins=None):
         self.plugin_location = plugin_location
         self.enabled_plugins = self.identify_plugins(enabled_plugins)
+        # how long each plugin takes, and how often it's sent or drops messages
+        self.stats = PluginStats()
 
     def identify_plugins(self, enabled_plugins):
         if not os.path.exists(self.plugin_location):
@@ -65,24 +68,27 @@ class PluginSet(object):
         if not isinstance(message, dict):
             raise TypeError('event is type {0}, should be a dict'.format(type(message)))
 
+        # flatten the message once, then only update the tokens
+        # a plugin changed after it has run
+        message_fields = TokenSet(message)
         for plugin in self.ordered_enabled_plugins:
             send = False
-            message_fields = [e for e in dict2List(message)]
-            # this is to make it so we can match on all fields
-            message_fields.append('*')
             if isinstance(plugin['registration'], list):
-                if set(plugin['registration']).intersection(message_fields):
+                # '*' lets a plugin match on all fields
+                if '*' in plugin['registration'] or message_fields.contains_any(plugin['registration']):
                     send = True
             elif isinstance(plugin['registration'], str):
-                if plugin['registration'] in message_fields:
+                if plugin['registration'] == '*' or plugin['registration'] in message_fields:
                     send = True
             if send:
                 try:
-                    (message, metadata) = self.send_message_to_plugin(plugin_class=plugin['plugin_class'], message=message, metadata=metadata)
+                    (message, metadata) = self.stats.call(plugin['plugin_class'], self.send_message_to_plugin, 1, plugin['plugin_class'], message, metadata)
                 except Exception as e:
                     logger.error('Received exception in {0}: message: {1}\n{2}'.format(plugin['plugin_class'], message, e.message))
                 if message is None:
+                    self.stats.dropped(plugin['plugin_class'])
                     return (message, metadata)
+                message_fields.update(message)
         return (message, metadata)
 
     def send_message_to_plugin(self, plugin_class, message, metadata=None):
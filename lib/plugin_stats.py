@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+from threading import Lock
+
+from utilities.utcNow import utcNow
+
+# upper bounds, in seconds, of the plugin call latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+class PluginStats(object):
+    '''per plugin counters: how many times each plugin was called,
+       how many events it was sent, dropped or raised on, the total time
+       spent in it and a histogram of how long each call took
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.plugins = dict()
+        self.started = time.time()
+
+    def plugin_name(self, plugin):
+        return plugin.__class__.__module__
+
+    def record(self, plugin, seconds, events=1, drops=0, exceptions=0):
+        name = self.plugin_name(plugin)
+        with self.lock:
+            stats = self.plugins.get(name)
+            if stats is None:
+                stats = self.plugins[name] = dict(
+                    invocations=0,
+                    events=0,
+                    drops=0,
+                    exceptions=0,
+                    seconds=0.0,
+                    histogram=[0] * (len(LATENCY_BUCKETS) + 1))
+            stats['invocations'] += 1
+            stats['events'] += events
+            stats['drops'] += drops
+            stats['exceptions'] += exceptions
+            stats['seconds'] += seconds
+            bucket = 0
+            while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+                bucket += 1
+            stats['histogram'][bucket] += 1
+
+    def call(self, plugin, function, events, *args):
+        '''call function(*args) on behalf of plugin, timing it
+           drops are counted by the caller once it sees the results
+        '''
+        started = time.time()
+        try:
+            result = function(*args)
+        except Exception:
+            self.record(plugin, time.time() - started, events, exceptions=1)
+            raise
+        self.record(plugin, time.time() - started, events)
+        return result
+
+    def dropped(self, plugin, drops=1):
+        name = self.plugin_name(plugin)
+        with self.lock:
+            if name in self.plugins:
+                self.plugins[name]['drops'] += drops
+
+    def snapshot(self, reset=False):
+        '''the stats so far, slowest plugin first'''
+        with self.lock:
+            plugins = dict(
+                (name, dict(stats, histogram=list(stats['histogram'])))
+                for name, stats in self.plugins.iteritems())
+            started = self.started
+            if reset:
+                self.plugins = dict()
+                self.started = time.time()
+        results = list()
+        for name, stats in plugins.iteritems():
+            result = dict(stats, plugin=name)
+            result['averagems'] = stats['seconds'] * 1000 / max(stats['invocations'], 1)
+            result['histogram'] = [
+                dict(le=str(bucket), count=count)
+                for bucket, count in zip(LATENCY_BUCKETS + ('+Inf',), stats['histogram'])]
+            results.append(result)
+        results.sort(key=lambda result: result['seconds'], reverse=True)
+        return dict(seconds=time.time() - started, plugins=results)
+
+    def due(self, interval):
+        '''whether interval seconds have passed since the stats were last reset
+           for workers to check from their loop, an interval of 0 is never due
+        '''
+        with self.lock:
+            return bool(interval) and time.time() - self.started >= interval
+
+    def to_event(self, hostname, reset=True):
+        '''a mozdefstats event of the stats since the last one'''
+        stats = dict(
+            utctimestamp=utcNow(),
+            summary='Plugin timings',
+            category='pluginstats',
+            hostname=hostname,
+            processid=os.getpid(),
+            processname=sys.argv[0],
+            tags=['mozdef', 'pluginstats'],
+            details=self.snapshot(reset))
+        return stats
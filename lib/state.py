@@ -1,4 +1,5 @@
 import json
+import os
 
 
 class StateParsingError(ValueError):
@@ -24,5 +25,9 @@ class State:
 
     def save(self):
         '''Write the self.data value into the state file'''
-        with open(self.filename, 'w') as f:
+        # write alongside and rename over it, so a crash mid write
+        # leaves the last state rather than half of one
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
             json.dump(self.data, f, sort_keys=True, indent=4, separators=(',', ': '))
+        os.rename(tmp_filename, self.filename)
@@ -1,5 +1,6 @@
 from .dict2List import dict2List
 from .toUTC import toUTC
+from .utcNow import utcNow
 from .logger import logger
 
-__all__ = ['dict2List', 'toUTC', 'logger']
+__all__ = ['dict2List', 'toUTC', 'utcNow', 'logger']
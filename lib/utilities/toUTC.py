@@ -1,16 +1,109 @@
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from dateutil.parser import parse
+from threading import Lock
 import pytz
 import math
+import re
 import tzlocal
 
 LOCAL_TIMEZONE = tzlocal.get_localzone()
 
+# the RFC3339/ISO-8601 shapes most shippers send us
+# i.e. 2016-07-13T14:33:31.625443Z, 2016-07-13 14:33:31-08:00
+ISO8601_DATE = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?(Z|z|[+-]\d{2}:?\d{2})?$')
+
+# the year-less syslog shape, i.e. Oct 27 14:01:12, Oct  7 14:01:12
+SYSLOG_DATE = re.compile(r'^([A-Za-z]{3}) +(\d{1,2}) (\d{2}):(\d{2}):(\d{2})$')
+MONTHS = dict((month, number + 1) for number, month in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']))
+
+
+class LRUCache(object):
+    '''a small least recently used cache'''
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return None
+            self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+# batches of events tend to share (second resolution) timestamps
+# strict ISO-8601 parses are cached by the string, syslog ones like "Oct 27 14:01:12"
+# by (year, string) as the year comes from when they're parsed.
+# Anything else is fuzzy parsed every time
+DATE_STRING_CACHE = LRUCache(1024)
+
+
+def thisYear():
+    '''the year dateutil fills in for dates without one'''
+    return datetime.now().year
+
+
+def parseISO8601(dateString):
+    '''strictly parse the common ISO-8601 shapes
+       returns None for anything else, so it can be parsed the slow way
+    '''
+    match = ISO8601_DATE.match(dateString)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    microsecond = 0
+    if fraction:
+        microsecond = int(fraction.ljust(6, '0'))
+    try:
+        objDate = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond)
+    except ValueError:
+        # leap seconds and the like
+        return None
+    if offset is None:
+        return LOCAL_TIMEZONE.localize(objDate)
+    if offset in ('Z', 'z'):
+        return objDate.replace(tzinfo=pytz.UTC)
+    offsetMinutes = int(offset[1:3]) * 60 + int(offset[-2:])
+    if offset[0] == '-':
+        offsetMinutes = -offsetMinutes
+    return (objDate - timedelta(minutes=offsetMinutes)).replace(tzinfo=pytz.UTC)
+
+
+def parseSyslog(match, year):
+    '''the datetime for a SYSLOG_DATE match in year, as dateutil would parse it
+       returns None for anything else, so it can be parsed the slow way
+    '''
+    month, day, hour, minute, second = match.groups()
+    month = MONTHS.get(month.lower())
+    if month is None:
+        return None
+    try:
+        objDate = datetime(year, month, int(day), int(hour), int(minute), int(second))
+    except ValueError:
+        # Feb 29 outside a leap year and the like
+        return None
+    return LOCAL_TIMEZONE.localize(objDate)
+
 
 def toUTC(suspectedDate):
     '''make a UTC date out of almost anything'''
     utc=pytz.UTC
     objDate=None
+    cacheKey=None
     if type(suspectedDate) == datetime:
         objDate = suspectedDate
     elif type(suspectedDate) == float:
@@ -23,9 +116,25 @@ def toUTC(suspectedDate):
     elif str(suspectedDate).isdigit():
         # epoch? but seconds/milliseconds/nanoseconds (lookin at you heka)
         epochDivisor = int(str(1) + '0'*(len(str(suspectedDate)) % 10))
-        objDate = datetime.fromtimestamp(float(suspectedDate/epochDivisor), LOCAL_TIMEZONE)
+        objDate = datetime.fromtimestamp(float(int(suspectedDate)/epochDivisor), LOCAL_TIMEZONE)
     elif type(suspectedDate) in (str, unicode):
-        objDate = parse(suspectedDate, fuzzy=True)
+        syslogMatch = SYSLOG_DATE.match(suspectedDate)
+        if syslogMatch is not None:
+            year = thisYear()
+            cacheKey = (year, suspectedDate)
+        else:
+            cacheKey = suspectedDate
+        cached = DATE_STRING_CACHE.get(cacheKey)
+        if cached is not None:
+            return cached
+        # only fall back to fuzzy parsing when the strict parses can't cope
+        if syslogMatch is not None:
+            objDate = parseSyslog(syslogMatch, year)
+        else:
+            objDate = parseISO8601(suspectedDate)
+        if objDate is None:
+            objDate = parse(suspectedDate, fuzzy=True)
+            cacheKey = None
     try:
         if objDate.tzinfo is None:
             objDate=LOCAL_TIMEZONE.localize(objDate)
@@ -34,6 +143,9 @@ def toUTC(suspectedDate):
             "Date %s which was converted to %s has no "
             "tzinfo attribute : %s" % (suspectedDate, objDate, e))
 
-    objDate=utc.normalize(objDate)
+    if objDate.tzinfo is not utc:
+        objDate=utc.normalize(objDate)
 
+    if cacheKey is not None:
+        DATE_STRING_CACHE.set(cacheKey, objDate)
     return objDate
@@ -0,0 +1,187 @@
+import copy
+
+from dict2List import dict2List
+
+
+def leafTokens(key, value):
+    '''the tokens dict2List yields for a single key/value pair
+       whose value is not itself a dict
+    '''
+    tokens = [key.encode('ascii', 'ignore').lower()]
+    if isinstance(value, list):
+        tokens.extend(dict2List(value))
+    elif isinstance(value, str):
+        tokens.append(value.lower())
+    elif isinstance(value, unicode):
+        tokens.append(value.encode('ascii', 'ignore').lower())
+    else:
+        tokens.append(value)
+    return tokens
+
+
+class TrackedDict(dict):
+    '''a dict that remembers which of its keys were set or deleted'''
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.touched = set()
+
+    def __setitem__(self, key, value):
+        self.touched.add(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.touched.add(key)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        self.touched.add(key)
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        (key, value) = dict.popitem(self)
+        self.touched.add(key)
+        return (key, value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.touched.add(key)
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def clear(self):
+        self.touched.update(self.keys())
+        dict.clear(self)
+
+    def __reduce__(self):
+        # copies and pickles start out as untouched
+        return (TrackedDict, (dict(self),))
+
+
+class TokenSet(object):
+    '''the flattened keys and values of a message (the same tokens
+       dict2List produces) kept as a live set.
+       Dicts nested in the message are swapped for TrackedDicts in place,
+       so update() only re-tokenizes the keys set or deleted since last time,
+       top level keys whose value was replaced and lists changed in place.
+    '''
+
+    def __init__(self, message):
+        self.counts = dict()
+        self.message = None
+        self.update(message)
+
+    def __contains__(self, token):
+        return token in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def contains_any(self, tokens):
+        for token in tokens:
+            if token in self.counts:
+                return True
+        return False
+
+    def update(self, message):
+        '''pick up the changes made to message'''
+        if message is not self.message:
+            # a new message, or a plugin built another one, start over
+            self.counts = dict()
+            # dict path: the TrackedDict there
+            self.nodes = dict()
+            # dict path: {key: tokens} for its non dict values
+            self.leaves = dict()
+            # (dict path, key): a copy of a list to compare against
+            self.lists = dict()
+            # the top level values, the message itself isn't tracked
+            self.values = dict()
+            self.message = message
+            self._add_node((), message)
+            return
+        # parents first, so we skip dicts a parent replaced
+        for path in sorted(self.nodes, key=len):
+            node = self.nodes.get(path)
+            if node is None:
+                continue
+            for key in self._touched(path, node):
+                self._replace(path, node, key)
+        # lists can be modified in place without the dict seeing it
+        for (path, key), previous in self.lists.items():
+            node = self.nodes.get(path)
+            if node is None or self.lists.get((path, key)) is not previous:
+                continue
+            value = node.get(key)
+            if type(value) is list and value == previous:
+                continue
+            self._replace(path, node, key)
+
+    def _touched(self, path, node):
+        '''the keys of node set or deleted since we last looked'''
+        if isinstance(node, TrackedDict):
+            keys = node.touched
+            node.touched = set()
+            return keys
+        # only the top level can be a plain dict, compare its values by identity
+        keys = set(key for key in node if key not in self.values)
+        keys.update(key for key, value in self.values.iteritems() if key not in node or node[key] is not value)
+        return keys
+
+    def _replace(self, path, node, key):
+        self._remove(path, key)
+        if key in node:
+            self._add(path, node, key, node[key])
+
+    def _add_node(self, path, node):
+        self.nodes[path] = node
+        self.leaves[path] = dict()
+        if isinstance(node, TrackedDict):
+            node.touched = set()
+        for key, value in node.items():
+            self._add(path, node, key, value)
+
+    def _add(self, path, node, key, value):
+        if isinstance(value, dict) and not isinstance(value, TrackedDict):
+            value = TrackedDict(value)
+            dict.__setitem__(node, key, value)
+        if not path:
+            self.values[key] = value
+        if isinstance(value, dict):
+            # dict2List doesn't emit the keys of nested dicts
+            self._add_node(path + (key,), value)
+            return
+        tokens = leafTokens(key, value)
+        for token in tokens:
+            self.counts[token] = self.counts.get(token, 0) + 1
+        self.leaves[path][key] = tokens
+        if isinstance(value, list):
+            self.lists[(path, key)] = copy.deepcopy(value)
+
+    def _remove(self, path, key):
+        if not path:
+            self.values.pop(key, None)
+        tokens = self.leaves[path].pop(key, None)
+        if tokens is not None:
+            self._discard(tokens)
+        self.lists.pop((path, key), None)
+        child = path + (key,)
+        for nodepath in [nodepath for nodepath in self.nodes if nodepath[:len(child)] == child]:
+            del self.nodes[nodepath]
+            for tokens in self.leaves.pop(nodepath).itervalues():
+                self._discard(tokens)
+        for listpath in [listpath for listpath in self.lists if listpath[0][:len(child)] == child]:
+            del self.lists[listpath]
+
+    def _discard(self, tokens):
+        for token in tokens:
+            remaining = self.counts[token] - 1
+            if remaining:
+                self.counts[token] = remaining
+            else:
+                del self.counts[token]
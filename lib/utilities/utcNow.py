@@ -0,0 +1,32 @@
+from datetime import datetime
+import pytz
+import time
+
+# how long (in seconds) a timestamp is reused before we make a new one
+TICK = 0.001
+
+# (tick number, iso string) swapped in as one object so threads
+# never see a string from one tick paired with another
+_lastNow = (None, None)
+
+
+def setTick(seconds):
+    '''change how often utcNow makes a new timestamp'''
+    global TICK, _lastNow
+    TICK = seconds
+    _lastNow = (None, None)
+
+
+def utcNow():
+    '''the current UTC time as an ISO-8601 string, the same as
+       toUTC(datetime.now()).isoformat() but only worked out once per tick
+    '''
+    global _lastNow
+    now = time.time()
+    tick = int(now / TICK)
+    lastTick, lastIso = _lastNow
+    if tick == lastTick:
+        return lastIso
+    iso = datetime.fromtimestamp(now, pytz.UTC).isoformat()
+    _lastNow = (tick, iso)
+    return iso
@@ -0,0 +1,127 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+import zlib
+
+# zstd is optional, pip install zstandard to accept it
+try:
+    import zstandard
+    hasZstd = True
+except ImportError as e:
+    hasZstd = False
+
+# how much to read from the request at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class DecompressionError(Exception):
+    status = 400
+
+
+class UnsupportedEncoding(DecompressionError):
+    status = 415
+
+
+class BodyTooLarge(DecompressionError):
+    status = 413
+
+
+class ZlibReader(object):
+    '''decompresses gzip/deflate from body a bounded amount at a time'''
+
+    def __init__(self, body, wbits):
+        self.body = body
+        self.wbits = wbits
+        self.decompressor = zlib.decompressobj(wbits)
+        self.pending = ''
+        self.finished = False
+
+    def read(self, size):
+        try:
+            while not self.finished:
+                if not self.pending:
+                    self.pending = self.body.read(CHUNK_SIZE)
+                    if not self.pending:
+                        self.finished = True
+                        return self.decompressor.flush()
+                data = self.decompressor.decompress(self.pending, size)
+                self.pending = self.decompressor.unconsumed_tail
+                if not self.pending and self.decompressor.unused_data:
+                    # concatenated gzip members pick up where the last one finished
+                    self.pending = self.decompressor.unused_data
+                    self.decompressor = zlib.decompressobj(self.wbits)
+                if data:
+                    return data
+        except zlib.error as e:
+            raise DecompressionError('invalid compressed body: {0}'.format(e))
+        return ''
+
+
+class ZstdReader(object):
+
+    def __init__(self, body):
+        self.reader = zstandard.ZstdDecompressor().stream_reader(body)
+
+    def read(self, size):
+        try:
+            return self.reader.read(size)
+        except zstandard.ZstdError as e:
+            raise DecompressionError('invalid compressed body: {0}'.format(e))
+
+
+class LimitedReader(object):
+    '''a file like view of a decompressing reader, that gives up
+       once more than maxSize bytes have come out of it
+    '''
+
+    def __init__(self, reader, maxSize):
+        self.reader = reader
+        self.maxSize = maxSize
+        self.size = 0
+
+    def read(self, size=-1):
+        if size is not None and size >= 0:
+            data = self.reader.read(size)
+            self.size += len(data)
+            if self.size > self.maxSize:
+                raise BodyTooLarge('body is over {0} bytes decompressed'.format(self.maxSize))
+            return data
+        chunks = []
+        while True:
+            data = self.read(CHUNK_SIZE)
+            if not data:
+                return ''.join(chunks)
+            chunks.append(data)
+
+    def __iter__(self):
+        '''the decompressed body line by line'''
+        buffered = ''
+        while True:
+            data = self.read(CHUNK_SIZE)
+            if not data:
+                break
+            lines = (buffered + data).split('\n')
+            buffered = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if buffered:
+            yield buffered
+
+
+def decompressedBody(body, encoding, maxSize):
+    '''body, decompressed as it's read according to its Content-Encoding'''
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return body
+    if encoding in ('gzip', 'x-gzip'):
+        reader = ZlibReader(body, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        reader = ZlibReader(body, zlib.MAX_WBITS)
+    elif encoding == 'zstd' and hasZstd:
+        reader = ZstdReader(body)
+    else:
+        raise UnsupportedEncoding('unsupported content encoding {0}'.format(encoding))
+    return LimitedReader(reader, maxSize)
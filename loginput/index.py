@@ -15,7 +15,11 @@ from bottle import _stdout as bottlelog
 import kombu
 from kombu import Connection,Queue,Exchange
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from configlib import getConfig,OptionParser
+from spool import Spool, SpoolDrainer
+from decompress import decompressedBody, DecompressionError
 
 
 @route('/status')
@@ -27,7 +31,10 @@ def status():
         request.body.close()
     response.status = 200
     response.content_type = "application/json"
-    response.body = json.dumps(dict(status='ok'))
+    status = dict(status='ok')
+    if spool is not None:
+        status['spool'] = spool.status()
+    response.body = json.dumps(status)
     return response
 
 @route('/test')
@@ -37,35 +44,177 @@ def testindex():
     #response.headers['X-IP'] = '{0}'.format(ip)
     response.status=200
 
+def requestBody():
+    '''the request body, decompressed as it's read if the shipper compressed it'''
+    return decompressedBody(request.body, request.headers.get('Content-Encoding'), options.maxbodysize)
+
+
+def decompressionFailed(e):
+    bottlelog('error reading request body: {0}\n'.format(e))
+    response.status = e.status
+    response.content_type = "application/json"
+    response.body = json.dumps(dict(error=str(e)))
+    return response
+
+
+def packEvents(events):
+    '''the message bodies to send events as, envelopes (lists) of up to
+       options.eventspermessage events, and lone events as themselves
+    '''
+    if options.eventspermessage <= 1:
+        return events
+    bodies = []
+    for start in range(0, len(events), options.eventspermessage):
+        envelope = events[start:start + options.eventspermessage]
+        if len(envelope) == 1:
+            envelope = envelope[0]
+        bodies.append(envelope)
+    return bodies
+
+
+def publishBatch(events):
+    '''publish a batch of events to the event task exchange'''
+    for body in packEvents(events):
+        mqproducer.publish(body, exchange=eventTaskExchange, routing_key=options.taskexchange)
+
+
+def sendEvents(events):
+    '''publish events straight to rabbitmq
+       index_gevent.py swaps this out for its own publisher
+    '''
+    ensurePublishBatch(events)
+
+
+def publishEvents(events):
+    '''queue events for the esworkers, raising if we can't
+       with a spool configured, events go to disk instead while rabbitmq
+       is down, slower than options.spoolbudget or still catching up on
+       what was spooled earlier.
+       The publish runs on publishExecutor so a stalled broker can't hold
+       the request past the budget, if it's still going when the budget
+       runs out the events are spooled anyway, so they may be
+       delivered twice but never lost
+    '''
+    if spool is None:
+        sendEvents(events)
+        return
+    if not spool.spooling:
+        publish = publishExecutor.submit(sendEvents, events)
+        try:
+            publish.result(timeout=options.spoolbudget)
+            return
+        except TimeoutError:
+            # if it never got started it won't be published at all
+            publish.cancel()
+            bottlelog('publishing took over {0}s, spooling until rabbitmq catches up\n'.format(options.spoolbudget))
+            spool.startSpooling()
+        except Exception as e:
+            bottlelog('error publishing {0} events, spooling them: {1}\n'.format(len(events), e))
+    spool.append(events)
+
+
+def spoolPublisher():
+    '''publish spooled events on a connection of the drainer's own'''
+    spoolConn = Connection(connString)
+    spoolProducer = spoolConn.Producer(serializer=options.mqserializer)
+
+    def publishSpooled(events):
+        for body in packEvents(events):
+            spoolProducer.publish(body, exchange=eventTaskExchange, routing_key=options.taskexchange)
+
+    return spoolConn.ensure(spoolProducer, publishSpooled, max_retries=10)
+
+
+def publishLines(lines, endpoint=None, skipActions=False):
+    '''parse newline delimited json events one line at a time,
+       publishing them in batches of options.batchsize
+       returns an elastic search style list of per line results
+    '''
+    items = []
+    batch = []
+    batchItems = []
+
+    def flush():
+        try:
+            publishEvents(batch)
+        except Exception as e:
+            bottlelog('error publishing {0} events: {1}\n'.format(len(batch), e))
+            for item in batchItems:
+                item['index'] = {'status': 503, 'error': 'unable to queue event'}
+        del batch[:]
+        del batchItems[:]
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            eventDict = json.loads(line)
+        except ValueError as e:
+            items.append({'index': {'status': 400, 'error': 'invalid json: {0}'.format(e)}})
+            continue
+        if not isinstance(eventDict, dict):
+            items.append({'index': {'status': 400, 'error': 'not a json object'}})
+            continue
+        if skipActions and 'index' in eventDict:
+            # don't post the items telling us where to post things..
+            continue
+        if endpoint is not None:
+            # let the message queue worker who gets this know where it was posted
+            eventDict['endpoint'] = endpoint
+        item = {'index': {'status': 201}}
+        items.append(item)
+        batch.append(eventDict)
+        batchItems.append(item)
+        if len(batch) >= options.batchsize:
+            flush()
+    if batch:
+        flush()
+    return items
+
+
+def batchResponse(items, started):
+    '''respond like elastic search does to a bulk request'''
+    response.status = 200
+    response.content_type = "application/json"
+    response.body = json.dumps(dict(
+        took=int((time.time() - started) * 1000),
+        errors=any(item['index']['status'] >= 300 for item in items),
+        items=items))
+    return response
+
+
 #act like elastic search bulk index
 @route('/_bulk',method='POST')
 @route('/_bulk/',method='POST')
 def bulkindex():
+    started = time.time()
+    items = []
     if request.body:
-        bulkpost=request.body.read()
-        #bottlelog('request:{0}\n'.format(bulkpost))
-        request.body.close()
-        if len(bulkpost)>10: #TODO Check for bulk format.
-            #iterate on messages and post to event message queue
-
-            eventlist=[]
-            for i in bulkpost.splitlines():
-                eventlist.append(i)
-
-            for i in eventlist:
-                try:
-                    #valid json?
-                    try:
-                        eventDict=json.loads(i)
-                    except ValueError as e:
-                        response.status=500
-                        return
-                    if not 'index' in json.loads(i).keys(): #don't post the items telling us where to post things..
-                        ensurePublish=mqConn.ensure(mqproducer,mqproducer.publish,max_retries=10)
-                        ensurePublish(eventDict,exchange=eventTaskExchange,routing_key=options.taskexchange)
-                except ValueError:
-                    bottlelog('value error {0}'.format(i))
-    return
+        # iterate the body line by line rather than reading it all in
+        try:
+            items = publishLines(requestBody(), skipActions=True)
+        except DecompressionError as e:
+            return decompressionFailed(e)
+        finally:
+            request.body.close()
+    return batchResponse(items, started)
+
+
+@route('/events/_batch', method=['POST','PUT'])
+@route('/events/_batch/', method=['POST','PUT'])
+def eventsbatch():
+    '''newline delimited json events, like /events but many at a time'''
+    started = time.time()
+    items = []
+    if request.body:
+        try:
+            items = publishLines(requestBody(), endpoint='events')
+        except DecompressionError as e:
+            return decompressionFailed(e)
+        finally:
+            request.body.close()
+    return batchResponse(items, started)
 
 @route('/_status')
 @route('/_status/')
@@ -75,9 +224,13 @@ def bulkindex():
 @route('/events', method=['POST','PUT'])
 def eventsindex():
     if request.body:
-        anevent=request.body.read()
+        try:
+            anevent=requestBody().read()
+        except DecompressionError as e:
+            return decompressionFailed(e)
+        finally:
+            request.body.close()
         #bottlelog('request:{0}\n'.format(anevent))
-        request.body.close()
         #valid json?
         try:
             eventDict=json.loads(anevent)
@@ -87,8 +240,7 @@ def eventsindex():
         #let the message queue worker who gets this know where it was posted
         eventDict['endpoint']='events'
         #post to event message queue
-        ensurePublish=mqConn.ensure(mqproducer,mqproducer.publish,max_retries=10)
-        ensurePublish(eventDict,exchange=eventTaskExchange,routing_key=options.taskexchange)
+        publishEvents([eventDict])
 
     return
 
@@ -97,8 +249,12 @@ def eventsindex():
 #debug(True)
 def cefindex():
     if request.body:
-        anevent=request.body.read()
-        request.body.close()
+        try:
+            anevent=requestBody().read()
+        except DecompressionError as e:
+            return decompressionFailed(e)
+        finally:
+            request.body.close()
         #valid json?
         try:
             cefDict=json.loads(anevent)
@@ -109,8 +265,7 @@ def cefindex():
         cefDict['endpoint']='cef'
 
         #post to eventtask exchange
-        ensurePublish=mqConn.ensure(mqproducer,mqproducer.publish,max_retries=10)
-        ensurePublish(cefDict,exchange=eventTaskExchange,routing_key=options.taskexchange)
+        publishEvents([cefDict])
     return
 
 @route('/custom/<application>',method=['POST','PUT'])
@@ -124,8 +279,12 @@ def customindex(application):
         to the esworker.py process.
     '''
     if request.body:
-        anevent=request.body.read()
-        request.body.close()
+        try:
+            anevent=requestBody().read()
+        except DecompressionError as e:
+            return decompressionFailed(e)
+        finally:
+            request.body.close()
         #valid json?
         try:
             customDict=json.loads(anevent)
@@ -137,8 +296,7 @@ def customindex(application):
         customDict['customendpoint'] = True
 
         #post to eventtask exchange
-        ensurePublish=mqConn.ensure(mqproducer,mqproducer.publish,max_retries=10)
-        ensurePublish(customDict,exchange=eventTaskExchange,routing_key=options.taskexchange)
+        publishEvents([customDict])
     return
 
 
@@ -148,7 +306,26 @@ def initConfig():
     options.mquser=getConfig('mquser','guest',options.configfile)
     options.mqpassword=getConfig('mqpassword','guest',options.configfile)
     options.mqport=getConfig('mqport',5672,options.configfile)
+    # amqp, or memory to use kombu's in process transport (see benchmarking/pipeline)
+    options.mqprotocol=getConfig('mqprotocol', 'amqp', options.configfile)
     options.listen_host=getConfig('listen_host', '127.0.0.1', options.configfile)
+    # how many events from a _bulk or _batch post to publish at a time
+    options.batchsize=getConfig('batchsize', 100, options.configfile)
+    # json or msgpack, the esworkers accept either
+    options.mqserializer=getConfig('mqserializer', 'json', options.configfile)
+    # publish events from bulk posts in envelopes (lists) of up to this many per message
+    # 1 publishes each event on its own, only raise it once every esworker
+    # reading the task queue unpacks envelopes (see docs/source/advanced_settings.rst)
+    options.eventspermessage=getConfig('eventspermessage', 1, options.configfile)
+    # largest request body we'll decompress, in bytes
+    options.maxbodysize=getConfig('maxbodysize', 100 * 1024 * 1024, options.configfile)
+    # directory to spool events to when rabbitmq is slow or down, blank to disable
+    options.spooldir=getConfig('spooldir', '', options.configfile)
+    # spool segment file size in bytes
+    options.spoolsegmentsize=getConfig('spoolsegmentsize', 64 * 1024 * 1024, options.configfile)
+    # secs a request waits on a publish before spooling its events and
+    # everything after them until rabbitmq catches up
+    options.spoolbudget=getConfig('spoolbudget', 0.5, options.configfile)
 
 
 #get config info:
@@ -159,13 +336,31 @@ initConfig()
 
 #connect and declare the message queue/kombu objects.
 connString='amqp://{0}:{1}@{2}:{3}//'.format(options.mquser,options.mqpassword,options.mqserver,options.mqport)
+if options.mqprotocol == 'memory':
+    # kombu's in process transport, for benchmarking
+    connString='memory://'
 mqConn=Connection(connString)
 
 eventTaskExchange=Exchange(name=options.taskexchange,type='direct',durable=True)
 eventTaskExchange(mqConn).declare()
 eventTaskQueue=Queue(options.taskexchange,exchange=eventTaskExchange)
 eventTaskQueue(mqConn).declare()
-mqproducer = mqConn.Producer(serializer='json')
+mqproducer = mqConn.Producer(serializer=options.mqserializer)
+
+spool = None
+publishExecutor = None
+publishRetries = 10
+if options.spooldir:
+    spool = Spool(options.spooldir, options.spoolsegmentsize)
+    SpoolDrainer(spool, spoolPublisher(), options.batchsize).start()
+    # requests wait on publishes made from here, for no longer than options.spoolbudget
+    publishExecutor = ThreadPoolExecutor(max_workers=1)
+    # fail fast and spool rather than keep the shipper waiting
+    publishRetries = 1
+
+# wrap publishing once, rather than per event, to recover from connection drops
+# a batch that fails part way through is published again in full
+ensurePublishBatch=mqConn.ensure(mqproducer,publishBatch,max_retries=publishRetries)
 
 if __name__ == "__main__":
     run(host=options.listen_host, port=8080)
@@ -0,0 +1,48 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+# gevent flavour of loginput: the same routes as index.py, but requests
+# are greenlets so one process can hold thousands of keep-alive
+# connections from shippers, and publishing goes through a single
+# persistent channel with pipelined publisher confirms (see publisher.py)
+# instead of every request blocking on its own publish.
+# run it with loginput_gevent.ini, or python index_gevent.py -c index.conf
+
+if __name__ == "__main__":
+    # under uwsgi, gevent-monkey-patch does this for us
+    from gevent import monkey
+    monkey.patch_all()
+
+import os
+import sys
+from bottle import run
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import index
+from publisher import ConfirmingPublisher
+from configlib import getConfig
+
+
+options = index.options
+# how many events to publish before waiting for their confirms
+options.confirmwindow = getConfig('confirmwindow', 1000, options.configfile)
+# secs to wait on the broker before reconnecting
+options.confirmtimeout = getConfig('confirmtimeout', 10, options.configfile)
+
+publisher = ConfirmingPublisher(
+    index.connString,
+    index.eventTaskExchange,
+    options.taskexchange,
+    pack=index.packEvents,
+    serializer=options.mqserializer,
+    window=options.confirmwindow,
+    timeout=options.confirmtimeout)
+publisher.start()
+index.sendEvents = publisher.publish
+
+application = index.application
+
+if __name__ == "__main__":
+    run(application, server='gevent', host=options.listen_host, port=8080)
@@ -0,0 +1,142 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+import gevent
+from gevent.event import AsyncResult
+from gevent.queue import Queue, Empty
+from bottle import _stdout as bottlelog
+from kombu import Connection, Producer
+
+
+class ConfirmTracker(object):
+    '''keeps track of which delivery tags the broker has confirmed'''
+
+    def __init__(self):
+        self.unconfirmed = set()
+        self.failed = set()
+
+    def add(self, tag):
+        self.unconfirmed.add(tag)
+
+    def ack(self, tag, multiple):
+        if multiple:
+            self.unconfirmed = set(pending for pending in self.unconfirmed if pending > tag)
+        else:
+            self.unconfirmed.discard(tag)
+
+    def nack(self, tag, multiple, requeue=False):
+        if multiple:
+            self.failed.update(pending for pending in self.unconfirmed if pending <= tag)
+        elif tag in self.unconfirmed:
+            self.failed.add(tag)
+        self.ack(tag, multiple)
+
+    def confirmed(self, tags):
+        '''were all these tags acked'''
+        return not any(tag in self.unconfirmed or tag in self.failed for tag in tags)
+
+
+class ConfirmingPublisher(object):
+    '''publishes events from one greenlet on one persistent channel,
+       sending everything requests have queued up, then waiting for the
+       broker to confirm it all, rather than a round trip per event
+    '''
+
+    def __init__(self, connString, exchange, routingKey, pack=None, serializer='json', window=1000, timeout=10, retries=10):
+        self.connString = connString
+        self.exchange = exchange
+        self.routingKey = routingKey
+        # turns a list of events into message bodies
+        self.pack = pack or (lambda events: events)
+        self.serializer = serializer
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.requests = Queue()
+        self.connection = None
+
+    def connect(self):
+        if self.connection is not None:
+            try:
+                self.connection.release()
+            except Exception:
+                pass
+        self.connection = Connection(self.connString)
+        self.channel = self.connection.channel()
+        self.channel.confirm_select()
+        self.tracker = ConfirmTracker()
+        self.channel.events['basic_ack'].add(self.tracker.ack)
+        self.channel.events['basic_nack'].add(self.tracker.nack)
+        self.producer = Producer(self.channel, serializer=self.serializer)
+        # delivery tags are numbered per channel from 1
+        self.lastTag = 0
+
+    def publish(self, events):
+        '''called from request greenlets, returns once the events are confirmed'''
+        result = AsyncResult()
+        self.requests.put((events, result))
+        try:
+            result.get(timeout=self.timeout * (self.retries + 1))
+        except gevent.Timeout:
+            raise Exception('timed out waiting for the broker')
+
+    def nextRequests(self):
+        '''block for one request, then take whatever else is waiting'''
+        pending = [self.requests.get()]
+        count = len(pending[0][0])
+        while count < self.window:
+            try:
+                request = self.requests.get_nowait()
+            except Empty:
+                break
+            pending.append(request)
+            count += len(request[0])
+        return pending
+
+    def send(self, pending):
+        '''publish everything pending, then wait for the broker to confirm it
+           returns the tags used for each request
+        '''
+        requestTags = []
+        for (events, result) in pending:
+            tags = []
+            for body in self.pack(events):
+                self.producer.publish(body, exchange=self.exchange, routing_key=self.routingKey)
+                self.lastTag += 1
+                self.tracker.add(self.lastTag)
+                tags.append(self.lastTag)
+            requestTags.append(tags)
+        while self.tracker.unconfirmed:
+            self.connection.drain_events(timeout=self.timeout)
+        return requestTags
+
+    def run(self):
+        while True:
+            pending = self.nextRequests()
+            for attempt in range(self.retries + 1):
+                try:
+                    if self.connection is None:
+                        self.connect()
+                    requestTags = self.send(pending)
+                except Exception as e:
+                    bottlelog('error publishing, reconnecting: {0}\n'.format(e))
+                    self.connection = None
+                    if attempt == self.retries:
+                        for (events, result) in pending:
+                            result.set_exception(e)
+                    else:
+                        gevent.sleep(1)
+                    continue
+                for ((events, result), tags) in zip(pending, requestTags):
+                    if self.tracker.confirmed(tags):
+                        result.set()
+                    else:
+                        result.set_exception(Exception('broker nacked events'))
+                self.tracker.failed.clear()
+                break
+
+    def start(self):
+        return gevent.spawn(self.run)
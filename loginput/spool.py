@@ -0,0 +1,164 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+import fcntl
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from bottle import _stdout as bottlelog
+
+
+class Spool(object):
+    '''an append only spool of events on disk for when rabbitmq is slow or down.
+       Events are written as json lines to numbered segment files,
+       rotated every segmentSize bytes and replayed oldest first.
+       Each process claims its own numbered subdirectory of directory,
+       picking up whatever a previous process left behind there.
+    '''
+
+    def __init__(self, directory, segmentSize=64 * 1024 * 1024):
+        self.segmentSize = segmentSize
+        self.lock = threading.Lock()
+        self.directory = self.claim(directory)
+        self.segments = sorted(glob.glob(os.path.join(self.directory, '*.spool')))
+        self.depth = sum(self.countLines(segment) for segment in self.segments)
+        # events already replayed from the oldest segment
+        self.offset = 0
+        self.writer = None
+        self.writerSegment = None
+        self.spooling = self.depth > 0
+
+    def claim(self, directory):
+        for slot in itertools.count():
+            path = os.path.join(directory, str(slot))
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            lockFile = open(os.path.join(path, 'lock'), 'w')
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                lockFile.close()
+                continue
+            # held open for as long as we live
+            self.lockFile = lockFile
+            return path
+
+    def countLines(self, segment):
+        with open(segment) as f:
+            return sum(1 for line in f)
+
+    def nextSegment(self):
+        sequence = 0
+        if self.segments:
+            sequence = int(os.path.basename(self.segments[-1]).split('.')[0]) + 1
+        return os.path.join(self.directory, '{0:012d}.spool'.format(sequence))
+
+    def closeWriter(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = None
+        self.writerSegment = None
+
+    def rotate(self):
+        '''start writing to a new segment'''
+        self.closeWriter()
+        self.writerSegment = self.nextSegment()
+        self.writer = open(self.writerSegment, 'ab')
+        self.segments.append(self.writerSegment)
+
+    def startSpooling(self):
+        '''send everything to the spool until it has been drained'''
+        with self.lock:
+            self.spooling = True
+
+    def append(self, events):
+        with self.lock:
+            if self.writer is None or self.writer.tell() >= self.segmentSize:
+                self.rotate()
+            self.writer.write(''.join(json.dumps(event) + '\n' for event in events))
+            self.writer.flush()
+            self.depth += len(events)
+            self.spooling = True
+
+    def replayed(self, publish, batch, lines):
+        if batch:
+            publish(batch)
+        with self.lock:
+            self.offset += lines
+            self.depth -= lines
+
+    def drain(self, publish, batchSize=100):
+        '''replay the oldest segment through publish(events), in batches
+           returns how many events were replayed. If publish raises we
+           pick up where it left off on the next call.
+        '''
+        with self.lock:
+            if not self.segments:
+                self.spooling = False
+                return 0
+            segment = self.segments[0]
+            if segment == self.writerSegment:
+                # new events go to a new segment from here on
+                self.closeWriter()
+            offset = self.offset
+        count = 0
+        batch = []
+        lines = 0
+        with open(segment) as f:
+            for line in itertools.islice(f, offset, None):
+                lines += 1
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    # most likely a write cut short when a previous process died
+                    bottlelog('skipping a corrupt line in spool segment {0}\n'.format(segment))
+                if len(batch) >= batchSize:
+                    self.replayed(publish, batch, lines)
+                    count += len(batch)
+                    batch = []
+                    lines = 0
+        self.replayed(publish, batch, lines)
+        count += len(batch)
+        with self.lock:
+            os.remove(segment)
+            self.segments.pop(0)
+            self.offset = 0
+            if not self.segments:
+                self.spooling = False
+        return count
+
+    def status(self):
+        with self.lock:
+            return dict(
+                depth=self.depth,
+                segments=len(self.segments),
+                spooling=self.spooling)
+
+
+class SpoolDrainer(threading.Thread):
+    '''replays the spool in the background, backing off while publishing fails'''
+
+    def __init__(self, spool, publish, batchSize=100, interval=1):
+        super(SpoolDrainer, self).__init__(name='spooldrainer')
+        self.daemon = True
+        self.spool = spool
+        self.publish = publish
+        self.batchSize = batchSize
+        self.interval = interval
+
+    def run(self):
+        while True:
+            try:
+                if not self.spool.spooling:
+                    time.sleep(self.interval)
+                    continue
+                self.spool.drain(self.publish, self.batchSize)
+            except Exception as e:
+                bottlelog('error replaying the spool: {0}\n'.format(e))
+                time.sleep(self.interval)
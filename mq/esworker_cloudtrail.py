@@ -11,31 +11,27 @@
 
 import json
 import os
-import pynsive
 import sys
-import socket
-import time
 from configlib import getConfig, OptionParser
 from datetime import datetime, timedelta
-from operator import itemgetter
 import boto.sqs
 import boto.sts
 import boto.s3
 from boto.sqs.message import RawMessage
-import gzip
-from StringIO import StringIO
 from threading import Timer
-import re
 
 
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../lib'))
-from utilities.toUTC import toUTC
-from elasticsearch_client import ElasticsearchClient
 from utilities.logger import logger, initLogger
+from utilities.utcNow import setTick
 
-CLOUDTRAIL_VERB_REGEX = re.compile(r'^([A-Z][^A-Z]*)')
+from lib import esconnection
+from lib.cloudtrail import CloudTrailNormalizer
+from lib.plugins import checkPlugins
+from lib.s3 import S3Fetcher
+from lib.sqs import SQSConsumer
 
 # running under uwsgi?
 try:
@@ -129,11 +125,7 @@ class RoleManager:
 
 def esConnect():
     '''open or re-open a connection to elastic search'''
-    return ElasticsearchClient(
-        (list('{0}'.format(s) for s in options.esservers)),
-        bulk_amount=options.esbulksize,
-        bulk_refresh_time=options.esbulktimeout
-    )
+    return esconnection.esConnect(options)
 
 
 class taskConsumer(object):
@@ -143,6 +135,9 @@ class taskConsumer(object):
         self.esConnection = esConnection
         self.taskQueue = taskQueue
         self.s3_connection = None
+        self.normalizer = CloudTrailNormalizer(
+            readOnly=options.readonly,
+            readOnlyIndex=options.readonlyindex)
         # This value controls how long we sleep
         # between reauthenticating and getting a new set of creds
         self.flush_wait_time = 1800
@@ -162,190 +157,78 @@ class taskConsumer(object):
         role_manager.assume_role(options.cloudtrail_arn)
         role_creds = role_manager.get_credentials(options.cloudtrail_arn)
         self.s3_connection = boto.connect_s3(**role_creds)
+        # bucket handles belong to the connection, so start afresh with it
+        self.fetcher = S3Fetcher(self.s3_connection)
 
     def flush_s3_creds(self):
         logger.debug('Recycling credentials and reassuming role')
         self.authenticate()
         Timer(self.flush_wait_time, self.flush_s3_creds).start()
 
-    def process_file(self, s3file):
-        logger.debug("Fetching %s" % s3file.name)
-        compressedData = s3file.read()
-        databuf = StringIO(compressedData)
-        gzip_file = gzip.GzipFile(fileobj=databuf)
-        json_logs = json.loads(gzip_file.read())
-        return json_logs['Records']
-
     def run(self):
         self.taskQueue.set_message_class(RawMessage)
-        while True:
-            try:
-                records = self.taskQueue.get_messages(options.prefetch)
-                for msg in records:
-                    body_message = msg.get_body()
-                    event = json.loads(body_message)
-
-                    if not event['Message']:
-                        logger.error('Invalid message format for cloudtrail SQS messages')
-                        continue
-
-                    if event['Message'] == 'CloudTrail validation message.':
-                        # We don't care about these messages
-                        continue
-
-                    message_json = json.loads(event['Message'])
-
-                    if 's3ObjectKey' not in message_json.keys():
-                        logger.error('Invalid message format, expecting an s3ObjectKey in Message')
-                        continue
-
-                    s3_log_files = message_json['s3ObjectKey']
-                    for log_file in s3_log_files:
-                        logger.debug('Downloading and parsing ' + log_file)
-                        bucket = self.s3_connection.get_bucket(message_json['s3Bucket'])
-
-                        log_file_lookup = bucket.lookup(log_file)
-                        events = self.process_file(log_file_lookup)
-                        for event in events:
-                            self.on_message(event)
-
-                    self.taskQueue.delete_message(msg)
-
-            except KeyboardInterrupt:
-                sys.exit(1)
-            except ValueError as e:
-                logger.error('Exception while handling message: %r' % e)
-            except Exception as e:
-                logger.error('Exception received: %r' % e)
-                time.sleep(3)
-
-            time.sleep(.1)
+        # fetch and index as many log files at once as we have processors,
+        # deleting their notifications once ES has their events
+        self.consumer = SQSConsumer(
+            self.taskQueue,
+            self.process_message,
+            receivers=options.receivers,
+            processors=options.processors,
+            waitTime=options.waittime,
+            batchSize=options.prefetch,
+            confirmed=self.esConnection.bulk_confirmed,
+            flush=self.esConnection.flush_bulk)
+        try:
+            self.consumer.run()
+        except KeyboardInterrupt:
+            sys.exit(1)
+
+    def process_message(self, msg):
+        '''index the events of every log file in a cloudtrail notification
+           returns the bulk generation the last of them was saved with
+        '''
+        body_message = msg.get_body()
+        try:
+            event = json.loads(body_message)
+        except ValueError as e:
+            logger.error('Exception while handling message: %r' % e)
+            return None
+
+        if not event.get('Message'):
+            logger.error('Invalid message format for cloudtrail SQS messages')
+            return None
+
+        if event['Message'] == 'CloudTrail validation message.':
+            # We don't care about these messages
+            return None
+
+        message_json = json.loads(event['Message'])
+
+        if 's3ObjectKey' not in message_json.keys():
+            logger.error('Invalid message format, expecting an s3ObjectKey in Message')
+            return None
+
+        generation = None
+        s3_log_files = message_json['s3ObjectKey']
+        for log_file in s3_log_files:
+            logger.debug('Downloading and parsing ' + log_file)
+            # records are indexed as they're read so memory stays flat however big the file
+            for record in self.fetcher.records(message_json['s3Bucket'], log_file):
+                saved = self.on_message(record)
+                if saved is not None:
+                    generation = saved
+        return generation
 
     def on_message(self, message):
-        message['category'] = 'cloudtrail'
-        message['utctimestamp'] = toUTC(message['eventTime']).isoformat()
-        message['receivedtimestamp'] = toUTC(datetime.now()).isoformat()
-        message['mozdefhostname'] = socket.gethostname()
-        message['hostname'] = message['eventSource']
-        message['processid'] = os.getpid()
-        message['processname'] = sys.argv[0]
-        message['severity'] = 'INFO'
-        summary_str = "{0} performed {1} in {2}".format(
-            message['sourceIPAddress'],
-            message['eventName'],
-            message['eventSource']
-        )
-        message['summary'] = summary_str
-        message['eventVerb'] = CLOUDTRAIL_VERB_REGEX.findall(
-            message['eventName'])[0]
-        message['eventReadOnly'] = (
-            message['eventVerb'] in ['Describe', 'Get', 'List'])
-        es.save_event(body=message, doc_type='cloudtrail', bulk=True)
-
-
-def registerPlugins():
-    pluginList = list()   # tuple of module,registration dict,priority
-    if os.path.exists('plugins'):
-        modules = pynsive.list_modules('plugins')
-        for mname in modules:
-            module = pynsive.import_module(mname)
-            reload(module)
-            if not module:
-                raise ImportError('Unable to load module {}'.format(mname))
-            else:
-                if 'message' in dir(module):
-                    mclass = module.message()
-                    mreg = mclass.registration
-                    if 'priority' in dir(mclass):
-                        mpriority = mclass.priority
-                    else:
-                        mpriority = 100
-                    if isinstance(mreg, list):
-                        print('[*] plugin {0} registered to receive messages with {1}'.format(mname, mreg))
-                        pluginList.append((mclass, mreg, mpriority))
-    return pluginList
-
-
-def checkPlugins(pluginList, lastPluginCheck):
-    if abs(datetime.now() - lastPluginCheck).seconds > options.plugincheckfrequency:
-        # print('[*] checking plugins')
-        lastPluginCheck = datetime.now()
-        pluginList = registerPlugins()
-        return pluginList, lastPluginCheck
-    else:
-        return pluginList, lastPluginCheck
-
-
-def dict2List(inObj):
-    '''given a dictionary, potentially with multiple sub dictionaries
-       return a list of the dict keys and values
-    '''
-    if isinstance(inObj, dict):
-        for key, value in inObj.iteritems():
-            if isinstance(value, dict):
-                for d in dict2List(value):
-                    yield d
-            elif isinstance(value, list):
-                yield key.encode('ascii', 'ignore').lower()
-                for l in dict2List(value):
-                    yield l
-            else:
-                yield key.encode('ascii', 'ignore').lower()
-                if isinstance(value, str):
-                    yield value.lower()
-                elif isinstance(value, unicode):
-                    yield value.encode('ascii', 'ignore').lower()
-                else:
-                    yield value
-    elif isinstance(inObj, list):
-        for v in inObj:
-            if isinstance(v, str):
-                yield v.lower()
-            elif isinstance(v, unicode):
-                yield v.encode('ascii', 'ignore').lower()
-            elif isinstance(v, list):
-                for l in dict2List(v):
-                    yield l
-            elif isinstance(v, dict):
-                for d in dict2List(v):
-                    yield d
-            else:
-                yield v
-    else:
-        yield ''
-
-
-def sendEventToPlugins(anevent, metadata, pluginList):
-    '''compare the event to the plugin registrations.
-       plugins register with a list of keys or values
-       or values they want to match on
-       this function compares that registration list
-       to the current event and sends the event to plugins
-       in order
-    '''
-    if not isinstance(anevent, dict):
-        raise TypeError('event is type {0}, should be a dict'.format(type(anevent)))
-
-    # expecting tuple of module,criteria,priority in pluginList
-    # sort the plugin list by priority
-    for plugin in sorted(pluginList, key=itemgetter(2), reverse=False):
-        # assume we don't run this event through the plugin
-        send = False
-        if isinstance(plugin[1], list):
-            try:
-                if (set(plugin[1]).intersection([e for e in dict2List(anevent)])):
-                    send = True
-            except TypeError:
-                sys.stderr.write('TypeError on set intersection for dict {0}'.format(anevent))
-                return (anevent, metadata)
-        if send:
-            (anevent, metadata) = plugin[0].onMessage(anevent, metadata)
-            if anevent is None:
-                # plug-in is signalling to drop this message
-                # early exit
-                return (anevent, metadata)
-
-    return (anevent, metadata)
+        normalized = self.normalizer.normalize(message)
+        if normalized is None:
+            # a read only call we've been told to drop
+            return None
+        (event, index) = normalized
+        # everything an event needs is already set, so it can go straight in the bulk.
+        # Keyed by its eventID, so records indexed again when a partly read
+        # notification comes back overwrite themselves instead of duplicating
+        return self.esConnection.save_object(body=event, index=index, doc_type='cloudtrail', doc_id=event.get('eventID'), bulk=True)
 
 
 def main():
@@ -374,11 +257,10 @@ def initConfig():
     options.output = getConfig('output', 'stdout', options.configfile)
     options.sysloghostname = getConfig('sysloghostname', 'localhost', options.configfile)
     options.syslogport = getConfig('syslogport', 514, options.configfile)
+    # seconds a utcNow() timestamp is reused for before making a new one
+    options.utcnowtick = getConfig('utcnowtick', 0.001, options.configfile)
 
-    # elastic search options. set esbulksize to a non-zero value to enable bulk posting, set timeout to post no matter how many events after X seconds.
-    options.esservers = list(getConfig('esservers', 'http://localhost:9200', options.configfile).split(','))
-    options.esbulksize = getConfig('esbulksize', 0, options.configfile)
-    options.esbulktimeout = getConfig('esbulktimeout', 30, options.configfile)
+    esconnection.initConfig(options)
 
     # set to sqs for Amazon
     options.mqprotocol = getConfig('mqprotocol', 'sqs', options.configfile)
@@ -389,6 +271,11 @@ def initConfig():
     options.eventexchange = getConfig('eventexchange', 'events', options.configfile)
     # rabbit: how many messages to ask for at once from the message queue
     options.prefetch = getConfig('prefetch', 10, options.configfile)
+    # sqs: how many threads long poll the queue, how long (secs) each poll waits for messages
+    # and how many threads fetch and index the log files they point to
+    options.receivers = getConfig('receivers', 1, options.configfile)
+    options.waittime = getConfig('waittime', 20, options.configfile)
+    options.processors = getConfig('processors', 4, options.configfile)
     # rabbit: user creds
     options.mquser = getConfig('mquser', 'guest', options.configfile)
     options.mqpassword = getConfig('mqpassword', 'guest', options.configfile)
@@ -416,6 +303,11 @@ def initConfig():
     # This is the full ARN that the s3 bucket lives under
     options.cloudtrail_arn = getConfig('cloudtrail_arn', 'cloudtrail_arn', options.configfile)
 
+    # what to do with read only (Describe/Get/List) calls:
+    # index them with everything else, route them to readonlyindex or drop them
+    options.readonly = getConfig('readonly', 'index', options.configfile)
+    options.readonlyindex = getConfig('readonlyindex', 'cloudtrail-readonly', options.configfile)
+
 
 if __name__ == '__main__':
     # configure ourselves
@@ -423,6 +315,7 @@ if __name__ == '__main__':
     parser.add_option("-c", dest='configfile', default=sys.argv[0].replace('.py', '.conf'), help="configuration file to use")
     (options, args) = parser.parse_args()
     initConfig()
+    setTick(options.utcnowtick)
     initLogger(options)
 
     # open ES connection globally so we don't waste time opening it per message
@@ -431,5 +324,5 @@ if __name__ == '__main__':
     # force a check for plugins and establish the plugin list
     pluginList = list()
     lastPluginCheck = datetime.now() - timedelta(minutes=60)
-    pluginList, lastPluginCheck = checkPlugins(pluginList, lastPluginCheck)
+    pluginList, lastPluginCheck = checkPlugins(pluginList, lastPluginCheck, options.plugincheckfrequency)
     main()
@@ -14,20 +14,23 @@ import json
 import kombu
 import math
 import os
-import pynsive
 import sys
 import socket
+import time
 from configlib import getConfig, OptionParser
 from datetime import datetime, timedelta
-from operator import itemgetter
 from kombu import Connection, Queue, Exchange
 from kombu.mixins import ConsumerMixin
 
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
-from elasticsearch_client import ElasticsearchClient, ElasticsearchBadServer, ElasticsearchInvalidIndex, ElasticsearchException
+from elasticsearch_client import ElasticsearchBadServer, ElasticsearchInvalidIndex, ElasticsearchException
+from utilities.utcNow import setTick
 
-from utilities.toUTC import toUTC
+from lib.plugins import sendEventsToPlugins, checkPlugins, pluginStats, savePluginStats
+from lib import esconnection, keymapping
+from lib.envelope import Envelope, EnvelopePart
+from lib.workers import WorkerStats, WorkerSupervisor
 
 
 # running under uwsgi?
@@ -38,11 +41,6 @@ except ImportError as e:
     hasUWSGI = False
 
 
-def removeAt(astring):
-    '''remove the leading @ from a string'''
-    return astring.replace('@', '')
-
-
 def isCEF(aDict):
     # determine if this is a CEF event
     # could be an event posted to the /cef http endpoint
@@ -61,148 +59,23 @@ def isCEF(aDict):
     return False
 
 
-def toUnicode(obj, encoding='utf-8'):
-    if type(obj) in [int, long, float, complex]:
-        # likely a number, convert it to string to get to unicode
-        obj = str(obj)
-    if isinstance(obj, basestring):
-        if not isinstance(obj, unicode):
-            obj = unicode(obj, encoding)
-    return obj
-
-
 def keyMapping(aDict):
-    '''map common key/fields to a normalized structure,
-       explicitly typed when possible to avoid schema changes for upsteam consumers
-       Special accomodations made for logstash,nxlog, beaver, heka and CEF
-       Some shippers attempt to conform to logstash-style @fieldname convention.
-       This strips the leading at symbol since it breaks some elastic search
-       libraries like elasticutils.
-    '''
-    returndict = dict()
-
-    # uncomment to save the source event for debugging, or chain of custody/forensics
-    # returndict['original']=aDict
-
-    # set the timestamp when we received it, i.e. now
-    returndict['receivedtimestamp'] = toUTC(datetime.now()).isoformat()
-    returndict['mozdefhostname'] = options.mozdefhostname
-    try:
-        for k, v in aDict.iteritems():
-            k = removeAt(k).lower()
-
-            if k == 'sourceip':
-                if 'details' not in returndict.keys():
-                    returndict[u'details'] = dict()
-                returndict[u'details']['sourceipaddress'] = v
-
-            if k == 'facility':
-                returndict[u'source'] = v
-
-            if k in ('message', 'summary'):
-                returndict[u'summary'] = toUnicode(v)
-
-            if k in ('payload') and 'summary' not in aDict.keys():
-                # special case for heka if it sends payload as well as a summary, keep both but move payload to the details section.
-                returndict[u'summary'] = toUnicode(v)
-            elif k in ('payload'):
-                if 'details' not in returndict.keys():
-                    returndict[u'details'] = dict()
-                returndict[u'details']['payload'] = toUnicode(v)
-
-            if k in ('eventtime', 'timestamp', 'utctimestamp', 'date'):
-                returndict[u'utctimestamp'] = toUTC(v).isoformat()
-                returndict[u'timestamp'] = toUTC(v).isoformat()
-
-            if k in ('hostname', 'source_host', 'host'):
-                returndict[u'hostname'] = toUnicode(v)
-
-            if k in ('tags'):
-                if 'tags' not in returndict.keys():
-                    returndict[u'tags'] = []
-                if type(v) == list:
-                    returndict[u'tags'] += v
-                else:
-                    if len(v) > 0:
-                        returndict[u'tags'].append(v)
-
-            # nxlog keeps the severity name in syslogseverity,everyone else should use severity or level.
-            if k in ('syslogseverity', 'severity', 'severityvalue', 'level', 'priority'):
-                returndict[u'severity'] = toUnicode(v).upper()
-
-            if k in ('facility', 'syslogfacility'):
-                returndict[u'facility'] = toUnicode(v)
-
-            if k in ('pid', 'processid'):
-                returndict[u'processid'] = toUnicode(v)
-
-            # nxlog sets sourcename to the processname (i.e. sshd), everyone else should call it process name or pname
-            if k in ('pname', 'processname', 'sourcename', 'program'):
-                returndict[u'processname'] = toUnicode(v)
-
-            # the file, or source
-            if k in ('path', 'logger', 'file'):
-                returndict[u'eventsource'] = toUnicode(v)
-
-            if k in ('type', 'eventtype', 'category'):
-                returndict[u'category'] = toUnicode(v)
-
-            # custom fields as a list/array
-            if k in ('fields', 'details'):
-                if len(v) > 0:
-                    returndict[u'details'] = v
-
-            # custom fields/details as a one off, not in an array
-            # i.e. fields.something=value or details.something=value
-            # move them to a dict for consistency in querying
-            if k.startswith('fields.') or k.startswith('details.'):
-                newName = k.replace('fields.', '')
-                newName = newName.lower().replace('details.', '')
-                # add a dict to hold the details if it doesn't exist
-                if 'details' not in returndict.keys():
-                    returndict[u'details'] = dict()
-                # add field with a special case for shippers that
-                # don't send details
-                # in an array as int/floats/strings
-                # we let them dictate the data type with field_datatype
-                # convention
-                if newName.endswith('_int'):
-                    returndict[u'details'][unicode(newName)] = int(v)
-                elif newName.endswith('_float'):
-                    returndict[u'details'][unicode(newName)] = float(v)
-                else:
-                    returndict[u'details'][unicode(newName)] = toUnicode(v)
-
-
-        #nxlog windows log handling
-        if 'Domain' in aDict.keys() and 'SourceModuleType' in aDict.keys():
-            # add a dict to hold the details if it doesn't exist
-            if 'details' not in returndict.keys():
-                returndict[u'details'] = dict()
-
-            # nxlog parses all windows event fields very well
-            # copy all fields to details
-            returndict[u'details'][k]=v
-
-        if 'utctimestamp' not in returndict.keys():
-            # default in case we don't find a reasonable timestamp
-            returndict['utctimestamp'] = toUTC(datetime.now()).isoformat()
-
-    except Exception as e:
-        sys.stderr.write('esworker exception normalizing the message %r\n' % e)
-        return None
-
-    return returndict
+    '''map common key/fields to a normalized structure, see lib/keymapping.py'''
+    return keymapping.keyMapping(aDict, options.mozdefhostname)
 
 
 def esConnect():
     '''open or re-open a connection to elastic search'''
-    return ElasticsearchClient((list('{0}'.format(s) for s in options.esservers)), options.esbulksize)
+    return esconnection.esConnect(options)
+
+
+# counters each consumer keeps, totalled across processes with --workers
+statNames = ('received', 'saved', 'dropped')
 
 
 class taskConsumer(ConsumerMixin):
 
-    def __init__(self, mqConnection, taskQueue, topicExchange, esConnection):
+    def __init__(self, mqConnection, taskQueue, topicExchange, esConnection, stats=None):
         self.connection = mqConnection
         self.esConnection = esConnection
         self.taskQueue = taskQueue
@@ -216,139 +89,277 @@ class taskConsumer(ConsumerMixin):
             # if we are bulk posting enable a timer to occasionally flush the bulker even if it's not full
             # to prevent events from sticking around an idle worker
             self.esConnection.start_bulk_timer()
+        # messages received but not yet run through the plugins
+        self.batch = list()
+        self.batchStarted = time.time()
+        self.lastBatchSize = 0
+        # (message, bulk generation) of bulk saved messages
+        # that we'll ack once ES has their bulk
+        self.pendingAcks = list()
+        self.received = 0
+        self.lastReceived = 0
+        if stats is None:
+            stats = WorkerStats(statNames)
+        self.stats = stats
 
     def get_consumers(self, Consumer, channel):
-        consumer = Consumer(self.taskQueue, callbacks=[self.on_message], accept=['json', 'text/plain'], no_ack=(not options.mqack))
+        consumer = Consumer(self.taskQueue, callbacks=[self.on_message], accept=['json', 'text/plain', 'application/x-msgpack'], no_ack=(not options.mqack))
         consumer.qos(prefetch_count=options.prefetch)
         return [consumer]
 
+    def on_consume_ready(self, connection, channel, consumers, **kwargs):
+        # delivery tags belong to the channel they came in on,
+        # anything we haven't acked on a previous channel will be redelivered
+        self.pendingAcks = list()
+        self.batch = list()
+
     def on_message(self, body, message):
         # print("RECEIVED MESSAGE: %r" % (body, ))
-        try:
-            # default elastic search metadata for an event
-            metadata = {
-                'index': 'events',
-                'doc_type': 'event',
-                'id': None
-            }
-            # just to be safe..check what we were sent.
-            if isinstance(body, dict):
-                bodyDict = body
-            elif isinstance(body, str) or isinstance(body, unicode):
-                try:
-                    bodyDict = json.loads(body)   # lets assume it's json
-                except ValueError as e:
-                    # not json..ack but log the message
-                    sys.stderr.write("esworker exception: unknown body type received %r\n" % body)
-                    message.ack()
-                    return
-            else:
-                sys.stderr.write("esworker exception: unknown body type received %r\n" % body)
+        # hold on to events until we've drained a prefetch batch
+        # so plugins can process them together, an envelope from
+        # a bulk post is usually a batch on its own
+        if isinstance(body, list):
+            # several events packed in one message, it's acked once they all are
+            events = zip(body, Envelope(message, len(body)).parts())
+            if not events:
                 message.ack()
                 return
-
-            if 'customendpoint' in bodyDict.keys() and bodyDict['customendpoint']:
-                # custom document
-                # send to plugins to allow them to modify it if needed
-                (normalizedDict, metadata) = sendEventToPlugins(bodyDict, metadata, pluginList)
-            else:
-                # normalize the dict
-                # to the mozdef events standard
-                normalizedDict = keyMapping(bodyDict)
-
-                # send to plugins to allow them to modify it if needed
-                if normalizedDict is not None and isinstance(normalizedDict, dict) and normalizedDict.keys():
-                    (normalizedDict, metadata) = sendEventToPlugins(normalizedDict, metadata, pluginList)
-
-            # drop the message if a plug in set it to None
-            # signaling a discard
-            if normalizedDict is None:
+        else:
+            events = [(body, message)]
+        self.received += 1
+        self.stats.increment('received', len(events))
+        if not self.batch:
+            self.batchStarted = time.time()
+        self.batch.extend(events)
+        if len(self.batch) >= options.prefetch:
+            self.process_batch()
+
+    def on_iteration(self):
+        # kombu calls this before every drain_events
+        # if the last drain didn't bring in anything new the queue has gone quiet
+        # so process what we have rather than waiting for a full batch
+        if self.batch:
+            if len(self.batch) == self.lastBatchSize or time.time() - self.batchStarted >= options.batchtimeout:
+                self.process_batch()
+        self.lastBatchSize = len(self.batch)
+        if self.pendingAcks:
+            self.ack_confirmed()
+        if self.pendingAcks and not self.batch:
+            # unacked messages count against the prefetch, so if the
+            # broker has stopped sending it may be waiting on us to flush
+            if self.received == self.lastReceived or self.pending_messages() >= options.prefetch:
+                self.esConnection.flush_bulk()
+                self.ack_confirmed()
+        self.lastReceived = self.received
+        if pluginStats.due(options.pluginstatsinterval):
+            savePluginStats(self.esConnection, options.mozdefhostname)
+
+    def pending_messages(self):
+        '''how many messages are waiting on their acks, envelopes count once'''
+        return len(set(message.delivery_tag for (message, generation) in self.pendingAcks))
+
+    def ack_confirmed(self):
+        '''ack every pending message whose bulk has been written
+           with one multiple ack on the highest delivery tag we can,
+           envelopes are settled through their parts so each is acked,
+           or requeued, once all of its events are
+        '''
+        confirmed = self.esConnection.bulk_confirmed()
+        waiting = list()
+        ready = list()
+        for (message, generation) in self.pendingAcks:
+            if generation > confirmed:
+                waiting.append((message, generation))
+            elif isinstance(message, EnvelopePart):
                 message.ack()
-                return
-
-            # make a json version for posting to elastic search
-            jbody = json.JSONEncoder().encode(normalizedDict)
-
-            if isCEF(normalizedDict):
-                # cef records are set to the 'deviceproduct' field value.
-                metadata['doc_type'] = 'cef'
-                if 'details' in normalizedDict.keys() and 'deviceproduct' in normalizedDict['details'].keys():
-                    # don't create strange doc types..
-                    if ' ' not in normalizedDict['details']['deviceproduct'] and '.' not in normalizedDict['details']['deviceproduct']:
-                        metadata['doc_type'] = normalizedDict['details']['deviceproduct']
-
+            else:
+                ready.append((message, generation))
+        if waiting:
+            # a multiple ack takes every outstanding delivery up to its tag with it
+            # so it can't reach past a message, or envelope, that's still waiting
+            limit = min(message.delivery_tag for (message, generation) in waiting)
+            waiting.extend(pending for pending in ready if pending[0].delivery_tag > limit)
+            ready = [pending for pending in ready if pending[0].delivery_tag < limit]
+        if ready:
+            message = max(ready, key=lambda pending: pending[0].delivery_tag)[0]
+            message.channel.basic_ack(message.delivery_tag, multiple=True)
+        self.pendingAcks = waiting
+
+    def reconnect(self):
+        '''swap in a new ES client. The new client's bulk generations start
+           over, so ack whatever the old one managed to send and put the
+           rest of the messages waiting on it back on the queue
+        '''
+        if options.esbulksize != 0:
             try:
-                bulk = False
-                if options.esbulksize != 0:
-                    bulk = True
-
-                res = self.esConnection.save_event(
-                    index=metadata['index'],
-                    doc_id=metadata['id'],
-                    doc_type=metadata['doc_type'],
-                    body=jbody,
-                    bulk=bulk
-                )
-
-            except (ElasticsearchBadServer, ElasticsearchInvalidIndex) as e:
-                # handle loss of server or race condition with index rotation/creation/aliasing
+                self.esConnection.finish_bulk()
+            except Exception as e:
+                sys.stderr.write('esworker exception finishing the bulk %r\n' % e)
+            self.ack_confirmed()
+            for (message, generation) in self.pendingAcks:
                 try:
-                    self.esConnection = esConnect()
                     message.requeue()
-                    return
                 except kombu.exceptions.MessageStateError:
                     # state may be already set.
-                    return
-            except ElasticsearchException as e:
-                # exception target for queue capacity issues reported by elastic search so catch the error, report it and retry the message
+                    pass
+            self.pendingAcks = list()
+        self.esConnection = esConnect()
+        if options.esbulksize != 0:
+            self.esConnection.start_bulk_timer()
+
+    def process_batch(self):
+        batch = self.batch
+        self.batch = list()
+        self.lastBatchSize = 0
+
+        # normalize what we can, and remember which message each event came from
+        events = list()
+        messages = list()
+        for (body, message) in batch:
+            try:
+                event = self.normalize_message(body, message)
+            except Exception as e:
+                self.drop_message(message, e)
+                continue
+            if event is not None:
+                events.append(event)
+                messages.append(message)
+
+        try:
+            # send to plugins to allow them to modify it if needed
+            # an event a plugin can't handle is dropped on its own
+            events = sendEventsToPlugins(events, pluginList)
+        except Exception as e:
+            # put the batch back rather than leave it unacked
+            sys.stderr.write("esworker exception sending events to plugins %r\n" % e)
+            for message in messages:
                 try:
-                    sys.stderr.write('ElasticSearchException: {0} reported while indexing event'.format(e))
                     message.requeue()
-                    return
                 except kombu.exceptions.MessageStateError:
                     # state may be already set.
-                    return
-            # post the dict (kombu serializes it to json) to the events topic queue
-            # using the ensure function to shortcut connection/queue drops/stalls, etc.
-            # ensurePublish = self.connection.ensure(self.mqproducer, self.mqproducer.publish, max_retries=10)
-            # ensurePublish(normalizedDict, exchange=self.topicExchange, routing_key='mozdef.event')
+                    pass
+            return
+
+        for ((normalizedDict, metadata), message) in zip(events, messages):
+            try:
+                self.save_message(normalizedDict, metadata, message)
+            except Exception as e:
+                self.drop_message(message, e)
+
+    def drop_message(self, message, e):
+        '''ack a message we couldn't do anything with so it isn't redelivered forever'''
+        sys.stderr.write("esworker exception in events queue %r\n" % e)
+        self.stats.increment('dropped')
+        try:
             message.ack()
-        except ValueError as e:
-            sys.stderr.write("esworker exception in events queue %r\n" % e)
-
-
-def registerPlugins():
-    pluginList = list()   # tuple of module,registration dict,priority
-    plugin_manager = pynsive.PluginManager()
-    if os.path.exists('plugins'):
-        modules = pynsive.list_modules('plugins')
-        for mname in modules:
-            module = pynsive.import_module(mname)
-            reload(module)
-            if not module:
-                raise ImportError('Unable to load module {}'.format(mname))
-            else:
-                if 'message' in dir(module):
-                    mclass = module.message()
-                    mreg = mclass.registration
-                    if 'priority' in dir(mclass):
-                        mpriority = mclass.priority
-                    else:
-                        mpriority = 100
-                    if isinstance(mreg, list):
-                        print('[*] plugin {0} registered to receive messages with {1}'.format(mname, mreg))
-                        pluginList.append((mclass, mreg, mpriority))
-    return pluginList
-
-
-def checkPlugins(pluginList, lastPluginCheck):
-    if abs(datetime.now() - lastPluginCheck).seconds > options.plugincheckfrequency:
-        # print('[*] checking plugins')
-        lastPluginCheck = datetime.now()
-        pluginList = registerPlugins()
-        return pluginList, lastPluginCheck
-    else:
-        return pluginList, lastPluginCheck
+        except kombu.exceptions.MessageStateError:
+            # state may be already set.
+            pass
+
+    def normalize_message(self, body, message):
+        '''turn a message body into an (event, metadata) tuple ready for the plugins
+           returns None if the message was dealt with and needs no further processing
+        '''
+        # default elastic search metadata for an event
+        metadata = {
+            'index': 'events',
+            'doc_type': 'event',
+            'id': None
+        }
+        # just to be safe..check what we were sent.
+        if isinstance(body, dict):
+            bodyDict = body
+        elif isinstance(body, str) or isinstance(body, unicode):
+            try:
+                bodyDict = json.loads(body)   # lets assume it's json
+            except ValueError as e:
+                # not json..ack but log the message
+                sys.stderr.write("esworker exception: unknown body type received %r\n" % body)
+                message.ack()
+                return None
+        else:
+            sys.stderr.write("esworker exception: unknown body type received %r\n" % body)
+            message.ack()
+            return None
+
+        if 'customendpoint' in bodyDict.keys() and bodyDict['customendpoint']:
+            # custom document
+            # plugins get to modify it if needed
+            return (bodyDict, metadata)
+
+        # normalize the dict
+        # to the mozdef events standard
+        normalizedDict = keyMapping(bodyDict)
+        if normalizedDict is None:
+            # drop the message
+            self.stats.increment('dropped')
+            message.ack()
+            return None
+        if isinstance(normalizedDict, dict) and normalizedDict.keys():
+            return (normalizedDict, metadata)
+
+        # nothing for the plugins to work on, save it as is
+        self.save_message(normalizedDict, metadata, message)
+        return None
+
+    def save_message(self, normalizedDict, metadata, message):
+        # drop the message if a plug in set it to None
+        # signaling a discard
+        if normalizedDict is None:
+            self.stats.increment('dropped')
+            message.ack()
+            return
+
+        if isCEF(normalizedDict):
+            # cef records are set to the 'deviceproduct' field value.
+            metadata['doc_type'] = 'cef'
+            if 'details' in normalizedDict.keys() and 'deviceproduct' in normalizedDict['details'].keys():
+                # don't create strange doc types..
+                if ' ' not in normalizedDict['details']['deviceproduct'] and '.' not in normalizedDict['details']['deviceproduct']:
+                    metadata['doc_type'] = normalizedDict['details']['deviceproduct']
+
+        try:
+            bulk = False
+            if options.esbulksize != 0:
+                bulk = True
+
+            res = self.esConnection.save_event(
+                index=metadata['index'],
+                doc_id=metadata['id'],
+                doc_type=metadata['doc_type'],
+                body=normalizedDict,
+                bulk=bulk
+            )
+            self.stats.increment('saved')
+            if bulk and options.mqack:
+                # the event is only queued, hold the ack
+                # until its bulk makes it to ES
+                self.pendingAcks.append((message, res))
+                return
+
+        except (ElasticsearchBadServer, ElasticsearchInvalidIndex) as e:
+            # handle loss of server or race condition with index rotation/creation/aliasing
+            try:
+                self.reconnect()
+                message.requeue()
+                return
+            except kombu.exceptions.MessageStateError:
+                # state may be already set.
+                return
+        except ElasticsearchException as e:
+            # exception target for queue capacity issues reported by elastic search so catch the error, report it and retry the message
+            try:
+                sys.stderr.write('ElasticSearchException: {0} reported while indexing event'.format(e))
+                message.requeue()
+                return
+            except kombu.exceptions.MessageStateError:
+                # state may be already set.
+                return
+        # post the dict (kombu serializes it to json) to the events topic queue
+        # using the ensure function to shortcut connection/queue drops/stalls, etc.
+        # ensurePublish = self.connection.ensure(self.mqproducer, self.mqproducer.publish, max_retries=10)
+        # ensurePublish(normalizedDict, exchange=self.topicExchange, routing_key='mozdef.event')
+        message.ack()
 
 
 def flattenDict(inDict, pre=None, values=True):
@@ -388,79 +399,16 @@ def flattenDict(inDict, pre=None, values=True):
         yield '-'.join(pre) + '.' + inDict
 
 
-def dict2List(inObj):
-    '''given a dictionary, potentially with multiple sub dictionaries
-       return a list of the dict keys and values
+def runWorker(stats):
+    '''entry point for each process forked with --workers
+       plugins are already loaded, connections are our own
     '''
-    if isinstance(inObj, dict):
-        for key, value in inObj.iteritems():
-            if isinstance(value, dict):
-                for d in dict2List(value):
-                    yield d
-            elif isinstance(value, list):
-                yield key.encode('ascii', 'ignore').lower()
-                for l in dict2List(value):
-                    yield l
-            else:
-                yield key.encode('ascii', 'ignore').lower()
-                if isinstance(value, str):
-                    yield value.lower()
-                elif isinstance(value, unicode):
-                    yield value.encode('ascii', 'ignore').lower()
-                else:
-                    yield value
-    elif isinstance(inObj, list):
-        for v in inObj:
-            if isinstance(v, str):
-                yield v.lower()
-            elif isinstance(v, unicode):
-                yield v.encode('ascii', 'ignore').lower()
-            elif isinstance(v, list):
-                for l in dict2List(v):
-                    yield l
-            elif isinstance(v,dict):
-                for d in dict2List(v):
-                    yield d
-            else:
-                yield v
-    else:
-        yield ''
+    global es
+    es = esConnect()
+    main(stats)
 
 
-def sendEventToPlugins(anevent, metadata, pluginList):
-    '''compare the event to the plugin registrations.
-       plugins register with a list of keys or values
-       or values they want to match on
-       this function compares that registration list
-       to the current event and sends the event to plugins
-       in order
-    '''
-    if not isinstance(anevent, dict):
-        raise TypeError('event is type {0}, should be a dict'.format(type(anevent)))
-
-    # expecting tuple of module,criteria,priority in pluginList
-    # sort the plugin list by priority
-    for plugin in sorted(pluginList, key=itemgetter(2), reverse=False):
-        # assume we don't run this event through the plugin
-        send = False
-        if isinstance(plugin[1], list):
-            try:
-                if (set(plugin[1]).intersection([e for e in dict2List(anevent)])):
-                    send = True
-            except TypeError:
-                sys.stderr.write('TypeError on set intersection for dict {0}'.format(anevent))
-                return (anevent, metadata)
-        if send:
-            (anevent, metadata) = plugin[0].onMessage(anevent, metadata)
-            if anevent is None:
-                # plug-in is signalling to drop this message
-                # early exit
-                return (anevent, metadata)
-
-    return (anevent, metadata)
-
-
-def main():
+def main(stats=None):
     # connect and declare the message queue/kombu objects.
     # only py-amqp supports ssl and doesn't recognize amqps
     # so fix up the connection string accordingly
@@ -469,7 +417,11 @@ def main():
         mqSSL = True
     else:
         mqSSL = False
-    mqConn = Connection(connString, ssl=mqSSL)
+    if options.mqprotocol == 'memory':
+        # kombu's in process transport, for benchmarking
+        mqConn = Connection('memory://', transport_options={'polling_interval': 0.01})
+    else:
+        mqConn = Connection(connString, ssl=mqSSL)
     # Task Exchange for events sent via http for us to normalize and post to elastic search
     if options.mqack:
         # conservative, store msgs to disk, ack each message
@@ -494,17 +446,16 @@ def main():
     else:
         sys.stdout.write('started without uwsgi\n')
     # consume our queue and publish on the topic exchange
-    taskConsumer(mqConn, eventTaskQueue, eventTopicExchange, es).run()
+    taskConsumer(mqConn, eventTaskQueue, eventTopicExchange, es, stats).run()
 
 
 def initConfig():
     #capture the hostname
     options.mozdefhostname = getConfig('mozdefhostname', socket.gethostname(), options.configfile)
+    # seconds a utcNow() timestamp is reused for before making a new one
+    options.utcnowtick = getConfig('utcnowtick', 0.001, options.configfile)
 
-    # elastic search options. set esbulksize to a non-zero value to enable bulk posting, set timeout to post no matter how many events after X seconds.
-    options.esservers = list(getConfig('esservers', 'http://localhost:9200', options.configfile).split(','))
-    options.esbulksize = getConfig('esbulksize', 0, options.configfile)
-    options.esbulktimeout = getConfig('esbulktimeout', 30, options.configfile)
+    esconnection.initConfig(options)
 
     # message queue options
     options.mqserver = getConfig('mqserver', 'localhost', options.configfile)
@@ -512,11 +463,14 @@ def initConfig():
     options.eventexchange = getConfig('eventexchange', 'events', options.configfile)
     # how many messages to ask for at once from the message queue
     options.prefetch = getConfig('prefetch', 50, options.configfile)
+    # secs to hold a partial batch of messages before sending it through the plugins
+    options.batchtimeout = getConfig('batchtimeout', 1, options.configfile)
     options.mquser = getConfig('mquser', 'guest', options.configfile)
     options.mqpassword = getConfig('mqpassword', 'guest', options.configfile)
     options.mqport = getConfig('mqport', 5672, options.configfile)
     options.mqvhost = getConfig('mqvhost', '/', options.configfile)
     # set to either amqp or amqps for ssl
+    # (or memory for kombu's in process transport, see benchmarking/pipeline)
     options.mqprotocol = getConfig('mqprotocol', 'amqp', options.configfile)
     # run with message acking?
     # also toggles transient/persistant delivery (messages in memory only or stored on disk)
@@ -529,21 +483,34 @@ def initConfig():
     # regular updates are disabled for now,
     # though we set the frequency anyway.
     options.plugincheckfrequency = getConfig('plugincheckfrequency', 120, options.configfile)
+    # secs between saving per plugin timings as a mozdefstats event, 0 to disable
+    options.pluginstatsinterval = getConfig('pluginstatsinterval', 300, options.configfile)
+
+    # how many consumer processes to run, --workers overrides this
+    if not options.workers:
+        options.workers = getConfig('workers', 1, options.configfile)
+    # secs between printing stats totalled across the workers
+    options.statsinterval = getConfig('statsinterval', 60, options.configfile)
 
 
 if __name__ == '__main__':
     # configure ourselves
     parser = OptionParser()
     parser.add_option("-c", dest='configfile', default=sys.argv[0].replace('.py', '.conf'), help="configuration file to use")
+    parser.add_option("--workers", dest='workers', type='int', default=0, help="number of consumer processes to run")
     (options, args) = parser.parse_args()
     initConfig()
-
-    # open ES connection globally so we don't waste time opening it per message
-    es = esConnect()
+    setTick(options.utcnowtick)
 
     # force a check for plugins and establish the plugin list
+    # before forking any workers so they share it
     pluginList = list()
     lastPluginCheck = datetime.now()-timedelta(minutes=60)
-    pluginList, lastPluginCheck = checkPlugins(pluginList, lastPluginCheck)
+    pluginList, lastPluginCheck = checkPlugins(pluginList, lastPluginCheck, options.plugincheckfrequency)
 
-    main()
+    if options.workers > 1:
+        WorkerSupervisor(options.workers, runWorker, statNames, options.statsinterval).run()
+    else:
+        # open ES connection globally so we don't waste time opening it per message
+        es = esConnect()
+        main()
@@ -16,21 +16,26 @@ import json
 import math
 import os
 import kombu
-import pynsive
 import sys
 import socket
 import time
 from configlib import getConfig, OptionParser
 from datetime import datetime, timedelta
 import calendar
-from operator import itemgetter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
-from elasticsearch_client import ElasticsearchClient, ElasticsearchBadServer, ElasticsearchInvalidIndex, ElasticsearchException
+from elasticsearch_client import ElasticsearchBadServer, ElasticsearchInvalidIndex, ElasticsearchException
 
 from utilities.toUTC import toUTC
+from utilities.utcNow import setTick
+from state import State
+
+from lib.plugins import sendEventToPlugins, checkPlugins, pluginStats, savePluginStats
+from lib import esconnection, keymapping
 
 
 # running under uwsgi?
@@ -62,7 +67,7 @@ class PTRequestor(object):
         return None
 
 
-    def makerequest(self, query, stime, etime, maxid):
+    def search(self, query, stime, etime, maxid):
         payload = {
                 'min_time': calendar.timegm(stime.utctimetuple()),
                 'max_time': calendar.timegm(etime.utctimetuple()),
@@ -72,7 +77,11 @@ class PTRequestor(object):
             payload['max_id'] = maxid
         hdrs = {'X-Papertrail-Token': self._apikey}
         resp = requests.get(self._papertrail_api, headers=hdrs, params=payload)
-        return self.parse_events(resp.json())
+        return resp.json()
+
+
+    def makerequest(self, query, stime, etime, maxid):
+        return self.parse_events(self.search(query, stime, etime, maxid))
 
 
     def request(self, query, stime, etime):
@@ -91,9 +100,34 @@ class PTRequestor(object):
         return self._events
 
 
-def removeAt(astring):
-    '''remove the leading @ from a string'''
-    return astring.replace('@', '')
+    def fetch(self, query, stime, etime):
+        '''every event in a window, oldest first, paging back through it
+           for as long as papertrail says there's more.
+           Unlike request this keeps no state, so windows can be fetched in parallel.
+           Like request it stops at evmax events, so a window never holds more than that
+        '''
+        events = {}
+        maxid = None
+        while True:
+            resp = self.search(query, stime, etime, maxid)
+            for x in resp['events']:
+                events[x['id']] = x
+            if not resp.get('reached_record_limit') or resp['min_id'] == maxid:
+                break
+            if len(events) > self._evmax:
+                sys.stderr.write('WARNING: papertrail esworker hitting event request limit backfilling {0} to {1}, '
+                                 'try a smaller papertrailbackfillwindow\n'.format(stime.isoformat(), etime.isoformat()))
+                break
+            maxid = resp['min_id']
+        return [events[evid] for evid in sorted(events, key=int)]
+
+
+def backfillWindows(stime, etime, seconds):
+    '''split stime to etime into windows of (at most) seconds'''
+    window = timedelta(seconds=seconds)
+    while stime < etime:
+        yield (stime, min(stime + window, etime))
+        stime += window
 
 
 def isCEF(aDict):
@@ -114,137 +148,27 @@ def isCEF(aDict):
     return False
 
 
-def toUnicode(obj, encoding='utf-8'):
-    if type(obj) in [int, long, float, complex]:
-        # likely a number, convert it to string to get to unicode
-        obj = str(obj)
-    if isinstance(obj, basestring):
-        if not isinstance(obj, unicode):
-            obj = unicode(obj, encoding)
-    return obj
-
-
 def keyMapping(aDict):
-    '''map common key/fields to a normalized structure,
-       explicitly typed when possible to avoid schema changes for upsteam consumers
-       Special accomodations made for logstash,nxlog, beaver, heka and CEF
-       Some shippers attempt to conform to logstash-style @fieldname convention.
-       This strips the leading at symbol since it breaks some elastic search
-       libraries like elasticutils.
-    '''
-    returndict = dict()
-
-    # uncomment to save the source event for debugging, or chain of custody/forensics
-    # returndict['original']=aDict
-
-    # set the timestamp when we received it, i.e. now
-    returndict['receivedtimestamp'] = toUTC(datetime.now()).isoformat()
-    returndict['mozdefhostname'] = options.mozdefhostname
-    try:
-        for k, v in aDict.iteritems():
-            k = removeAt(k).lower()
-
-            if k in ('message', 'summary'):
-                returndict[u'summary'] = toUnicode(v)
-
-            if k in ('payload') and 'summary' not in aDict.keys():
-                # special case for heka if it sends payload as well as a summary, keep both but move payload to the details section.
-                returndict[u'summary'] = toUnicode(v)
-            elif k in ('payload'):
-                if 'details' not in returndict.keys():
-                    returndict[u'details'] = dict()
-                returndict[u'details']['payload'] = toUnicode(v)
-
-            if k in ('eventtime', 'timestamp', 'utctimestamp'):
-                returndict[u'utctimestamp'] = toUTC(v).isoformat()
-                returndict[u'timestamp'] = toUTC(v).isoformat()
-
-            if k in ('hostname', 'source_host', 'host'):
-                returndict[u'hostname'] = toUnicode(v)
-
-            if k in ('tags'):
-                if len(v) > 0:
-                    returndict[u'tags'] = v
-
-            # nxlog keeps the severity name in syslogseverity,everyone else should use severity or level.
-            if k in ('syslogseverity', 'severity', 'severityvalue', 'level'):
-                returndict[u'severity'] = toUnicode(v).upper()
-
-            if k in ('facility', 'syslogfacility'):
-                returndict[u'facility'] = toUnicode(v)
-
-            if k in ('pid', 'processid'):
-                returndict[u'processid'] = toUnicode(v)
-
-            # nxlog sets sourcename to the processname (i.e. sshd), everyone else should call it process name or pname
-            if k in ('pname', 'processname', 'sourcename'):
-                returndict[u'processname'] = toUnicode(v)
-
-            # the file, or source
-            if k in ('path', 'logger', 'file'):
-                returndict[u'eventsource'] = toUnicode(v)
-
-            if k in ('type', 'eventtype', 'category'):
-                returndict[u'category'] = toUnicode(v)
-
-            # custom fields as a list/array
-            if k in ('fields', 'details'):
-                if len(v) > 0:
-                    returndict[u'details'] = v
-
-            # custom fields/details as a one off, not in an array
-            # i.e. fields.something=value or details.something=value
-            # move them to a dict for consistency in querying
-            if k.startswith('fields.') or k.startswith('details.'):
-                newName = k.replace('fields.', '')
-                newName = newName.lower().replace('details.', '')
-                # add a dict to hold the details if it doesn't exist
-                if 'details' not in returndict.keys():
-                    returndict[u'details'] = dict()
-                # add field with a special case for shippers that
-                # don't send details
-                # in an array as int/floats/strings
-                # we let them dictate the data type with field_datatype
-                # convention
-                if newName.endswith('_int'):
-                    returndict[u'details'][unicode(newName)] = int(v)
-                elif newName.endswith('_float'):
-                    returndict[u'details'][unicode(newName)] = float(v)
-                else:
-                    returndict[u'details'][unicode(newName)] = toUnicode(v)
-
-
-        #nxlog windows log handling
-        if 'Domain' in aDict.keys() and 'SourceModuleType' in aDict.keys():
-            # add a dict to hold the details if it doesn't exist
-            if 'details' not in returndict.keys():
-                returndict[u'details'] = dict()
-
-            # nxlog parses all windows event fields very well
-            # copy all fields to details
-            returndict[u'details'][k]=v
-
-        if 'utctimestamp' not in returndict.keys():
-            # default in case we don't find a reasonable timestamp
-            returndict['utctimestamp'] = toUTC(datetime.now()).isoformat()
-
-    except Exception as e:
-        sys.stderr.write('esworker exception normalizing the message %r\n' % e)
-        return None
-
-    return returndict
+    '''map common key/fields to a normalized structure, see lib/keymapping.py'''
+    return keymapping.keyMapping(aDict, options.mozdefhostname, keymapping.basicKeyHandlers)
 
 
 def esConnect():
     '''open or re-open a connection to elastic search'''
-    return ElasticsearchClient((list('{0}'.format(s) for s in options.esservers)), options.esbulksize)
+    return esconnection.esConnect(options)
 
 
 class taskConsumer(object):
 
-    def __init__(self, ptRequestor, esConnection):
+    def __init__(self, ptRequestor, esConnection, state=None):
         self.ptrequestor = ptRequestor
         self.esConnection = esConnection
+        # where we checkpoint how far we've got, if anywhere
+        self.state = state
+        # the bulk generation of the last event we saved and
+        # the (generation, request time) checkpoints waiting on it being sent
+        self.lastGeneration = None
+        self.checkpoints = deque()
         # calculate our initial request window
         self.lastRequestTime = toUTC(datetime.now()) - timedelta(seconds=options.ptinterval) - \
             timedelta(seconds=options.ptbackoff)
@@ -255,6 +179,8 @@ class taskConsumer(object):
             self.esConnection.start_bulk_timer()
 
     def run(self):
+        if self.state is not None:
+            self.resume()
         while True:
             try:
                 curRequestTime = toUTC(datetime.now()) - timedelta(seconds=options.ptbackoff)
@@ -262,30 +188,10 @@ class taskConsumer(object):
                 # update last request time for the next request
                 self.lastRequestTime = curRequestTime
                 for msgid in records:
-                    msgdict = records[msgid]
-
-                    # strip any line feeds from the message itself, we just convert them
-                    # into spaces
-                    msgdict['message'] = msgdict['message'].replace('\n', ' ').replace('\r', '')
-
-                    event = dict()
-                    event['tags'] = ['papertrail', options.ptacctname]
-                    event['details'] = msgdict
-
-                    if event['details'].has_key('generated_at'):
-                        event['utctimestamp'] = toUTC(event['details']['generated_at']).isoformat()
-                    if event['details'].has_key('hostname'):
-                        event['hostname'] = event['details']['hostname']
-                    if event['details'].has_key('message'):
-                        event['summary'] = event['details']['message']
-                    if event['details'].has_key('severity'):
-                        event['severity'] = event['details']['severity']
-                    else:
-                        event['severity'] = 'INFO'
-                    event['category'] = 'syslog'
-
-                    #process message
-                    self.on_message(event, msgdict)
+                    self.process_record(records[msgid])
+                self.checkpoint(curRequestTime)
+                if pluginStats.due(options.pluginstatsinterval):
+                    savePluginStats(self.esConnection, options.mozdefhostname)
 
                 time.sleep(options.ptinterval)
 
@@ -295,6 +201,102 @@ class taskConsumer(object):
                 sys.stdout.write('Exception while handling message: %r'%e)
                 sys.exit(1)
 
+    def resume(self):
+        '''catch up from our last checkpoint (or the configured backfill start)
+           before going back to polling one interval at a time
+        '''
+        stime = self.state.data.get('lastrequesttime', options.ptbackfillstart)
+        if not stime:
+            return
+        stime = toUTC(stime)
+        etime = toUTC(datetime.now()) - timedelta(seconds=options.ptbackoff)
+        if etime - stime > timedelta(seconds=options.ptinterval):
+            lastIds = self.backfill(stime, etime)
+            # the first poll overlaps the last window, skip what we've seen
+            self.ptrequestor._evidcache = list(lastIds)
+            self.lastRequestTime = etime
+        else:
+            self.lastRequestTime = stime
+
+    def backfill(self, stime, etime):
+        '''fetch stime to etime in windows, a few at a time, indexing them in order
+           and checkpointing as each one is done
+           returns the event ids of the last window
+        '''
+        threads = max(1, options.ptbackfillthreads)
+        sys.stdout.write('backfilling papertrail from {0} to {1}\n'.format(stime.isoformat(), etime.isoformat()))
+        pending = deque()
+        lastIds = set()
+        executor = ThreadPoolExecutor(max_workers=threads)
+        try:
+            for (wstime, wetime) in backfillWindows(stime, etime, options.ptbackfillwindow):
+                pending.append((wetime, executor.submit(self.ptrequestor.fetch, options.ptquery, wstime, wetime)))
+                # keep the pool busy while we index, without fetching far ahead of ourselves
+                if len(pending) >= threads * 2:
+                    lastIds = self.index_window(pending.popleft(), lastIds)
+            while pending:
+                lastIds = self.index_window(pending.popleft(), lastIds)
+        finally:
+            for (wetime, future) in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+        return lastIds
+
+    def index_window(self, window, lastIds):
+        '''index a fetched window, skipping events its neighbour already had'''
+        (wetime, future) = window
+        records = future.result()
+        for msgdict in records:
+            if msgdict['id'] not in lastIds:
+                self.process_record(msgdict)
+        self.checkpoint(wetime)
+        return set(msgdict['id'] for msgdict in records)
+
+    def checkpoint(self, requestTime):
+        '''remember we've indexed everything up to requestTime
+           once the bulk has sent every event we saved before it
+        '''
+        if self.state is None:
+            return
+        self.checkpoints.append((self.lastGeneration, requestTime))
+        confirmed = None
+        if options.esbulksize != 0:
+            confirmed = self.esConnection.bulk_confirmed()
+        latest = None
+        while self.checkpoints:
+            (generation, checkpointTime) = self.checkpoints[0]
+            if generation is not None and (confirmed is None or generation > confirmed):
+                # still in the bulk, or re-queued after a failed flush
+                break
+            latest = self.checkpoints.popleft()[1]
+        if latest is not None:
+            self.state.data['lastrequesttime'] = latest.isoformat()
+            self.state.save()
+
+    def process_record(self, msgdict):
+        # strip any line feeds from the message itself, we just convert them
+        # into spaces
+        msgdict['message'] = msgdict['message'].replace('\n', ' ').replace('\r', '')
+
+        event = dict()
+        event['tags'] = ['papertrail', options.ptacctname]
+        event['details'] = msgdict
+
+        if event['details'].has_key('generated_at'):
+            event['utctimestamp'] = toUTC(event['details']['generated_at']).isoformat()
+        if event['details'].has_key('hostname'):
+            event['hostname'] = event['details']['hostname']
+        if event['details'].has_key('message'):
+            event['summary'] = event['details']['message']
+        if event['details'].has_key('severity'):
+            event['severity'] = event['details']['severity']
+        else:
+            event['severity'] = 'INFO'
+        event['category'] = 'syslog'
+
+        #process message
+        self.on_message(event, msgdict)
+
     def on_message(self, body, message):
         #print("RECEIVED MESSAGE: %r" % (body, ))
         try:
@@ -339,9 +341,6 @@ class taskConsumer(object):
                 #message.ack()
                 return
 
-            # make a json version for posting to elastic search
-            jbody = json.JSONEncoder().encode(normalizedDict)
-
             if isCEF(normalizedDict):
                 # cef records are set to the 'deviceproduct' field value.
                 metadata['doc_type'] = 'cef'
@@ -359,9 +358,12 @@ class taskConsumer(object):
                     index=metadata['index'],
                     doc_id=metadata['id'],
                     doc_type=metadata['doc_type'],
-                    body=jbody,
+                    body=normalizedDict,
                     bulk=bulk
                 )
+                if bulk:
+                    # checkpoints wait for this generation to be sent
+                    self.lastGeneration = res
 
             except (ElasticsearchBadServer, ElasticsearchInvalidIndex) as e:
                 # handle loss of server or race condition with index rotation/creation/aliasing
@@ -387,112 +389,6 @@ class taskConsumer(object):
             sys.stderr.write("esworker exception in events queue %r\n" % e)
 
 
-def registerPlugins():
-    pluginList = list()   # tuple of module,registration dict,priority
-    plugin_manager = pynsive.PluginManager()
-    if os.path.exists('plugins'):
-        modules = pynsive.list_modules('plugins')
-        for mname in modules:
-            module = pynsive.import_module(mname)
-            reload(module)
-            if not module:
-                raise ImportError('Unable to load module {}'.format(mname))
-            else:
-                if 'message' in dir(module):
-                    mclass = module.message()
-                    mreg = mclass.registration
-                    if 'priority' in dir(mclass):
-                        mpriority = mclass.priority
-                    else:
-                        mpriority = 100
-                    if isinstance(mreg, list):
-                        print('[*] plugin {0} registered to receive messages with {1}'.format(mname, mreg))
-                        pluginList.append((mclass, mreg, mpriority))
-    return pluginList
-
-
-def checkPlugins(pluginList, lastPluginCheck):
-    if abs(datetime.now() - lastPluginCheck).seconds > options.plugincheckfrequency:
-        # print('[*] checking plugins')
-        lastPluginCheck = datetime.now()
-        pluginList = registerPlugins()
-        return pluginList, lastPluginCheck
-    else:
-        return pluginList, lastPluginCheck
-
-
-def dict2List(inObj):
-    '''given a dictionary, potentially with multiple sub dictionaries
-       return a list of the dict keys and values
-    '''
-    if isinstance(inObj, dict):
-        for key, value in inObj.iteritems():
-            if isinstance(value, dict):
-                for d in dict2List(value):
-                    yield d
-            elif isinstance(value, list):
-                yield key.encode('ascii', 'ignore').lower()
-                for l in dict2List(value):
-                    yield l
-            else:
-                yield key.encode('ascii', 'ignore').lower()
-                if isinstance(value, str):
-                    yield value.lower()
-                elif isinstance(value, unicode):
-                    yield value.encode('ascii', 'ignore').lower()
-                else:
-                    yield value
-    elif isinstance(inObj, list):
-        for v in inObj:
-            if isinstance(v, str):
-                yield v.lower()
-            elif isinstance(v, unicode):
-                yield v.encode('ascii', 'ignore').lower()
-            elif isinstance(v, list):
-                for l in dict2List(v):
-                    yield l
-            elif isinstance(v,dict):
-                for d in dict2List(v):
-                    yield d
-            else:
-                yield v
-    else:
-        yield ''
-
-
-def sendEventToPlugins(anevent, metadata, pluginList):
-    '''compare the event to the plugin registrations.
-       plugins register with a list of keys or values
-       or values they want to match on
-       this function compares that registration list
-       to the current event and sends the event to plugins
-       in order
-    '''
-    if not isinstance(anevent, dict):
-        raise TypeError('event is type {0}, should be a dict'.format(type(anevent)))
-
-    # expecting tuple of module,criteria,priority in pluginList
-    # sort the plugin list by priority
-    for plugin in sorted(pluginList, key=itemgetter(2), reverse=False):
-        # assume we don't run this event through the plugin
-        send = False
-        if isinstance(plugin[1], list):
-            try:
-                if (set(plugin[1]).intersection([e for e in dict2List(anevent)])):
-                    send = True
-            except TypeError:
-                sys.stderr.write('TypeError on set intersection for dict {0}'.format(anevent))
-                return (anevent, metadata)
-        if send:
-            (anevent, metadata) = plugin[0].onMessage(anevent, metadata)
-            if anevent is None:
-                # plug-in is signalling to drop this message
-                # early exit
-                return (anevent, metadata)
-
-    return (anevent, metadata)
-
-
 def main():
     if hasUWSGI:
         sys.stdout.write("started as uwsgi mule {0}\n".format(uwsgi.mule_id()))
@@ -502,19 +398,22 @@ def main():
     # establish api interface with papertrail
     ptRequestor = PTRequestor(options.ptapikey, evmax=options.ptquerymax)
 
-    # consume our queue
-    taskConsumer(ptRequestor, es).run()
+    # checkpoint our progress so a restart picks up where we left off
+    state = None
+    if options.ptstatefile:
+        state = State(options.ptstatefile)
 
+    # consume our queue
+    taskConsumer(ptRequestor, es, state).run()
 
 
 def initConfig():
     #capture the hostname
     options.mozdefhostname = getConfig('mozdefhostname', socket.gethostname(), options.configfile)
+    # seconds a utcNow() timestamp is reused for before making a new one
+    options.utcnowtick = getConfig('utcnowtick', 0.001, options.configfile)
 
-    # elastic search options. set esbulksize to a non-zero value to enable bulk posting, set timeout to post no matter how many events after X seconds.
-    options.esservers = list(getConfig('esservers', 'http://localhost:9200', options.configfile).split(','))
-    options.esbulksize = getConfig('esbulksize', 0, options.configfile)
-    options.esbulktimeout = getConfig('esbulktimeout', 30, options.configfile)
+    esconnection.initConfig(options)
 
     # papertrail configuration
     options.ptapikey = getConfig('papertrailapikey', 'none', options.configfile)
@@ -522,7 +421,15 @@ def initConfig():
     options.ptinterval = getConfig('papertrailinterval', 60, options.configfile)
     options.ptbackoff = getConfig('papertrailbackoff', 300, options.configfile)
     options.ptacctname = getConfig('papertrailaccount', 'unset', options.configfile)
+    # most events to take from one poll, or one backfill window, the rest are skipped
     options.ptquerymax = getConfig('papertrailmaxevents', 2000, options.configfile)
+    # backfill: set a state file to checkpoint progress to and catch up from there on restart,
+    # backfillstart is where to catch up from the first time (blank starts from now)
+    # the gap is fetched in windows of backfillwindow seconds, backfillthreads at a time
+    options.ptstatefile = getConfig('papertrailstatefile', '', options.configfile)
+    options.ptbackfillstart = getConfig('papertrailbackfillstart', '', options.configfile)
+    options.ptbackfillwindow = getConfig('papertrailbackfillwindow', 3600, options.configfile)
+    options.ptbackfillthreads = getConfig('papertrailbackfillthreads', 4, options.configfile)
 
     # plugin options
     # secs to pass before checking for new/updated plugins
@@ -530,6 +437,8 @@ def initConfig():
     # regular updates are disabled for now,
     # though we set the frequency anyway.
     options.plugincheckfrequency = getConfig('plugincheckfrequency', 120, options.configfile)
+    # secs between saving per plugin timings as a mozdefstats event, 0 to disable
+    options.pluginstatsinterval = getConfig('pluginstatsinterval', 300, options.configfile)
 
 
 if __name__ == '__main__':
@@ -538,6 +447,7 @@ if __name__ == '__main__':
     parser.add_option("-c", dest='configfile', default=sys.argv[0].replace('.py', '.conf'), help="configuration file to use")
     (options, args) = parser.parse_args()
     initConfig()
+    setTick(options.utcnowtick)
 
     # open ES connection globally so we don't waste time opening it per message
     es = esConnect()
@@ -545,6 +455,6 @@ if __name__ == '__main__':
     # force a check for plugins and establish the plugin list
     pluginList = list()
     lastPluginCheck = datetime.now()-timedelta(minutes=60)
-    pluginList, lastPluginCheck = checkPlugins(pluginList, lastPluginCheck)
+    pluginList, lastPluginCheck = checkPlugins(pluginList, lastPluginCheck, options.plugincheckfrequency)
 
     main()
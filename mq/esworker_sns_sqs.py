@@ -15,6 +15,7 @@ import os
 import sys
 import socket
 import time
+from threading import Lock
 from configlib import getConfig, OptionParser
 from datetime import datetime, timedelta
 import pytz
@@ -27,9 +28,12 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../lib'))
 from utilities.toUTC import toUTC
-from elasticsearch_client import ElasticsearchClient, ElasticsearchBadServer, ElasticsearchInvalidIndex, ElasticsearchException
+from utilities.utcNow import utcNow, setTick
+from elasticsearch_client import ElasticsearchBadServer, ElasticsearchInvalidIndex, ElasticsearchException
 
-from lib.plugins import sendEventToPlugins, checkPlugins
+from lib import esconnection
+from lib.plugins import sendEventToPlugins, checkPlugins, pluginStats, savePluginStats
+from lib.sqs import SQSConsumer
 
 # running under uwsgi?
 try:
@@ -41,7 +45,7 @@ except ImportError as e:
 
 def esConnect():
     '''open or re-open a connection to elastic search'''
-    return ElasticsearchClient((list('{0}'.format(s) for s in options.esservers)), options.esbulksize)
+    return esconnection.esConnect(options)
 
 
 class taskConsumer(object):
@@ -50,6 +54,9 @@ class taskConsumer(object):
         self.connection = mqConnection
         self.esConnection = esConnection
         self.taskQueue = taskQueue
+        self.consumer = None
+        # only one processor thread swaps in a new ES client at a time
+        self.reconnectLock = Lock()
 
         self.pluginList = list()
         lastPluginCheck = datetime.now() - timedelta(minutes=60)
@@ -64,28 +71,67 @@ class taskConsumer(object):
 
     def run(self):
         self.taskQueue.set_message_class(RawMessage)
-
-        while True:
-            try:
-                records = self.taskQueue.get_messages(self.options.prefetch)
-                for msg in records:
-                    msg_body = msg.get_body()
-                    try:
-                        # get_body() should be json
-                        message_json = json.loads(msg_body)
-                        event = self.on_message(message_json)
-                        # delete message from queue
-                        self.taskQueue.delete_message(msg)
-                    except ValueError:
-                        sys.stdout.write('Invalid message, not JSON <dropping message and continuing>: %r\n' % msg_body)
-                        self.taskQueue.delete_message(msg)
-                        continue
-                time.sleep(.1)
-            except ValueError as e:
-                sys.stdout.write('Exception while handling message: %r' % e)
-                sys.exit(1)
-
-    def on_message(self, message):
+        confirmed = flush = None
+        if self.options.esbulksize != 0:
+            # only delete messages once their bulk has made it to ES,
+            # asking whichever ES client we have at the time
+            confirmed = lambda: self.esConnection.bulk_confirmed()
+            flush = lambda: self.esConnection.flush_bulk()
+        self.consumer = SQSConsumer(
+            self.taskQueue,
+            self.process_message,
+            receivers=self.options.receivers,
+            processors=self.options.processors,
+            waitTime=self.options.waittime,
+            batchSize=self.options.prefetch,
+            confirmed=confirmed,
+            flush=flush,
+            periodic=self.periodic)
+        self.consumer.run()
+
+    def periodic(self):
+        if pluginStats.due(self.options.pluginstatsinterval):
+            savePluginStats(self.esConnection, self.options.mozdefhostname)
+
+    def process_message(self, msg):
+        '''save an SQS message, returning the bulk generation it was saved with'''
+        msg_body = msg.get_body()
+        try:
+            # get_body() should be json
+            message_json = json.loads(msg_body)
+        except ValueError:
+            sys.stdout.write('Invalid message, not JSON <dropping message and continuing>: %r\n' % msg_body)
+            return None
+        esConnection = self.esConnection
+        generation = self.on_message(message_json, esConnection)
+        if generation is not None and esConnection is not self.esConnection:
+            # saved in the bulk of a client we've since given up on
+            return SQSConsumer.RETRY
+        return generation
+
+    def reconnect(self, failedConnection=None):
+        '''swap in a new ES client, messages still waiting on
+           the old one's bulk are left to come back from the queue.
+           Given the client that failed, does nothing if another
+           thread has already replaced it
+        '''
+        with self.reconnectLock:
+            if failedConnection is not None and failedConnection is not self.esConnection:
+                return
+            if self.consumer is not None:
+                self.consumer.deleteConfirmed()
+            oldConnection = self.esConnection
+            self.esConnection = esConnect()
+            if self.options.esbulksize != 0:
+                oldConnection.finish_bulk()
+                self.esConnection.start_bulk_timer()
+                if self.consumer is not None:
+                    self.consumer.forget()
+
+    def on_message(self, message, esConnection=None):
+        # save to the client process_message saw, so it can tell if it's been replaced
+        if esConnection is None:
+            esConnection = self.esConnection
         # default elastic search metadata for an event
         metadata = {
             'index': 'events',
@@ -94,7 +140,7 @@ class taskConsumer(object):
         }
         event = {}
 
-        event['receivedtimestamp'] = toUTC(datetime.now()).isoformat()
+        event['receivedtimestamp'] = utcNow()
         event['mozdefhostname'] = self.options.mozdefhostname
 
         if 'tags' in event:
@@ -137,7 +183,7 @@ class taskConsumer(object):
                 except ValueError:
                     event['summary'] = message_value
         (event, metadata) = sendEventToPlugins(event, metadata, self.pluginList)
-        self.save_event(event, metadata)
+        return self.save_event(event, metadata)
 
     def save_event(self, event, metadata):
         try:
@@ -146,32 +192,32 @@ class taskConsumer(object):
             if event is None:
                 return
 
-            # make a json version for posting to elastic search
-            jbody = json.JSONEncoder().encode(event)
-
             try:
                 bulk = False
                 if self.options.esbulksize != 0:
                     bulk = True
 
-                self.esConnection.save_event(
+                res = esConnection.save_event(
                     index=metadata['index'],
                     doc_id=metadata['id'],
                     doc_type=metadata['doc_type'],
-                    body=jbody,
+                    body=event,
                     bulk=bulk
                 )
+                if bulk:
+                    # the bulk generation, so we know when it's safe to delete the message
+                    return res
 
             except (ElasticsearchBadServer, ElasticsearchInvalidIndex) as e:
                 # handle loss of server or race condition with index rotation/creation/aliasing
                 try:
-                    self.esConnection = esConnect()
-                    return
+                    self.reconnect(esConnection)
+                    return SQSConsumer.RETRY
                 except kombu.exceptions.MessageStateError:
                     return
             except ElasticsearchException as e:
                 sys.stderr.write('ElasticSearchException: {0} reported while indexing event'.format(e))
-                return
+                return SQSConsumer.RETRY
         except ValueError as e:
             sys.stderr.write("esworker.sqs exception in events queue %r\n" % e)
 
@@ -197,11 +243,10 @@ def main():
 def initConfig():
     # capture the hostname
     options.mozdefhostname = getConfig('mozdefhostname', socket.gethostname(), options.configfile)
+    # seconds a utcNow() timestamp is reused for before making a new one
+    options.utcnowtick = getConfig('utcnowtick', 0.001, options.configfile)
 
-    # elastic search options. set esbulksize to a non-zero value to enable bulk posting, set timeout to post no matter how many events after X seconds.
-    options.esservers = list(getConfig('esservers', 'http://localhost:9200', options.configfile).split(','))
-    options.esbulksize = getConfig('esbulksize', 0, options.configfile)
-    options.esbulktimeout = getConfig('esbulktimeout', 30, options.configfile)
+    esconnection.initConfig(options)
 
     # set to sqs for Amazon
     options.mqprotocol = getConfig('mqprotocol', 'sqs', options.configfile)
@@ -210,6 +255,11 @@ def initConfig():
     options.taskexchange = getConfig('taskexchange', 'eventtask', options.configfile)
     # rabbit: how many messages to ask for at once from the message queue
     options.prefetch = getConfig('prefetch', 10, options.configfile)
+    # sqs: how many threads long poll the queue, how long (secs) each poll waits for messages
+    # and how many threads process what they receive
+    options.receivers = getConfig('receivers', 1, options.configfile)
+    options.waittime = getConfig('waittime', 20, options.configfile)
+    options.processors = getConfig('processors', 1, options.configfile)
 
     # aws options
     options.accesskey = getConfig('accesskey', '', options.configfile)
@@ -222,6 +272,8 @@ def initConfig():
     # regular updates are disabled for now,
     # though we set the frequency anyway.
     options.plugincheckfrequency = getConfig('plugincheckfrequency', 120, options.configfile)
+    # secs between saving per plugin timings as a mozdefstats event, 0 to disable
+    options.pluginstatsinterval = getConfig('pluginstatsinterval', 300, options.configfile)
 
 
 if __name__ == '__main__':
@@ -230,6 +282,7 @@ if __name__ == '__main__':
     parser.add_option("-c", dest='configfile', default=sys.argv[0].replace('.py', '.conf'), help="configuration file to use")
     (options, args) = parser.parse_args()
     initConfig()
+    setTick(options.utcnowtick)
 
     # open ES connection globally so we don't waste time opening it per message
     es = esConnect()
@@ -17,13 +17,12 @@
 import json
 import math
 import os
-import pynsive
 import sys
 import socket
 import time
+from threading import Lock
 from configlib import getConfig, OptionParser
 from datetime import datetime, timedelta
-from operator import itemgetter
 import boto.sqs
 from boto.sqs.message import RawMessage
 import base64
@@ -32,8 +31,12 @@ import kombu
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../lib'))
-from utilities.toUTC import toUTC
-from elasticsearch_client import ElasticsearchClient, ElasticsearchBadServer, ElasticsearchInvalidIndex, ElasticsearchException
+from elasticsearch_client import ElasticsearchBadServer, ElasticsearchInvalidIndex, ElasticsearchException
+from utilities.utcNow import setTick
+
+from lib.plugins import sendEventToPlugins, checkPlugins, pluginStats, savePluginStats
+from lib.sqs import SQSConsumer
+from lib import esconnection, keymapping
 
 # running under uwsgi?
 try:
@@ -43,11 +46,6 @@ except ImportError as e:
     hasUWSGI = False
 
 
-def removeAt(astring):
-    '''remove the leading @ from a string'''
-    return astring.replace('@', '')
-
-
 def isCEF(aDict):
     # determine if this is a CEF event
     # could be an event posted to the /cef http endpoint
@@ -66,131 +64,14 @@ def isCEF(aDict):
     return False
 
 
-def toUnicode(obj, encoding='utf-8'):
-    if type(obj) in [int, long, float, complex]:
-        # likely a number, convert it to string to get to unicode
-        obj = str(obj)
-    if isinstance(obj, basestring):
-        if not isinstance(obj, unicode):
-            obj = unicode(obj, encoding)
-    return obj
-
-
 def keyMapping(aDict):
-    '''map common key/fields to a normalized structure,
-       explicitly typed when possible to avoid schema changes for upsteam consumers
-       Special accomodations made for logstash,nxlog, beaver, heka and CEF
-       Some shippers attempt to conform to logstash-style @fieldname convention.
-       This strips the leading at symbol since it breaks some elastic search
-       libraries like elasticutils.
-    '''
-    returndict = dict()
-
-    # uncomment to save the source event for debugging, or chain of custody/forensics
-    # returndict['original']=aDict
-
-    # set the timestamp when we received it, i.e. now
-    returndict['receivedtimestamp'] = toUTC(datetime.now()).isoformat()
-    returndict['mozdefhostname'] = options.mozdefhostname
-    try:
-        for k, v in aDict.iteritems():
-            k = removeAt(k).lower()
-
-            if k in ('message', 'summary'):
-                returndict[u'summary'] = toUnicode(v)
-
-            if k in ('payload') and 'summary' not in aDict.keys():
-                # special case for heka if it sends payload as well as a summary, keep both but move payload to the details section.
-                returndict[u'summary'] = toUnicode(v)
-            elif k in ('payload'):
-                if 'details' not in returndict.keys():
-                    returndict[u'details'] = dict()
-                returndict[u'details']['payload'] = toUnicode(v)
-
-            if k in ('eventtime', 'timestamp', 'utctimestamp'):
-                returndict[u'utctimestamp'] = toUTC(v).isoformat()
-                returndict[u'timestamp'] = toUTC(v).isoformat()
-
-            if k in ('hostname', 'source_host', 'host'):
-                returndict[u'hostname'] = toUnicode(v)
-
-            if k in ('tags'):
-                if len(v) > 0:
-                    returndict[u'tags'] = v
-
-            # nxlog keeps the severity name in syslogseverity,everyone else should use severity or level.
-            if k in ('syslogseverity', 'severity', 'severityvalue', 'level'):
-                returndict[u'severity'] = toUnicode(v).upper()
-
-            if k in ('facility', 'syslogfacility'):
-                returndict[u'facility'] = toUnicode(v)
-
-            if k in ('pid', 'processid'):
-                returndict[u'processid'] = toUnicode(v)
-
-            # nxlog sets sourcename to the processname (i.e. sshd), everyone else should call it process name or pname
-            if k in ('pname', 'processname', 'sourcename'):
-                returndict[u'processname'] = toUnicode(v)
-
-            # the file, or source
-            if k in ('path', 'logger', 'file'):
-                returndict[u'eventsource'] = toUnicode(v)
-
-            if k in ('type', 'eventtype', 'category'):
-                returndict[u'category'] = toUnicode(v)
-
-            # custom fields as a list/array
-            if k in ('fields', 'details'):
-                if len(v) > 0:
-                    returndict[u'details'] = v
-
-            # custom fields/details as a one off, not in an array
-            # i.e. fields.something=value or details.something=value
-            # move them to a dict for consistency in querying
-            if k.startswith('fields.') or k.startswith('details.'):
-                newName = k.replace('fields.', '')
-                newName = newName.lower().replace('details.', '')
-                # add a dict to hold the details if it doesn't exist
-                if 'details' not in returndict.keys():
-                    returndict[u'details'] = dict()
-                # add field with a special case for shippers that
-                # don't send details
-                # in an array as int/floats/strings
-                # we let them dictate the data type with field_datatype
-                # convention
-                if newName.endswith('_int'):
-                    returndict[u'details'][unicode(newName)] = int(v)
-                elif newName.endswith('_float'):
-                    returndict[u'details'][unicode(newName)] = float(v)
-                else:
-                    returndict[u'details'][unicode(newName)] = toUnicode(v)
-
-
-        #nxlog windows log handling
-        if 'Domain' in aDict.keys() and 'SourceModuleType' in aDict.keys():
-            # add a dict to hold the details if it doesn't exist
-            if 'details' not in returndict.keys():
-                returndict[u'details'] = dict()
-
-            # nxlog parses all windows event fields very well
-            # copy all fields to details
-            returndict[u'details'][k]=v
-
-        if 'utctimestamp' not in returndict.keys():
-            # default in case we don't find a reasonable timestamp
-            returndict['utctimestamp'] = toUTC(datetime.now()).isoformat()
-
-    except Exception as e:
-        sys.stderr.write(
-            'esworker.sqs exception normalizing the message %r\n' % e)
-        return None
-
-    return returndict
+    '''map common key/fields to a normalized structure, see lib/keymapping.py'''
+    return keymapping.keyMapping(aDict, options.mozdefhostname, keymapping.basicKeyHandlers)
 
 
 def esConnect():
     '''open or re-open a connection to elastic search'''
-    return ElasticsearchClient((list('{0}'.format(s) for s in options.esservers)), options.esbulksize)
+    return esconnection.esConnect(options)
 
 
 class taskConsumer(object):
@@ -199,6 +80,9 @@ class taskConsumer(object):
         self.connection = mqConnection
         self.esConnection = esConnection
         self.taskQueue = taskQueue
+        self.consumer = None
+        # only one processor thread swaps in a new ES client at a time
+        self.reconnectLock = Lock()
 
         if options.esbulksize != 0:
             # if we are bulk posting enable a timer to occasionally flush the bulker even if it's not full
@@ -209,61 +93,100 @@ class taskConsumer(object):
         # Boto expects base64 encoded messages - but if the writer is not boto it's not necessarily base64 encoded
         # Thus we've to detect that and decode or not decode accordingly
         self.taskQueue.set_message_class(RawMessage)
-        while True:
+        confirmed = flush = None
+        if options.esbulksize != 0:
+            # only delete messages once their bulk has made it to ES,
+            # asking whichever ES client we have at the time
+            confirmed = lambda: self.esConnection.bulk_confirmed()
+            flush = lambda: self.esConnection.flush_bulk()
+        self.consumer = SQSConsumer(
+            self.taskQueue,
+            self.process_message,
+            receivers=options.receivers,
+            processors=options.processors,
+            waitTime=options.waittime,
+            batchSize=options.prefetch,
+            confirmed=confirmed,
+            flush=flush,
+            periodic=self.periodic)
+        try:
+            self.consumer.run()
+        except KeyboardInterrupt:
+            sys.exit(1)
+
+    def periodic(self):
+        if pluginStats.due(options.pluginstatsinterval):
+            savePluginStats(self.esConnection, options.mozdefhostname)
+
+    def process_message(self, msg):
+        '''decode and save an SQS message, returning the bulk generation it was saved with'''
+        # msg.id is the id,
+        # get_body() should be json
+
+        # pre process the message a bit
+        tmp = msg.get_body()
+        try:
+            msgbody = json.loads(tmp)
+        except ValueError:
+            # If Boto wrote to the queue, it might be base64 encoded, so let's decode that
             try:
-                records=self.taskQueue.get_messages(options.prefetch)  #10 max
-                for msg in records:
-                    # msg.id is the id,
-                    # get_body() should be json
-
-                    # pre process the message a bit
-                    tmp = msg.get_body()
-                    try:
-                        msgbody = json.loads(tmp)
-                    except ValueError:
-                        # If Boto wrote to the queue, it might be base64 encoded, so let's decode that
-                        try:
-                            tmp = base64.b64decode(tmp)
-                            msgbody = json.loads(tmp)
-                        except:
-                            sys.stdout.write('invalid message, not JSON <dropping message and continuing>: %r\n' % msg.get_body())
-                            self.taskQueue.delete_message(msg)
-                            continue
-
-                    event = dict()
-                    event = msgbody
-
-                    # Was this message sent by fluentd-sqs
-                    fluentd_sqs_specific_fields = {
-                        'az', 'instance_id', '__tag'}
-                    if fluentd_sqs_specific_fields.issubset(
-                            set(msgbody.keys())):
-                        # Until we can influence fluentd-sqs to set the
-                        # 'customendpoint' key before submitting to SQS, we'll
-                        # need to do it here
-                        # TODO : Change nubis fluentd output to include
-                        # 'customendpoint'
-                        event['customendpoint'] = True
-
-                    if 'tags' in event:
-                        event['tags'].extend([options.taskexchange])
-                    else:
-                        event['tags'] = [options.taskexchange]
-
-                    #process message
-                    self.on_message(event, msg)
-
-                    #delete message from queue
-                    self.taskQueue.delete_message(msg)
-                time.sleep(.1)
-
-            except KeyboardInterrupt:
-                sys.exit(1)
-            except ValueError as e:
-                sys.stdout.write('Exception while handling message: %r'%e)
-                sys.exit(1)
-
-    def on_message(self, body, message):
+                tmp = base64.b64decode(tmp)
+                msgbody = json.loads(tmp)
+            except:
+                sys.stdout.write('invalid message, not JSON <dropping message and continuing>: %r\n' % msg.get_body())
+                return None
+
+        event = dict()
+        event = msgbody
+
+        # Was this message sent by fluentd-sqs
+        fluentd_sqs_specific_fields = {
+            'az', 'instance_id', '__tag'}
+        if fluentd_sqs_specific_fields.issubset(
+                set(msgbody.keys())):
+            # Until we can influence fluentd-sqs to set the
+            # 'customendpoint' key before submitting to SQS, we'll
+            # need to do it here
+            # TODO : Change nubis fluentd output to include
+            # 'customendpoint'
+            event['customendpoint'] = True
+
+        if 'tags' in event:
+            event['tags'].extend([options.taskexchange])
+        else:
+            event['tags'] = [options.taskexchange]
+
+        #process message
+        esConnection = self.esConnection
+        generation = self.on_message(event, msg, esConnection)
+        if generation is not None and esConnection is not self.esConnection:
+            # saved in the bulk of a client we've since given up on
+            return SQSConsumer.RETRY
+        return generation
+
+    def reconnect(self, failedConnection=None):
+        '''swap in a new ES client, messages still waiting on
+           the old one's bulk are left to come back from the queue.
+           Given the client that failed, does nothing if another
+           thread has already replaced it
+        '''
+        with self.reconnectLock:
+            if failedConnection is not None and failedConnection is not self.esConnection:
+                return
+            if self.consumer is not None:
+                self.consumer.deleteConfirmed()
+            oldConnection = self.esConnection
+            self.esConnection = esConnect()
+            if options.esbulksize != 0:
+                oldConnection.finish_bulk()
+                self.esConnection.start_bulk_timer()
+                if self.consumer is not None:
+                    self.consumer.forget()
+
+    def on_message(self, body, message, esConnection=None):
+        # save to the client process_message saw, so it can tell if it's been replaced
+        if esConnection is None:
+            esConnection = self.esConnection
         #print("RECEIVED MESSAGE: %r" % (body, ))
         try:
             # default elastic search metadata for an event
@@ -311,9 +234,6 @@ class taskConsumer(object):
                 #message.ack()
                 return
 
-            # make a json version for posting to elastic search
-            jbody = json.JSONEncoder().encode(normalizedDict)
-
             if isCEF(normalizedDict):
                 # cef records are set to the 'deviceproduct' field value.
                 metadata['doc_type'] = 'cef'
@@ -327,20 +247,22 @@ class taskConsumer(object):
                 if options.esbulksize != 0:
                     bulk = True
 
-                res = self.esConnection.save_event(
+                res = esConnection.save_event(
                     index=metadata['index'],
                     doc_id=metadata['id'],
                     doc_type=metadata['doc_type'],
-                    body=jbody,
+                    body=normalizedDict,
                     bulk=bulk
                 )
+                if bulk:
+                    # the bulk generation, so we know when it's safe to delete the message
+                    return res
 
             except (ElasticsearchBadServer, ElasticsearchInvalidIndex) as e:
                 # handle loss of server or race condition with index rotation/creation/aliasing
                 try:
-                    self.esConnection = esConnect()
-                    #message.requeue()
-                    return
+                    self.reconnect(esConnection)
+                    return SQSConsumer.RETRY
                 except kombu.exceptions.MessageStateError:
                     # state may be already set.
                     return
@@ -348,8 +270,7 @@ class taskConsumer(object):
                 # exception target for queue capacity issues reported by elastic search so catch the error, report it and retry the message
                 try:
                     sys.stderr.write('ElasticSearchException: {0} reported while indexing event'.format(e))
-                    #message.requeue()
-                    return
+                    return SQSConsumer.RETRY
                 except kombu.exceptions.MessageStateError:
                     # state may be already set.
                     return
@@ -360,112 +281,6 @@ class taskConsumer(object):
                 "esworker.sqs exception in events queue %r\n" % e)
 
 
-def registerPlugins():
-    pluginList = list()   # tuple of module,registration dict,priority
-    plugin_manager = pynsive.PluginManager()
-    if os.path.exists('plugins'):
-        modules = pynsive.list_modules('plugins')
-        for mname in modules:
-            module = pynsive.import_module(mname)
-            reload(module)
-            if not module:
-                raise ImportError('Unable to load module {}'.format(mname))
-            else:
-                if 'message' in dir(module):
-                    mclass = module.message()
-                    mreg = mclass.registration
-                    if 'priority' in dir(mclass):
-                        mpriority = mclass.priority
-                    else:
-                        mpriority = 100
-                    if isinstance(mreg, list):
-                        print('[*] plugin {0} registered to receive messages with {1}'.format(mname, mreg))
-                        pluginList.append((mclass, mreg, mpriority))
-    return pluginList
-
-
-def checkPlugins(pluginList, lastPluginCheck):
-    if abs(datetime.now() - lastPluginCheck).seconds > options.plugincheckfrequency:
-        # print('[*] checking plugins')
-        lastPluginCheck = datetime.now()
-        pluginList = registerPlugins()
-        return pluginList, lastPluginCheck
-    else:
-        return pluginList, lastPluginCheck
-
-
-def dict2List(inObj):
-    '''given a dictionary, potentially with multiple sub dictionaries
-       return a list of the dict keys and values
-    '''
-    if isinstance(inObj, dict):
-        for key, value in inObj.iteritems():
-            if isinstance(value, dict):
-                for d in dict2List(value):
-                    yield d
-            elif isinstance(value, list):
-                yield key.encode('ascii', 'ignore').lower()
-                for l in dict2List(value):
-                    yield l
-            else:
-                yield key.encode('ascii', 'ignore').lower()
-                if isinstance(value, str):
-                    yield value.lower()
-                elif isinstance(value, unicode):
-                    yield value.encode('ascii', 'ignore').lower()
-                else:
-                    yield value
-    elif isinstance(inObj, list):
-        for v in inObj:
-            if isinstance(v, str):
-                yield v.lower()
-            elif isinstance(v, unicode):
-                yield v.encode('ascii', 'ignore').lower()
-            elif isinstance(v, list):
-                for l in dict2List(v):
-                    yield l
-            elif isinstance(v,dict):
-                for d in dict2List(v):
-                    yield d
-            else:
-                yield v
-    else:
-        yield ''
-
-
-def sendEventToPlugins(anevent, metadata, pluginList):
-    '''compare the event to the plugin registrations.
-       plugins register with a list of keys or values
-       or values they want to match on
-       this function compares that registration list
-       to the current event and sends the event to plugins
-       in order
-    '''
-    if not isinstance(anevent, dict):
-        raise TypeError('event is type {0}, should be a dict'.format(type(anevent)))
-
-    # expecting tuple of module,criteria,priority in pluginList
-    # sort the plugin list by priority
-    for plugin in sorted(pluginList, key=itemgetter(2), reverse=False):
-        # assume we don't run this event through the plugin
-        send = False
-        if isinstance(plugin[1], list):
-            try:
-                if (set(plugin[1]).intersection([e for e in dict2List(anevent)])):
-                    send = True
-            except TypeError:
-                sys.stderr.write('TypeError on set intersection for dict {0}'.format(anevent))
-                return (anevent, metadata)
-        if send:
-            (anevent, metadata) = plugin[0].onMessage(anevent, metadata)
-            if anevent is None:
-                # plug-in is signalling to drop this message
-                # early exit
-                return (anevent, metadata)
-
-    return (anevent, metadata)
-
-
 def main():
     # meant only to talk to SQS using boto
     # and process events as json.
@@ -492,11 +307,10 @@ def main():
 def initConfig():
     #capture the hostname
     options.mozdefhostname = getConfig('mozdefhostname', socket.gethostname(), options.configfile)
+    # seconds a utcNow() timestamp is reused for before making a new one
+    options.utcnowtick = getConfig('utcnowtick', 0.001, options.configfile)
 
-    # elastic search options. set esbulksize to a non-zero value to enable bulk posting, set timeout to post no matter how many events after X seconds.
-    options.esservers = list(getConfig('esservers', 'http://localhost:9200', options.configfile).split(','))
-    options.esbulksize = getConfig('esbulksize', 0, options.configfile)
-    options.esbulktimeout = getConfig('esbulktimeout', 30, options.configfile)
+    esconnection.initConfig(options)
 
     # set to sqs for Amazon
     options.mqprotocol = getConfig('mqprotocol', 'sqs', options.configfile)
@@ -507,6 +321,11 @@ def initConfig():
     options.eventexchange = getConfig('eventexchange', 'events', options.configfile)
     # rabbit: how many messages to ask for at once from the message queue
     options.prefetch = getConfig('prefetch', 10, options.configfile)
+    # sqs: how many threads long poll the queue, how long (secs) each poll waits for messages
+    # and how many threads process what they receive
+    options.receivers = getConfig('receivers', 1, options.configfile)
+    options.waittime = getConfig('waittime', 20, options.configfile)
+    options.processors = getConfig('processors', 1, options.configfile)
     # rabbit: user creds
     options.mquser = getConfig('mquser', 'guest', options.configfile)
     options.mqpassword = getConfig('mqpassword', 'guest', options.configfile)
@@ -530,6 +349,8 @@ def initConfig():
     # regular updates are disabled for now,
     # though we set the frequency anyway.
     options.plugincheckfrequency = getConfig('plugincheckfrequency', 120, options.configfile)
+    # secs between saving per plugin timings as a mozdefstats event, 0 to disable
+    options.pluginstatsinterval = getConfig('pluginstatsinterval', 300, options.configfile)
 
 
 if __name__ == '__main__':
@@ -538,6 +359,7 @@ if __name__ == '__main__':
     parser.add_option("-c", dest='configfile', default=sys.argv[0].replace('.py', '.conf'), help="configuration file to use")
     (options, args) = parser.parse_args()
     initConfig()
+    setTick(options.utcnowtick)
 
     # open ES connection globally so we don't waste time opening it per message
     es = esConnect()
@@ -545,6 +367,6 @@ if __name__ == '__main__':
     # force a check for plugins and establish the plugin list
     pluginList = list()
     lastPluginCheck = datetime.now()-timedelta(minutes=60)
-    pluginList, lastPluginCheck = checkPlugins(pluginList, lastPluginCheck)
+    pluginList, lastPluginCheck = checkPlugins(pluginList, lastPluginCheck, options.plugincheckfrequency)
 
     main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+import os
+import re
+import socket
+import sys
+
+from utilities.toUTC import toUTC
+from utilities.utcNow import utcNow
+
+CLOUDTRAIL_VERB_REGEX = re.compile(r'^([A-Z][^A-Z]*)')
+
+# the verbs of calls that only look at things,
+# usually most of what cloudtrail records
+READ_ONLY_VERBS = ('Describe', 'Get', 'List')
+
+# what to do with read only calls
+READ_ONLY_ACTIONS = ('index', 'route', 'drop')
+
+# eventNames come from a fixed list of AWS APIs so the verb cache stays small,
+# this just keeps anything unexpected from growing it forever
+VERB_CACHE_SIZE = 10000
+
+
+class CloudTrailNormalizer(object):
+    '''turn cloudtrail records into mozdef events, in place.
+       Everything that's the same for every record is worked out once,
+       and each eventName is only split into its verb the first time we see it.
+       readOnly says what to do with Describe/Get/List calls:
+       index them with everything else, route them to readOnlyIndex or drop them.
+    '''
+    def __init__(self, hostname=None, readOnly='index', index='events', readOnlyIndex='cloudtrail-readonly'):
+        if readOnly not in READ_ONLY_ACTIONS:
+            raise ValueError('readOnly must be one of {0}, not {1!r}'.format(', '.join(READ_ONLY_ACTIONS), readOnly))
+        self.hostname = hostname or socket.gethostname()
+        self.processid = os.getpid()
+        self.processname = sys.argv[0]
+        self.readOnly = readOnly
+        self.index = index
+        self.readOnlyIndex = readOnlyIndex
+        # eventName: (verb, read only?)
+        self.verbs = dict()
+        self.dropped = 0
+
+    def verb(self, eventName):
+        verb = self.verbs.get(eventName)
+        if verb is None:
+            match = CLOUDTRAIL_VERB_REGEX.match(eventName)
+            if match is None:
+                verb = (eventName, False)
+            else:
+                verb = (match.group(1), match.group(1) in READ_ONLY_VERBS)
+            if len(self.verbs) >= VERB_CACHE_SIZE:
+                self.verbs = dict()
+            self.verbs[eventName] = verb
+        return verb
+
+    def normalize(self, record):
+        '''returns the (event, index) to save the record as, or None to drop it'''
+        eventVerb, eventReadOnly = self.verb(record['eventName'])
+        index = self.index
+        if eventReadOnly:
+            if self.readOnly == 'drop':
+                self.dropped += 1
+                return None
+            if self.readOnly == 'route':
+                index = self.readOnlyIndex
+
+        record['category'] = 'cloudtrail'
+        record['utctimestamp'] = toUTC(record['eventTime']).isoformat()
+        record['receivedtimestamp'] = record['timestamp'] = utcNow()
+        record['mozdefhostname'] = self.hostname
+        record['hostname'] = record['eventSource']
+        record['processid'] = self.processid
+        record['processname'] = self.processname
+        record['severity'] = 'INFO'
+        record['summary'] = '{0} performed {1} in {2}'.format(
+            record['sourceIPAddress'],
+            record['eventName'],
+            record['eventSource']
+        )
+        record['eventVerb'] = eventVerb
+        record['eventReadOnly'] = eventReadOnly
+        # the rest of what Event.add_required_fields would have filled in
+        if 'tags' not in record:
+            record['tags'] = []
+        if 'source' not in record:
+            record['source'] = 'UNKNOWN'
+        if 'details' not in record:
+            record['details'] = {}
+        return (record, index)
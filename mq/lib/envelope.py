@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+class Envelope(object):
+    '''a message carrying a list of events rather than just one.
+       Each event gets a part that stands in for the message, the
+       message is acked once every part has been, or requeued
+       (events and all) if any part was.
+    '''
+    def __init__(self, message, count):
+        self.message = message
+        self.remaining = count
+        self.requeued = False
+
+    def parts(self):
+        return [EnvelopePart(self) for num in range(self.remaining)]
+
+    def done(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            if self.requeued:
+                self.message.requeue()
+            else:
+                self.message.ack()
+
+
+class EnvelopePart(object):
+    '''one event's share of an Envelope, acked and requeued like a message'''
+
+    def __init__(self, envelope):
+        self.envelope = envelope
+
+    @property
+    def delivery_tag(self):
+        return self.envelope.message.delivery_tag
+
+    @property
+    def channel(self):
+        return self.envelope.message.channel
+
+    def ack(self):
+        self.envelope.done()
+
+    def requeue(self):
+        self.envelope.requeued = True
+        self.envelope.done()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import sys
+import os
+from configlib import getConfig
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../lib'))
+from elasticsearch_client import ElasticsearchClient
+
+
+def initConfig(options):
+    '''read the elastic search options every esworker shares'''
+    # elastic search options. set esbulksize to a non-zero value to enable bulk posting, set timeout to post no matter how many events after X seconds.
+    options.esservers = list(getConfig('esservers', 'http://localhost:9200', options.configfile).split(','))
+    options.esbulksize = getConfig('esbulksize', 0, options.configfile)
+    options.esbulktimeout = getConfig('esbulktimeout', 30, options.configfile)
+    # also post the bulk once the queued events add up to this many bytes, 0 to disable
+    options.esbulkbytes = getConfig('esbulkbytes', 0, options.configfile)
+    # send bulks from this many background threads while the next one fills, 0 sends them inline
+    options.esbulksenders = getConfig('esbulksenders', 0, options.configfile)
+    # how many bulks can be waiting on or being sent before we stop reading events
+    options.esbulkinflight = getConfig('esbulkinflight', 1, options.configfile)
+    # resend events ES rejects as too busy (429/503) this many times, waiting
+    # esbulkretrybackoff seconds, doubling each time, before giving up on them
+    options.esbulkretries = getConfig('esbulkretries', 3, options.configfile)
+    options.esbulkretrybackoff = getConfig('esbulkretrybackoff', 1.0, options.configfile)
+    # where to put events that could not be indexed, leave blank to only log them
+    options.esdeadletterindex = getConfig('esdeadletterindex', '', options.configfile)
+    options.esdeadletterfile = getConfig('esdeadletterfile', '', options.configfile)
+
+
+def esConnect(options):
+    '''open or re-open a connection to elastic search'''
+    return ElasticsearchClient(
+        (list('{0}'.format(s) for s in options.esservers)),
+        bulk_amount=options.esbulksize,
+        bulk_refresh_time=options.esbulktimeout,
+        bulk_bytes=options.esbulkbytes,
+        bulk_senders=options.esbulksenders,
+        bulk_max_in_flight=options.esbulkinflight,
+        bulk_retries=options.esbulkretries,
+        bulk_retry_backoff=options.esbulkretrybackoff,
+        dead_letter_index=options.esdeadletterindex,
+        dead_letter_file=options.esdeadletterfile
+    )
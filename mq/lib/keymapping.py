@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../lib'))
+from utilities.toUTC import toUTC
+from utilities.utcNow import utcNow
+
+
+def removeAt(astring):
+    '''remove the leading @ from a string'''
+    return astring.replace('@', '')
+
+
+def toUnicode(obj, encoding='utf-8'):
+    if type(obj) in [int, long, float, complex]:
+        # likely a number, convert it to string to get to unicode
+        obj = str(obj)
+    if isinstance(obj, basestring):
+        if not isinstance(obj, unicode):
+            obj = unicode(obj, encoding)
+    return obj
+
+
+def details(returndict):
+    '''the details dict, created if it doesn't exist yet'''
+    if u'details' not in returndict:
+        returndict[u'details'] = dict()
+    return returndict[u'details']
+
+
+def mapSourceIP(returndict, v, aDict):
+    details(returndict)['sourceipaddress'] = v
+
+
+def mapSource(returndict, v, aDict):
+    returndict[u'source'] = v
+
+
+def mapSummary(returndict, v, aDict):
+    returndict[u'summary'] = toUnicode(v)
+
+
+def mapPayload(returndict, v, aDict):
+    if 'summary' not in aDict:
+        returndict[u'summary'] = toUnicode(v)
+    else:
+        # special case for heka if it sends payload as well as a summary, keep both but move payload to the details section.
+        details(returndict)['payload'] = toUnicode(v)
+
+
+def mapTimestamp(returndict, v, aDict):
+    returndict[u'utctimestamp'] = returndict[u'timestamp'] = toUTC(v).isoformat()
+
+
+def mapHostname(returndict, v, aDict):
+    returndict[u'hostname'] = toUnicode(v)
+
+
+def mapTags(returndict, v, aDict):
+    if u'tags' not in returndict:
+        returndict[u'tags'] = []
+    if type(v) == list:
+        returndict[u'tags'] += v
+    else:
+        if len(v) > 0:
+            returndict[u'tags'].append(v)
+
+
+def mapTagsAsSent(returndict, v, aDict):
+    if len(v) > 0:
+        returndict[u'tags'] = v
+
+
+def mapSeverity(returndict, v, aDict):
+    returndict[u'severity'] = toUnicode(v).upper()
+
+
+def mapFacility(returndict, v, aDict):
+    returndict[u'facility'] = toUnicode(v)
+
+
+def mapProcessID(returndict, v, aDict):
+    returndict[u'processid'] = toUnicode(v)
+
+
+def mapProcessName(returndict, v, aDict):
+    returndict[u'processname'] = toUnicode(v)
+
+
+def mapEventSource(returndict, v, aDict):
+    returndict[u'eventsource'] = toUnicode(v)
+
+
+def mapCategory(returndict, v, aDict):
+    returndict[u'category'] = toUnicode(v)
+
+
+def mapDetails(returndict, v, aDict):
+    # custom fields as a list/array
+    if len(v) > 0:
+        returndict[u'details'] = v
+
+
+def mapDetailField(returndict, k, v):
+    '''custom fields/details as a one off, not in an array
+       i.e. fields.something=value or details.something=value
+       move them to a dict for consistency in querying
+    '''
+    newName = k.replace('fields.', '')
+    newName = newName.lower().replace('details.', '')
+    # add field with a special case for shippers that
+    # don't send details
+    # in an array as int/floats/strings
+    # we let them dictate the data type with field_datatype
+    # convention
+    if newName.endswith('_int'):
+        details(returndict)[unicode(newName)] = int(v)
+    elif newName.endswith('_float'):
+        details(returndict)[unicode(newName)] = float(v)
+    else:
+        details(returndict)[unicode(newName)] = toUnicode(v)
+
+
+# normalized (no @, lower case) key -> what to do with its value, in order
+keyHandlers = {
+    'sourceip': (mapSourceIP,),
+    # nxlog keeps the severity name in syslogseverity,everyone else should use severity or level.
+    'syslogseverity': (mapSeverity,),
+    'severity': (mapSeverity,),
+    'severityvalue': (mapSeverity,),
+    'level': (mapSeverity,),
+    'priority': (mapSeverity,),
+    'facility': (mapSource, mapFacility),
+    'syslogfacility': (mapFacility,),
+    'message': (mapSummary,),
+    'summary': (mapSummary,),
+    'payload': (mapPayload,),
+    'eventtime': (mapTimestamp,),
+    'timestamp': (mapTimestamp,),
+    'utctimestamp': (mapTimestamp,),
+    'date': (mapTimestamp,),
+    'hostname': (mapHostname,),
+    'source_host': (mapHostname,),
+    'host': (mapHostname,),
+    'tags': (mapTags,),
+    'pid': (mapProcessID,),
+    'processid': (mapProcessID,),
+    # nxlog sets sourcename to the processname (i.e. sshd), everyone else should call it process name or pname
+    'pname': (mapProcessName,),
+    'processname': (mapProcessName,),
+    'sourcename': (mapProcessName,),
+    'program': (mapProcessName,),
+    # the file, or source
+    'path': (mapEventSource,),
+    'logger': (mapEventSource,),
+    'file': (mapEventSource,),
+    'type': (mapCategory,),
+    'eventtype': (mapCategory,),
+    'category': (mapCategory,),
+    'fields': (mapDetails,),
+    'details': (mapDetails,),
+}
+
+# esworker_sqs and esworker_papertrail have never mapped sourceip, priority, program or date,
+# copied facility into source or turned tags into a list, keep their output as it was
+basicKeyHandlers = dict(keyHandlers, facility=(mapFacility,), tags=(mapTagsAsSent,))
+for key in ('sourceip', 'priority', 'program', 'date'):
+    del basicKeyHandlers[key]
+
+# raw key -> normalized key, shippers use the same handful of keys over and over
+normalizedKeys = dict()
+maxNormalizedKeys = 10000
+
+
+def normalizeKey(k):
+    try:
+        return normalizedKeys[k]
+    except KeyError:
+        if len(normalizedKeys) >= maxNormalizedKeys:
+            normalizedKeys.clear()
+        normalized = normalizedKeys[k] = removeAt(k).lower()
+        return normalized
+
+
+def keyMapping(aDict, mozdefhostname, handlers=keyHandlers):
+    '''map common key/fields to a normalized structure,
+       explicitly typed when possible to avoid schema changes for upsteam consumers
+       Special accomodations made for logstash,nxlog, beaver, heka and CEF
+       Some shippers attempt to conform to logstash-style @fieldname convention.
+       This strips the leading at symbol since it breaks some elastic search
+       libraries like elasticutils.
+       handlers is the key to handlers table to map with, keyHandlers
+       unless a worker needs its own
+    '''
+    returndict = dict()
+
+    # uncomment to save the source event for debugging, or chain of custody/forensics
+    # returndict['original']=aDict
+
+    # set the timestamp when we received it, i.e. now
+    returndict['receivedtimestamp'] = utcNow()
+    returndict['mozdefhostname'] = mozdefhostname
+    try:
+        for k, v in aDict.iteritems():
+            k = normalizeKey(k)
+            keyHandler = handlers.get(k)
+            if keyHandler is not None:
+                for handler in keyHandler:
+                    handler(returndict, v, aDict)
+            elif k.startswith('fields.') or k.startswith('details.'):
+                mapDetailField(returndict, k, v)
+
+        #nxlog windows log handling
+        if 'Domain' in aDict and 'SourceModuleType' in aDict:
+            # nxlog parses all windows event fields very well
+            # copy all fields to details
+            details(returndict)[k] = v
+
+        if 'utctimestamp' not in returndict:
+            # default in case we don't find a reasonable timestamp
+            returndict['utctimestamp'] = utcNow()
+
+    except Exception as e:
+        sys.stderr.write('esworker exception normalizing the message %r\n' % e)
+        return None
+
+    return returndict
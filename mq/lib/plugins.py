@@ -15,8 +15,53 @@ from operator import itemgetter
 from datetime import datetime
 import pynsive
 
-sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../lib'))
-from utilities.dict2List import dict2List
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../lib'))
+from utilities.token_set import TokenSet
+from plugin_stats import PluginStats
+
+# how long each plugin takes, and how often it's sent or drops events
+pluginStats = PluginStats()
+
+
+def savePluginStats(esConnection, hostname):
+    '''save how the plugins have been doing since last time as a mozdefstats event'''
+    try:
+        esConnection.save_event(
+            index='events',
+            doc_type='mozdefstats',
+            body=pluginStats.to_event(hostname))
+    except Exception as e:
+        sys.stderr.write('exception saving plugin stats %r\n' % e)
+
+
+class PluginIndex(list):
+    '''a priority ordered list of (plugin, registration, priority) tuples
+       along with an inverted index from each registration term
+       to the positions of the plugins that registered for it.
+       Built once at load time so events are only flattened once
+       instead of once per plugin.
+    '''
+    def __init__(self, pluginList=None):
+        super(PluginIndex, self).__init__(sorted(pluginList or [], key=itemgetter(2), reverse=False))
+        self.termIndex = dict()
+        for position, plugin in enumerate(self):
+            if isinstance(plugin[1], list):
+                for term in plugin[1]:
+                    try:
+                        self.termIndex.setdefault(term, set()).add(position)
+                    except TypeError:
+                        sys.stderr.write('TypeError indexing registration {0} for plugin {1}\n'.format(term, plugin[0]))
+
+    def matchingPlugins(self, fields, start=0):
+        '''given the flattened fields of an event
+           return the sorted positions (at or after start)
+           of the plugins registered on any of those fields
+        '''
+        positions = set()
+        for term, termPositions in self.termIndex.iteritems():
+            if term in fields:
+                positions.update(termPositions)
+        return sorted(p for p in positions if p >= start)
 
 
 def sendEventToPlugins(anevent, metadata, pluginList):
@@ -31,25 +76,118 @@ def sendEventToPlugins(anevent, metadata, pluginList):
         raise TypeError('event is type {0}, should be a dict'.format(type(anevent)))
 
     # expecting tuple of module,criteria,priority in pluginList
-    # sort the plugin list by priority
-    for plugin in sorted(pluginList, key=itemgetter(2), reverse=False):
-        # assume we don't run this event through the plugin
-        send = False
-        if isinstance(plugin[1], list):
+    # registerPlugins hands us an already sorted and indexed list
+    if not isinstance(pluginList, PluginIndex):
+        pluginList = PluginIndex(pluginList)
+
+    try:
+        fields = TokenSet(anevent)
+    except TypeError:
+        sys.stderr.write('TypeError on set intersection for dict {0}'.format(anevent))
+        return (anevent, metadata)
+
+    position = 0
+    while position < len(pluginList):
+        matches = pluginList.matchingPlugins(fields, position)
+        if not matches:
+            break
+        position = matches[0]
+        plugin = pluginList[position][0]
+        (anevent, metadata) = pluginStats.call(plugin, plugin.onMessage, 1, anevent, metadata)
+        if anevent is None:
+            # plug-in is signalling to drop this message
+            # early exit
+            pluginStats.dropped(plugin)
+            return (anevent, metadata)
+        # the plugin may have added fields a later plugin
+        # registered on, pick up just what it changed
+        try:
+            fields.update(anevent)
+        except TypeError:
+            sys.stderr.write('TypeError on set intersection for dict {0}'.format(anevent))
+            return (anevent, metadata)
+        position += 1
+
+    return (anevent, metadata)
+
+
+def sendMessageToPlugin(plugin, anevent, metadata):
+    '''hand one event to a plugin, dropping it
+       if the plugin raises rather than losing the batch
+    '''
+    try:
+        if hasattr(plugin, 'onMessageBatch') and not hasattr(plugin, 'onMessage'):
+            return pluginStats.call(plugin, plugin.onMessageBatch, 1, [(anevent, metadata)])[0]
+        return pluginStats.call(plugin, plugin.onMessage, 1, anevent, metadata)
+    except Exception as e:
+        sys.stderr.write('exception in plugin {0} dropping event {1}: {2!r}\n'.format(plugin, anevent, e))
+        return (None, metadata)
+
+
+def sendMessageBatchToPlugin(plugin, batch):
+    '''hand a list of (event, metadata) tuples to a plugin
+       plugins that can work on a whole batch at once
+       implement onMessageBatch, everyone else gets
+       onMessage called once per event.
+       If the batch fails the plugin gets its events one at a time
+       so only the events it can't handle are dropped
+    '''
+    if hasattr(plugin, 'onMessageBatch'):
+        try:
+            return pluginStats.call(plugin, plugin.onMessageBatch, len(batch), batch)
+        except Exception as e:
+            sys.stderr.write('exception in plugin {0} batch, retrying its events one at a time: {1!r}\n'.format(plugin, e))
+    return [sendMessageToPlugin(plugin, anevent, metadata) for (anevent, metadata) in batch]
+
+
+def sendEventsToPlugins(events, pluginList):
+    '''batch version of sendEventToPlugins
+       given a list of (event, metadata) tuples
+       walk the plugins in priority order and send each plugin
+       every event in the batch that matches its registration.
+       Each event still sees the plugins in the same order as
+       sendEventToPlugins would send them.
+       returns a list of (event, metadata) tuples in the same order,
+       with event set to None for anything a plugin dropped
+    '''
+    if not isinstance(pluginList, PluginIndex):
+        pluginList = PluginIndex(pluginList)
+
+    results = list()
+    fieldsList = list()
+    for (anevent, metadata) in events:
+        if not isinstance(anevent, dict):
+            raise TypeError('event is type {0}, should be a dict'.format(type(anevent)))
+        try:
+            fields = TokenSet(anevent)
+        except TypeError:
+            sys.stderr.write('TypeError on set intersection for dict {0}'.format(anevent))
+            fields = None
+        results.append((anevent, metadata))
+        fieldsList.append(fields)
+
+    for (plugin, registration, priority) in pluginList:
+        if not isinstance(registration, list):
+            continue
+        selected = [i for i, fields in enumerate(fieldsList)
+                    if fields is not None and fields.contains_any(registration)]
+        if not selected:
+            continue
+        processed = sendMessageBatchToPlugin(plugin, [results[i] for i in selected])
+        for i, (anevent, metadata) in zip(selected, processed):
+            results[i] = (anevent, metadata)
+            if anevent is None:
+                # plug-in is signalling to drop this message
+                pluginStats.dropped(plugin)
+                fieldsList[i] = None
+                continue
             try:
-                if (set(plugin[1]).intersection([e for e in dict2List(anevent)])):
-                    send = True
+                fieldsList[i].update(anevent)
             except TypeError:
                 sys.stderr.write('TypeError on set intersection for dict {0}'.format(anevent))
-                return (anevent, metadata)
-        if send:
-            (anevent, metadata) = plugin[0].onMessage(anevent, metadata)
-            if anevent is None:
-                # plug-in is signalling to drop this message
-                # early exit
-                return (anevent, metadata)
+                fieldsList[i] = None
 
-    return (anevent, metadata)
+    return results
 
 
 def registerPlugins():
@@ -72,7 +210,7 @@ def registerPlugins():
                     if isinstance(mreg, list):
                         print('[*] plugin {0} registered to receive messages with {1}'.format(mname, mreg))
                         pluginList.append((mclass, mreg, mpriority))
-    return pluginList
+    return PluginIndex(pluginList)
 
 
 def checkPlugins(pluginList, lastPluginCheck, checkFrequency):
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+import json
+import re
+import zlib
+from threading import Lock
+
+# how much to read from S3 at a time
+CHUNK_SIZE = 64 * 1024
+
+JSON_WHITESPACE = ' \t\n\r'
+
+
+def gunzipChunks(fileobj, chunkSize=CHUNK_SIZE):
+    '''decompress a gzip file a chunk at a time as it's read,
+       fileobj only needs a read(size), so an S3 key will do
+    '''
+    # 16 + MAX_WBITS expects a gzip header and trailer
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        data = fileobj.read(chunkSize)
+        if not data:
+            break
+        while data:
+            chunk = decompressor.decompress(data)
+            if chunk:
+                yield chunk
+            # concatenated gzip members pick up where the last one finished
+            data = decompressor.unused_data
+            if data:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunk = decompressor.flush()
+    if chunk:
+        yield chunk
+
+
+def jsonArrayItems(chunks, key='Records'):
+    '''yield the items of the array under key in a JSON document
+       handed to us as chunks of text, one item at a time,
+       so only an item or so is ever held in memory rather than the document
+    '''
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    start = re.compile(r'"{0}"\s*:\s*\['.format(re.escape(key)))
+    buf = ''
+    while True:
+        match = start.search(buf)
+        if match is not None:
+            break
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError('No {0} array found'.format(key))
+        # only the tail could be the start of a key split across chunks
+        buf = buf[-len(key) * 4:] + chunk
+    buf = buf[match.end():]
+    pos = 0
+    while True:
+        while pos < len(buf) and buf[pos] in JSON_WHITESPACE + ',':
+            pos += 1
+        if pos < len(buf):
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # most likely the rest of the item is still to come
+                item = end = None
+            if end is not None:
+                yield item
+                pos = end
+                continue
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError('Unterminated {0} array'.format(key))
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+class S3Fetcher(object):
+    '''stream records out of gzipped JSON logs in S3 (cloudtrail and the like),
+       holding on to bucket handles rather than looking them up for every key.
+       Safe to share between threads.
+    '''
+    def __init__(self, connection, chunkSize=CHUNK_SIZE):
+        self.connection = connection
+        self.chunkSize = chunkSize
+        self.buckets = dict()
+        self.lock = Lock()
+
+    def bucket(self, name):
+        with self.lock:
+            bucket = self.buckets.get(name)
+            if bucket is None:
+                # a missing bucket or key shows up as an error once we read it
+                bucket = self.buckets[name] = self.connection.get_bucket(name, validate=False)
+        return bucket
+
+    def records(self, bucketName, keyName, arrayKey='Records'):
+        key = self.bucket(bucketName).new_key(keyName)
+        try:
+            for record in jsonArrayItems(gunzipChunks(key, self.chunkSize), arrayKey):
+                yield record
+        finally:
+            key.close()
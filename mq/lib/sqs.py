@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+import sys
+import time
+from Queue import Queue, Empty
+from threading import Event, Lock, Thread
+
+# the most SQS will hand out, or delete, in one call
+SQS_BATCH_SIZE = 10
+
+
+class SQSConsumer(object):
+    '''long poll an SQS queue from several receiver threads, hand the
+       messages to a pool of processor threads and delete them in batches
+       once they've been dealt with.
+       process(message) returns the bulk generation the message's event
+       was saved with, the message is deleted once confirmed() reaches it,
+       or None to delete it straight away. A message whose process()
+       raises, or returns RETRY, is left alone to come back after
+       its visibility timeout. periodic(), if given, is called from
+       the run loop every deleteInterval for the worker's own upkeep.
+    '''
+    # returned by process() to leave a message on the queue
+    RETRY = object()
+
+    def __init__(self, queue, process, receivers=1, processors=1, waitTime=20,
+                 batchSize=SQS_BATCH_SIZE, confirmed=None, flush=None, deleteInterval=0.5, periodic=None):
+        self.queue = queue
+        self.process = process
+        self.receivers = max(1, receivers)
+        self.processors = max(1, processors)
+        self.waitTime = waitTime
+        self.batchSize = min(max(1, batchSize), SQS_BATCH_SIZE)
+        self.confirmed = confirmed
+        self.flush = flush
+        self.deleteInterval = deleteInterval
+        self.periodic = periodic
+        # enough received messages to keep the processors busy,
+        # receivers block once it's full rather than run ahead
+        self.work = Queue(maxsize=self.processors * self.batchSize * 2)
+        self.lock = Lock()
+        # (message, bulk generation) processed but not yet deleted
+        self.pending = list()
+        self.processed = 0
+        self.deleted = 0
+        self.stopping = Event()
+        self.threads = list()
+
+    def start(self):
+        for num in range(self.receivers):
+            self.startThread(self.receive, 'sqs-receiver-{0}'.format(num))
+        for num in range(self.processors):
+            self.startThread(self.processLoop, 'sqs-processor-{0}'.format(num))
+
+    def startThread(self, target, name):
+        thread = Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        '''receive and process until stopped, deleting as we go'''
+        self.start()
+        try:
+            lastProcessed = self.processed
+            while not self.stopping.wait(self.deleteInterval):
+                if self.pending and self.flush is not None and self.processed == lastProcessed and self.work.empty():
+                    # nothing new came in since last time so the bulk
+                    # may be sitting on our messages till its timer goes off,
+                    # don't let them outlive their visibility timeout
+                    self.flush()
+                lastProcessed = self.processed
+                self.deleteConfirmed()
+                if self.periodic is not None:
+                    self.periodic()
+        finally:
+            self.stopping.set()
+            for thread in self.threads:
+                thread.join()
+            if self.pending and self.flush is not None:
+                self.flush()
+            self.deleteConfirmed()
+
+    def receive(self):
+        while not self.stopping.is_set():
+            try:
+                messages = self.queue.get_messages(num_messages=self.batchSize, wait_time_seconds=self.waitTime)
+            except Exception as e:
+                sys.stderr.write('esworker.sqs exception receiving messages %r\n' % e)
+                self.stopping.wait(1)
+                continue
+            for message in messages:
+                self.work.put(message)
+
+    def processLoop(self):
+        while not (self.stopping.is_set() and self.work.empty()):
+            try:
+                message = self.work.get(timeout=0.1)
+            except Empty:
+                continue
+            try:
+                generation = self.process(message)
+            except Exception as e:
+                sys.stderr.write('esworker.sqs exception processing message %r\n' % e)
+                continue
+            if generation is self.RETRY:
+                continue
+            with self.lock:
+                self.pending.append((message, generation))
+                self.processed += 1
+
+    def forget(self):
+        '''leave every message still waiting on a bulk to come back,
+           for when the bulk they're in won't be sent
+        '''
+        with self.lock:
+            self.pending = [(message, generation) for (message, generation) in self.pending if generation is None]
+
+    def deleteConfirmed(self):
+        '''delete every processed message whose event has been written'''
+        confirmed = None
+        if self.confirmed is not None:
+            confirmed = self.confirmed()
+        with self.lock:
+            done = list()
+            waiting = list()
+            for (message, generation) in self.pending:
+                if generation is None or (confirmed is not None and generation <= confirmed):
+                    done.append(message)
+                else:
+                    waiting.append((message, generation))
+            self.pending = waiting
+        for start in range(0, len(done), SQS_BATCH_SIZE):
+            self.deleteBatch(done[start:start + SQS_BATCH_SIZE])
+
+    def deleteBatch(self, messages):
+        try:
+            results = self.queue.delete_message_batch(messages)
+        except Exception as e:
+            # they'll be back after their visibility timeout
+            sys.stderr.write('esworker.sqs exception deleting messages %r\n' % e)
+            return
+        errors = getattr(results, 'errors', None) or []
+        for error in errors:
+            sys.stderr.write('esworker.sqs could not delete message %r\n' % error)
+        self.deleted += len(messages) - len(errors)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+import re
+
+
+class SyslogParsers(object):
+    '''regexes for picking fields out of syslog messages, registered by the
+       details.program they're for and a literal prefix every message they
+       can match starts with. Patterns are compiled once, as they're registered,
+       and an event is only tried against those for its program whose prefix
+       its summary starts with, longest prefix first.
+    '''
+    def __init__(self):
+        # program: {prefix length: {prefix: [(regex, fields)]}}
+        self.programs = dict()
+        # program: its prefix lengths, longest first
+        self.lengths = dict()
+
+    def register(self, program, prefix, pattern, fields=None):
+        '''fields are the named groups to copy into details, all of them if None'''
+        regex = re.compile(pattern)
+        prefixes = self.programs.setdefault(program, dict())
+        prefixes.setdefault(len(prefix), dict()).setdefault(prefix, list()).append((regex, fields))
+        self.lengths[program] = sorted(prefixes.keys(), reverse=True)
+
+    def match(self, program, text):
+        '''the (match, fields) of the first pattern to match text, or None'''
+        prefixes = self.programs.get(program)
+        if prefixes is None:
+            return None
+        for length in self.lengths[program]:
+            patterns = prefixes[length].get(text[:length])
+            if patterns is not None:
+                for (regex, fields) in patterns:
+                    match = regex.match(text)
+                    if match is not None:
+                        return (match, fields)
+        return None
+
+    def parse(self, message):
+        '''copy what the first matching pattern picks out of the summary into details
+           returns whether anything matched
+        '''
+        details = message.get('details')
+        if not isinstance(details, dict) or 'program' not in details or 'summary' not in message:
+            return False
+        found = self.match(details['program'], message['summary'])
+        if found is None:
+            return False
+        (match, fields) = found
+        if fields is None:
+            details.update(match.groupdict())
+        else:
+            for field in fields:
+                details[field] = match.group(field)
+        return True
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+
+import multiprocessing
+import signal
+import sys
+import time
+
+
+class WorkerStats(object):
+    '''named counters for one worker, kept in a slice of shared memory
+       when running under a WorkerSupervisor so the parent can total them.
+       Only the worker writes its own slice, so no locking is needed.
+    '''
+    def __init__(self, names, counters=None, offset=0):
+        self.names = list(names)
+        if counters is None:
+            counters = [0] * len(self.names)
+        self.counters = counters
+        self.offset = offset
+
+    def increment(self, name, amount=1):
+        self.counters[self.offset + self.names.index(name)] += amount
+
+    def get(self, name):
+        return self.counters[self.offset + self.names.index(name)]
+
+    def totals(self):
+        return dict((name, self.get(name)) for name in self.names)
+
+
+class WorkerSupervisor(object):
+    '''fork count processes each running target(stats), after whatever
+       the parent has already loaded (plugins, geoip databases) so it's
+       shared copy on write, and restart any that exit.
+       Anything holding sockets or threads (ES, rabbitmq) should be
+       opened by target in the child.
+    '''
+    def __init__(self, count, target, statNames=(), statsInterval=60, restartDelay=1):
+        self.count = count
+        self.target = target
+        self.statNames = list(statNames)
+        self.statsInterval = statsInterval
+        self.restartDelay = restartDelay
+        self.counters = multiprocessing.Array('L', len(self.statNames) * count, lock=False)
+        self.processes = [None] * count
+        self.restarts = 0
+        self.running = False
+        self.lastStats = self.totals()
+        self.lastStatsTime = time.time()
+
+    def workerStats(self, slot):
+        return WorkerStats(self.statNames, self.counters, slot * len(self.statNames))
+
+    def totals(self):
+        '''the stats summed across all workers'''
+        totals = dict((name, 0) for name in self.statNames)
+        for slot in range(self.count):
+            for name, value in self.workerStats(slot).totals().iteritems():
+                totals[name] += value
+        return totals
+
+    def runWorker(self, slot):
+        # the child shouldn't try to supervise its siblings
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.target(self.workerStats(slot))
+
+    def startWorker(self, slot):
+        process = multiprocessing.Process(
+            target=self.runWorker,
+            args=(slot,),
+            name='worker-{0}'.format(slot))
+        process.start()
+        self.processes[slot] = process
+
+    def start(self):
+        self.running = True
+        for slot in range(self.count):
+            self.startWorker(slot)
+
+    def check(self):
+        '''restart any workers that have exited'''
+        for slot, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                sys.stderr.write('worker {0} (pid {1}) exited with {2}, restarting\n'.format(slot, process.pid, process.exitcode))
+                self.restarts += 1
+                self.startWorker(slot)
+
+    def reportStats(self):
+        now = time.time()
+        totals = self.totals()
+        elapsed = max(now - self.lastStatsTime, 1)
+        report = ' '.join(
+            '{0}={1} ({2:.1f}/s)'.format(name, totals[name], (totals[name] - self.lastStats[name]) / elapsed)
+            for name in self.statNames)
+        sys.stdout.write('{0} workers, {1} restarts: {2}\n'.format(self.count, self.restarts, report))
+        sys.stdout.flush()
+        self.lastStats = totals
+        self.lastStatsTime = now
+
+    def stop(self, *args):
+        self.running = False
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join()
+
+    def run(self):
+        '''start the workers and look after them until we're signalled to stop'''
+        signal.signal(signal.SIGTERM, self.stop)
+        self.start()
+        try:
+            while self.running:
+                time.sleep(self.restartDelay)
+                if not self.running:
+                    break
+                self.check()
+                if self.statsInterval and time.time() - self.lastStatsTime >= self.statsInterval:
+                    self.reportStats()
+        except KeyboardInterrupt:
+            pass
+        self.stop()
@@ -10,7 +10,7 @@
 
 import netaddr
 from utilities.toUTC import toUTC
-from datetime import datetime
+from utilities.utcNow import utcNow
 from platform import node
 
 
@@ -110,10 +110,10 @@ class message(object):
             newmessage[u'timestamp'] = toUTC(newmessage['details']['ts']).isoformat()
         else:
             # a malformed message somehow managed to crawl to us, let's put it somewhat together
-            newmessage[u'utctimestamp'] = toUTC(datetime.now()).isoformat()
-            newmessage[u'timestamp'] = toUTC(datetime.now()).isoformat()
+            newmessage[u'utctimestamp'] = utcNow()
+            newmessage[u'timestamp'] = utcNow()
 
-        newmessage[u'receivedtimestamp'] = toUTC(datetime.now()).isoformat()
+        newmessage[u'receivedtimestamp'] = utcNow()
         newmessage[u'eventsource'] = u'nsm'
         newmessage[u'severity'] = u'INFO'
         newmessage[u'mozdefhostname'] = self.mozdefhostname
@@ -47,30 +47,53 @@ class message(object):
         return location
 
     def onMessage(self, message, metadata):
+        return self.processMessage(message, metadata, dict())
+
+    def onMessageBatch(self, batch):
+        # share lookups across the batch, the same
+        # handful of addresses tend to show up over and over
+        locations = dict()
+        return [self.processMessage(message, metadata, locations) for (message, metadata) in batch]
+
+    def lookupIP(self, ipText, locations):
+        '''return the geolocation for ipText,
+           None if it's an ip we don't look up (private, loopback, etc)
+           or False if it's not an ip at all
+        '''
+        cacheable = isinstance(ipText, basestring)
+        if cacheable and ipText in locations:
+            return locations[ipText]
+        location = False
+        if isIP(ipText):
+            location = None
+            ip = netaddr.IPNetwork(ipText)[0]
+            if (not ip.is_loopback() and not ip.is_private() and not ip.is_reserved()):
+                '''lookup geoip info'''
+                location = self.ipLocation(ipText)
+        if cacheable:
+            locations[ipText] = location
+        return location
+
+    def processMessage(self, message, metadata, locations):
         if 'details' in message.keys():
             if 'sourceipaddress' in message['details'].keys():
-                ipText = message['details']['sourceipaddress']
-                if isIP(ipText):
-                    ip = netaddr.IPNetwork(ipText)[0]
-                    if (not ip.is_loopback() and not ip.is_private() and not ip.is_reserved()):
-                        '''lookup geoip info'''
-                        message['details']['sourceipgeolocation'] = self.ipLocation(ipText)
-                else:
+                location = self.lookupIP(message['details']['sourceipaddress'], locations)
+                if location is False:
                     # invalid ip sent in the field
                     # if we send on, elastic search will error, so set it
                     # to a valid, yet meaningless value
                     message['details']['sourceipaddress'] = '0.0.0.0'
+                elif location is not None:
+                    # each event gets its own copy since later plugins may modify it
+                    message['details']['sourceipgeolocation'] = dict(location)
 
             if 'destinationipaddress' in message['details'].keys():
-                ipText = message['details']['destinationipaddress']
-                if isIP(ipText):
-                    ip = netaddr.IPNetwork(ipText)[0]
-                    if (not ip.is_loopback() and not ip.is_private() and not ip.is_reserved()):
-                        '''lookup geoip info'''
-                        message['details']['destinationipgeolocation'] = self.ipLocation(ipText)
-                else:
+                location = self.lookupIP(message['details']['destinationipaddress'], locations)
+                if location is False:
                     # invalid ip sent in the field
                     # if we send on, elastic search will error, so set it
                     # to a valid, yet meaningless value
                     message['details']['destinationipaddress'] = '0.0.0.0'
+                elif location is not None:
+                    message['details']['destinationipgeolocation'] = dict(location)
         return (message, metadata)
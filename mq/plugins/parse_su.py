@@ -8,8 +8,8 @@
 
 import sys
 import os
-import re
-sys.path.append(os.path.join(os.path.dirname(__file__), "../../lib"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from lib.syslogparsers import SyslogParsers
 
 
 class message(object):
@@ -23,21 +23,13 @@ class message(object):
         self.registration = ['sshd']
         self.priority = 5
 
+        # compiled once here rather than for every message
+        self.parsers = SyslogParsers()
+        self.parsers.register(
+            'su', 'pam_unix(su',
+            '^pam_unix\(su(?:-l)?\:session\)\: session (?P<status>\w+) for user (?P<username>\w+)(?: (?:by (?:(?P<originuser>\w+))?\(uid\=(?P<uid>[0-9]+)\)?)?)?$')
 
-    def onMessage(self, message, metadata):
 
-        self.session_regexp = re.compile('^pam_unix\(su(?:-l)?\:session\)\: session (?P<status>\w+) for user (?P<username>\w+)(?: (?:by (?:(?P<originuser>\w+))?\(uid\=(?P<uid>[0-9]+)\)?)?)?$')
- 
-        if 'details' in message:
-            if 'program' in message['details']:
-                if message['details']['program'] == 'su':
-                    msg_unparsed = message['summary']
-                    if msg_unparsed.startswith('pam_unix'):
-                        session_search = re.search(self.session_regexp, msg_unparsed)
-                        if session_search:
-                            message['details']['originuser'] = session_search.group('originuser')
-                            message['details']['status'] = session_search.group('status')
-                            message['details']['uid'] = session_search.group('uid')
-                            message['details']['username'] = session_search.group('username')
-                            
+    def onMessage(self, message, metadata):
+        self.parsers.parse(message)
         return (message, metadata)
@@ -1,3 +1,4 @@
+import threading
 import time
 
 import os
@@ -135,3 +136,233 @@ class TestTimer(BulkQueueTest):
         assert queue.size() == 0
         queue.stop_timer()
         assert self.num_objects_saved() == 200
+
+
+class MockESClient(object):
+    def __init__(self, send_time=0):
+        self.send_time = send_time
+        self.saved_batches = []
+
+    def save_documents(self, documents, attempt=0):
+        time.sleep(self.send_time)
+        self.saved_batches.append(documents)
+
+
+class FailingESClient(MockESClient):
+    def __init__(self):
+        super(FailingESClient, self).__init__()
+        self.failing = True
+
+    def save_documents(self, documents, attempt=0):
+        if self.failing:
+            raise Exception('Unable to reach ES')
+        super(FailingESClient, self).save_documents(documents)
+
+
+class BusyESClient(MockESClient):
+    '''rejects the first document of each batch until it's been retried'''
+    def __init__(self, retries=1):
+        super(BusyESClient, self).__init__()
+        self.retries = retries
+        self.attempts = []
+
+    def save_documents(self, documents, attempt=0):
+        self.attempts.append(attempt)
+        if attempt < self.retries:
+            super(BusyESClient, self).save_documents(documents[1:])
+            return documents[:1]
+        super(BusyESClient, self).save_documents(documents)
+
+    def retry_delay(self, attempt):
+        return 0.2
+
+
+class TestByteThreshold(object):
+
+    def test_flush_on_bytes(self):
+        es_client = MockESClient()
+        queue = BulkQueue(es_client, threshold=100, byte_threshold=50)
+        queue.add(index='events', doc_type='event', body='{"keyname": "value0"}')
+        queue.add(index='events', doc_type='event', body='{"keyname": "value1"}')
+        assert queue.size() == 2
+        assert es_client.saved_batches == []
+        queue.add(index='events', doc_type='event', body='{"keyname": "value2"}')
+        assert queue.size() == 0
+        assert queue.bytes == 0
+        assert len(es_client.saved_batches) == 1
+        assert len(es_client.saved_batches[0]) == 3
+
+    def test_byte_threshold_disabled(self):
+        es_client = MockESClient()
+        queue = BulkQueue(es_client, threshold=100)
+        for num in range(0, 50):
+            queue.add(index='events', doc_type='event', body='{"keyname": "value' + str(num) + '"}')
+        assert queue.size() == 50
+        assert es_client.saved_batches == []
+
+
+class TestConcurrentFlush(object):
+
+    def test_add_waits_for_inflight_flush(self):
+        es_client = MockESClient(send_time=1)
+        queue = BulkQueue(es_client, threshold=100)
+        queue.add(index='events', doc_type='event', body='{"keyname": "value0"}')
+        flusher = threading.Thread(target=queue.flush)
+        flusher.start()
+        time.sleep(0.2)
+        start = time.time()
+        queue.add(index='events', doc_type='event', body='{"keyname": "value1"}')
+        assert time.time() - start >= 0.5
+        flusher.join()
+        assert len(es_client.saved_batches) == 1
+        assert len(es_client.saved_batches[0]) == 1
+        assert queue.size() == 1
+
+    def test_no_events_lost_with_timer(self):
+        es_client = MockESClient(send_time=0.01)
+        queue = BulkQueue(es_client, threshold=7, flush_time=0.05)
+        queue.start_timer()
+        for num in range(0, 500):
+            queue.add(index='events', doc_type='event', body='{"keyname": "value' + str(num) + '"}')
+        queue.stop_timer()
+        queue.flush()
+        saved = [doc['_source'] for batch in es_client.saved_batches for doc in batch]
+        assert len(saved) == 500
+        assert len(set(saved)) == 500
+
+
+class TestBackgroundSenders(object):
+
+    def test_add_does_not_wait_for_send(self):
+        es_client = MockESClient(send_time=1)
+        queue = BulkQueue(es_client, threshold=2, senders=1, max_in_flight=2)
+        start = time.time()
+        for num in range(0, 4):
+            queue.add(index='events', doc_type='event', body='{"keyname": "value' + str(num) + '"}')
+        assert time.time() - start < 0.5
+        assert len(queue.in_flight) == 2
+        queue.join()
+        assert len(queue.in_flight) == 0
+        assert len(es_client.saved_batches) == 2
+
+    def test_add_waits_at_max_in_flight(self):
+        es_client = MockESClient(send_time=0.5)
+        queue = BulkQueue(es_client, threshold=1, senders=1, max_in_flight=1)
+        start = time.time()
+        queue.add(index='events', doc_type='event', body='{"keyname": "value0"}')
+        assert time.time() - start < 0.25
+        queue.add(index='events', doc_type='event', body='{"keyname": "value1"}')
+        assert time.time() - start >= 0.4
+        queue.join()
+        assert len(es_client.saved_batches) == 2
+
+    def test_concurrent_senders(self):
+        es_client = MockESClient(send_time=0.5)
+        queue = BulkQueue(es_client, threshold=1, senders=4, max_in_flight=4)
+        start = time.time()
+        for num in range(0, 4):
+            queue.add(index='events', doc_type='event', body='{"keyname": "value' + str(num) + '"}')
+        queue.join()
+        assert time.time() - start < 1
+        assert len(es_client.saved_batches) == 4
+
+    def test_no_events_lost_with_timer(self):
+        es_client = MockESClient(send_time=0.01)
+        queue = BulkQueue(es_client, threshold=7, flush_time=0.05, senders=3, max_in_flight=4)
+        queue.start_timer()
+        for num in range(0, 500):
+            queue.add(index='events', doc_type='event', body='{"keyname": "value' + str(num) + '"}')
+        queue.stop_timer()
+        queue.flush()
+        queue.join()
+        saved = [doc['_source'] for batch in es_client.saved_batches for doc in batch]
+        assert len(saved) == 500
+        assert len(set(saved)) == 500
+
+
+class TestConfirmed(object):
+
+    def test_confirmed_after_flush(self):
+        es_client = MockESClient()
+        queue = BulkQueue(es_client, threshold=2)
+        assert queue.confirmed() == -1
+        generation = queue.add(index='events', doc_type='event', body='{"keyname": "value0"}')
+        assert generation == 0
+        assert queue.confirmed() == -1
+        assert queue.add(index='events', doc_type='event', body='{"keyname": "value1"}') == 0
+        assert queue.confirmed() == 0
+        assert queue.add(index='events', doc_type='event', body='{"keyname": "value2"}') == 1
+        assert queue.confirmed() == 0
+
+    def test_not_confirmed_while_sending(self):
+        es_client = MockESClient(send_time=0.5)
+        queue = BulkQueue(es_client, threshold=1, senders=2, max_in_flight=2)
+        queue.add(index='events', doc_type='event', body='{"keyname": "value0"}')
+        assert queue.confirmed() == -1
+        queue.join()
+        assert queue.confirmed() == 0
+
+    def test_failed_send_not_confirmed(self):
+        es_client = FailingESClient()
+        queue = BulkQueue(es_client, threshold=2)
+        queue.add(index='events', doc_type='event', body='{"keyname": "value0"}')
+        # kept for the next flush rather than raised back at us
+        queue.add(index='events', doc_type='event', body='{"keyname": "value1"}')
+        assert queue.confirmed() == -1
+        assert queue.size() == 2
+        es_client.failing = False
+        queue.flush()
+        assert queue.confirmed() == 1
+        assert len(es_client.saved_batches) == 1
+        assert len(es_client.saved_batches[0]) == 2
+
+    def test_timer_survives_failed_flush(self):
+        es_client = FailingESClient()
+        queue = BulkQueue(es_client, threshold=10, flush_time=0.1)
+        queue.add(index='events', doc_type='event', body='{"keyname": "value0"}')
+        queue.start_timer()
+        try:
+            time.sleep(0.3)
+            assert queue.size() == 1
+            es_client.failing = False
+            time.sleep(0.3)
+            assert queue.size() == 0
+            assert len(es_client.saved_batches) == 1
+        finally:
+            queue.stop_timer()
+
+
+class TestRetries(object):
+
+    def test_busy_documents_resent_after_backoff(self):
+        es_client = BusyESClient()
+        queue = BulkQueue(es_client, threshold=2)
+        queue.add(index='events', doc_type='event', body='{"keyname": "value0"}')
+        start = time.time()
+        generation = queue.add(index='events', doc_type='event', body='{"keyname": "value1"}')
+        # nobody sleeps on the retry
+        assert time.time() - start < 0.1
+        assert len(queue.retries) == 1
+        assert queue.confirmed() < generation
+        queue.flush()
+        assert len(queue.retries) == 1
+        time.sleep(0.25)
+        queue.flush()
+        assert queue.retries == []
+        assert queue.confirmed() >= generation
+        assert es_client.attempts == [0, 1]
+        saved = [doc['_source'] for batch in es_client.saved_batches for doc in batch]
+        assert sorted(saved) == ['{"keyname": "value0"}', '{"keyname": "value1"}']
+
+    def test_timer_resends(self):
+        es_client = BusyESClient()
+        queue = BulkQueue(es_client, threshold=1, flush_time=0.1)
+        queue.start_timer()
+        try:
+            generation = queue.add(index='events', doc_type='event', body='{"keyname": "value0"}')
+            assert queue.confirmed() < generation
+            time.sleep(0.5)
+            assert queue.confirmed() >= generation
+            assert es_client.attempts[:2] == [0, 1]
+        finally:
+            queue.stop_timer()
@@ -314,6 +314,23 @@ class TestBulkWritesWithLessThanThreshold(BulkTest):
         assert self.get_num_events() == 6
 
 
+class TestBulkSerializedOnce(BulkTest):
+
+    def test_bulk_queue_holds_serialized_documents(self):
+        self.es_client.save_event(body={'key': 'value'}, bulk=True)
+        queued_document = self.es_client.bulk_queue.list[0]['_source']
+        assert isinstance(queued_document, basestring)
+        assert json.loads(queued_document)['key'] == 'value'
+        assert json.loads(queued_document)['category'] == 'UNKNOWN'
+
+    def test_bulk_writing_serialized_documents(self):
+        for num in range(5):
+            self.es_client.save_event(body={"key": "value" + str(num)}, bulk=True)
+        self.flush(self.event_index_name)
+        time.sleep(5)
+        assert self.get_num_events() == 5
+
+
 class TestWriteWithID(ElasticsearchClientTest):
 
     def test_write_with_id(self):
@@ -461,3 +478,75 @@ class TestBulkInvalidFormatProblem(BulkTest):
         self.flush(self.event_index_name)
         time.sleep(5)
         assert self.get_num_events() == 1
+
+
+class MockBulkResponses(object):
+    '''stands in for es_connection.bulk, answering each bulk request
+       with the next list of item statuses'''
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.requests = []
+
+    def __call__(self, body, **kwargs):
+        lines = body.strip().split('\n')
+        documents = [json.loads(line) for line in lines[1::2]]
+        self.requests.append(documents)
+        items = []
+        for status in self.statuses.pop(0):
+            item = {'status': status}
+            if status >= 300:
+                item['error'] = {'type': 'some_exception', 'reason': 'status ' + str(status)}
+            items.append({'index': item})
+        return {'items': items}
+
+
+class TestBulkFailures(object):
+
+    def setup(self):
+        self.es_client = ElasticsearchClient(['http://127.0.0.1:1'], bulk_retry_backoff=0.01)
+
+    def documents(self, num):
+        return [{'_index': 'events', '_type': 'event', '_id': None, '_source': json.dumps({'keyname': num})} for num in range(num)]
+
+    def test_retry_rejected(self):
+        responses = MockBulkResponses([[201, 429, 201, 503], [201, 201]])
+        self.es_client.es_connection.bulk = responses
+        retry = self.es_client.save_documents(self.documents(4))
+        assert len(responses.requests) == 1
+        assert [json.loads(document['_source']) for document in retry] == [{'keyname': 1}, {'keyname': 3}]
+        assert self.es_client.save_documents(retry, 1) == []
+        assert responses.requests[1] == [{'keyname': 1}, {'keyname': 3}]
+
+    def test_retry_delay(self):
+        assert self.es_client.retry_delay(0) == 0.01
+        assert self.es_client.retry_delay(2) == 0.04
+
+    def test_dead_letter_file(self, tmpdir):
+        dead_letter_file = str(tmpdir.join('deadletter.json'))
+        self.es_client.dead_letter_file = dead_letter_file
+        self.es_client.bulk_retries = 1
+        responses = MockBulkResponses([[400, 429, 201], [429]])
+        self.es_client.es_connection.bulk = responses
+        retry = self.es_client.save_documents(self.documents(3))
+        # out of retries, dead lettered rather than handed back
+        assert self.es_client.save_documents(retry, 1) == []
+        assert len(responses.requests) == 2
+        records = [json.loads(line) for line in open(dead_letter_file)]
+        assert len(records) == 2
+        assert records[0]['status'] == 400
+        assert json.loads(records[0]['document']) == {'keyname': 0}
+        assert 'status 400' in records[0]['error']
+        assert records[1]['status'] == 429
+        assert json.loads(records[1]['document']) == {'keyname': 1}
+
+    def test_dead_letter_index(self):
+        self.es_client.dead_letter_index = 'deadletter'
+        responses = MockBulkResponses([[201, 400], [201]])
+        self.es_client.es_connection.bulk = responses
+        self.es_client.save_documents(self.documents(2))
+        assert len(responses.requests) == 2
+        record = responses.requests[1][0]
+        assert record['index'] == 'events'
+        assert record['status'] == 400
+        assert json.loads(record['document']) == {'keyname': 1}
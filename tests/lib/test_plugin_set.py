@@ -149,3 +149,9 @@ class TestPluginSet(object):
         assert parsed_message['plugin7_key'] == 'lime'
         assert parsed_message == message
         assert parsed_metadata == self.metadata
+
+    def test_run_plugins_records_stats(self):
+        message = {'apples': 'sometext', 'otherkey': 'abcd'}
+        self.plugin_set.run_plugins(message, self.metadata)
+        plugins = dict((stats['plugin'], stats) for stats in self.plugin_set.stats.snapshot()['plugins'])
+        assert plugins['test_plugins.plugin1']['invocations'] == 1
@@ -0,0 +1,76 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../lib"))
+from plugin_stats import PluginStats, LATENCY_BUCKETS
+
+import pytest
+
+
+def make_plugin(module):
+    return type('message', (object,), dict(__module__=module))()
+
+
+class TestPluginStats(object):
+    def setup(self):
+        self.stats = PluginStats()
+        self.fast = make_plugin('plugins.fast')
+        self.slow = make_plugin('plugins.slow')
+
+    def plugin_stats(self, name):
+        return [plugin for plugin in self.stats.snapshot()['plugins'] if plugin['plugin'] == name][0]
+
+    def test_record(self):
+        self.stats.record(self.fast, 0.0002)
+        self.stats.record(self.fast, 0.002, events=10, drops=2)
+        fast = self.plugin_stats('plugins.fast')
+        assert fast['invocations'] == 2
+        assert fast['events'] == 11
+        assert fast['drops'] == 2
+        assert fast['exceptions'] == 0
+        assert fast['seconds'] == pytest.approx(0.0022)
+        assert fast['averagems'] == pytest.approx(1.1)
+        counts = dict((bucket['le'], bucket['count']) for bucket in fast['histogram'])
+        assert counts['0.0005'] == 1
+        assert counts['0.005'] == 1
+        assert sum(counts.values()) == 2
+        assert len(fast['histogram']) == len(LATENCY_BUCKETS) + 1
+
+    def test_slowest_first(self):
+        self.stats.record(self.fast, 0.001)
+        self.stats.record(self.slow, 2)
+        plugins = self.stats.snapshot()['plugins']
+        assert [plugin['plugin'] for plugin in plugins] == ['plugins.slow', 'plugins.fast']
+        assert plugins[0]['histogram'][-1] == dict(le='+Inf', count=1)
+
+    def test_call(self):
+        assert self.stats.call(self.fast, lambda a, b: a + b, 1, 2, 3) == 5
+        assert self.plugin_stats('plugins.fast')['invocations'] == 1
+
+    def test_call_exception(self):
+        def fail():
+            raise KeyError('oops')
+        with pytest.raises(KeyError):
+            self.stats.call(self.fast, fail, 1)
+        assert self.plugin_stats('plugins.fast')['exceptions'] == 1
+
+    def test_dropped(self):
+        self.stats.record(self.fast, 0.001)
+        self.stats.dropped(self.fast, 3)
+        assert self.plugin_stats('plugins.fast')['drops'] == 3
+
+    def test_to_event_resets(self):
+        self.stats.record(self.fast, 0.001)
+        event = self.stats.to_event('mozdefhost')
+        assert event['category'] == 'pluginstats'
+        assert event['hostname'] == 'mozdefhost'
+        assert event['details']['plugins'][0]['plugin'] == 'plugins.fast'
+        assert 'utctimestamp' in event
+        assert self.stats.snapshot()['plugins'] == []
+
+    def test_due(self):
+        assert not self.stats.due(0)
+        assert not self.stats.due(60)
+        self.stats.started -= 61
+        assert self.stats.due(60)
+        self.stats.to_event('mozdefhost')
+        assert not self.stats.due(60)
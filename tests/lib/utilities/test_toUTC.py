@@ -89,3 +89,74 @@ class TestToUTC():
         result = toUTC(1.468443523e+11)
         self.result_is_datetime(result)
         assert str(result) == '2016-07-13 20:58:43+00:00'
+
+    def test_iso8601_zulu(self):
+        result = toUTC("2016-07-13T22:33:31.625443Z")
+        self.result_is_datetime(result)
+        assert str(result) == '2016-07-13 22:33:31.625443+00:00'
+
+    def test_iso8601_short_fraction(self):
+        result = toUTC("2016-07-13T22:33:31.5+0100")
+        self.result_is_datetime(result)
+        assert str(result) == '2016-07-13 21:33:31.500000+00:00'
+
+    def test_digit_string_epoch(self):
+        result = toUTC("1468443523")
+        self.result_is_datetime(result)
+        assert str(result) == '2016-07-13 20:58:43+00:00'
+
+    def test_fast_path_matches_fuzzy_parse(self):
+        dates = [
+            "2016-07-13T14:33:31.625443-08:00",
+            "2016-07-13 14:33:31",
+            "2016-07-13T14:33:31+05:30",
+            "2016-02-29T23:59:59.1Z",
+            "2016-12-31 23:59:59.999999+00:00",
+        ]
+        for date_str in dates:
+            fuzzy = parse(date_str, fuzzy=True)
+            if fuzzy.tzinfo is None:
+                fuzzy = pytz.timezone('UTC').localize(fuzzy)
+            assert toUTC(date_str) == fuzzy
+            assert str(toUTC(date_str)) == str(pytz.UTC.normalize(fuzzy))
+
+    def test_unparseable_fast_path_falls_back(self):
+        result = toUTC("2016-07-13T14:33:31.6254431Z")
+        self.result_is_datetime(result)
+        assert str(result) == str(parse("2016-07-13T14:33:31.6254431Z", fuzzy=True))
+
+    def test_cached_result(self):
+        first = toUTC("2017-10-27T14:01:12Z")
+        assert toUTC("2017-10-27T14:01:12Z") is first
+
+    def test_syslog_matches_fuzzy_parse(self):
+        dates = [
+            "Oct 27 14:01:12",
+            "Jan  2 00:00:00",
+            "dec 31 23:59:59",
+        ]
+        for date_str in dates:
+            fuzzy = pytz.timezone('UTC').localize(parse(date_str, fuzzy=True))
+            assert toUTC(date_str) == fuzzy
+
+    def test_syslog_result_cached_per_year(self, monkeypatch):
+        # year-less dates depend on when they're parsed
+        toUTCModule = sys.modules['utilities.toUTC']
+        monkeypatch.setattr(toUTCModule, 'thisYear', lambda: 2016)
+        first = toUTC("Oct 27 14:01:12")
+        assert toUTC("Oct 27 14:01:12") is first
+        assert str(first) == '2016-10-27 14:01:12+00:00'
+        monkeypatch.setattr(toUTCModule, 'thisYear', lambda: 2017)
+        assert str(toUTC("Oct 27 14:01:12")) == '2017-10-27 14:01:12+00:00'
+
+    def test_syslog_leap_day(self):
+        toUTCModule = sys.modules['utilities.toUTC']
+        match = toUTCModule.SYSLOG_DATE.match("Feb 29 14:01:12")
+        assert str(toUTCModule.parseSyslog(match, 2016)) == '2016-02-29 14:01:12+00:00'
+        # left to the fuzzy parse
+        assert toUTCModule.parseSyslog(match, 2017) is None
+
+    def test_fuzzy_result_not_cached(self):
+        first = toUTC("Oct 27 14:01:12 2017 somewhere")
+        assert toUTC("Oct 27 14:01:12 2017 somewhere") is not first
+        assert toUTC("Oct 27 14:01:12 2017 somewhere") == first
@@ -0,0 +1,55 @@
+import random
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../lib'))
+
+from utilities.toUTC import toUTC, DATE_STRING_CACHE
+
+
+def realistic_dates(count):
+    '''the kind of mix an esworker sees, lots of ISO-8601 and
+       syslog batches sharing second resolution timestamps'''
+    random.seed(42)
+    dates = []
+    for num in range(count):
+        second = num / 50
+        shape = random.random()
+        if shape < 0.4:
+            dates.append('2017-10-27T14:%02d:%02d.%06dZ' % (second / 60 % 60, second % 60, random.randint(0, 999999)))
+        elif shape < 0.6:
+            dates.append('2017-10-27 14:%02d:%02d-07:00' % (second / 60 % 60, second % 60))
+        elif shape < 0.9:
+            dates.append('Oct 27 14:%02d:%02d' % (second / 60 % 60, second % 60))
+        else:
+            dates.append(1509113000 + second)
+    return dates
+
+
+class TestToUTCBenchmark():
+    '''counts the work toUTC does for a realistic mix of dates
+       rather than timing it, benchmarking/workers/toutc.py has the wall clock numbers
+    '''
+    def setup(self):
+        self.dates = realistic_dates(5000)
+        DATE_STRING_CACHE.entries.clear()
+
+    def test_no_fuzzy_parses(self, monkeypatch):
+        fuzzy = []
+        toUTCModule = sys.modules['utilities.toUTC']
+        monkeypatch.setattr(toUTCModule, 'parse', lambda *args, **kwargs: fuzzy.append(args))
+        for date in self.dates:
+            toUTC(date)
+        assert fuzzy == []
+
+    def test_batches_come_from_the_cache(self):
+        strings = [date for date in self.dates if isinstance(date, str)]
+        parsed = dict()
+        misses = 0
+        for date in strings:
+            result = toUTC(date)
+            if parsed.get(date) is not result:
+                misses += 1
+                parsed[date] = result
+        # every syslog and offset timestamp repeats within its second
+        assert misses < len(strings) / 2
@@ -0,0 +1,138 @@
+import copy
+import os
+import pickle
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../../lib"))
+from utilities import token_set
+from utilities.token_set import TokenSet, TrackedDict
+from utilities.dict2List import dict2List
+
+
+class TestTokenSet():
+    def setup(self):
+        self.message = {
+            'category': 'syslog',
+            'tags': ['Example'],
+            'details': {
+                'program': 'sshd',
+                'sourceipaddress': '1.2.3.4',
+                'port': 22,
+                'nested': {'Something': u'Else'},
+            },
+        }
+        self.tokens = TokenSet(self.message)
+
+    def assert_matches_dict2List(self):
+        assert set(self.tokens) == set(dict2List(self.message))
+
+    def test_initial_tokens(self):
+        self.assert_matches_dict2List()
+        assert 'sshd' in self.tokens
+        assert 'example' in self.tokens
+        assert 'details' not in self.tokens
+        assert 22 in self.tokens
+
+    def test_contains_any(self):
+        assert self.tokens.contains_any(['nothere', 'something'])
+        assert not self.tokens.contains_any(['nothere', 'orhere'])
+
+    def test_added_key(self):
+        self.message['details']['destinationipaddress'] = '5.6.7.8'
+        self.tokens.update(self.message)
+        assert 'destinationipaddress' in self.tokens
+        self.assert_matches_dict2List()
+
+    def test_changed_value(self):
+        self.message['details']['program'] = 'su'
+        self.tokens.update(self.message)
+        assert 'sshd' not in self.tokens
+        assert 'su' in self.tokens
+        self.assert_matches_dict2List()
+
+    def test_removed_key(self):
+        del self.message['details']['sourceipaddress']
+        self.tokens.update(self.message)
+        assert 'sourceipaddress' not in self.tokens
+        assert '1.2.3.4' not in self.tokens
+        self.assert_matches_dict2List()
+
+    def test_list_modified_in_place(self):
+        self.message['tags'].append('added')
+        self.tokens.update(self.message)
+        assert 'added' in self.tokens
+        self.assert_matches_dict2List()
+
+    def test_dict_replaced_by_value(self):
+        self.message['details']['nested'] = 'flat'
+        self.tokens.update(self.message)
+        assert 'something' not in self.tokens
+        assert 'flat' in self.tokens
+        self.assert_matches_dict2List()
+
+    def test_duplicate_tokens_counted(self):
+        self.message['category'] = 'sshd'
+        self.tokens.update(self.message)
+        del self.message['details']['program']
+        self.tokens.update(self.message)
+        assert 'sshd' in self.tokens
+        self.assert_matches_dict2List()
+
+    def test_tracks_nested_dicts(self):
+        assert not isinstance(self.message, TrackedDict)
+        assert isinstance(self.message['details'], TrackedDict)
+        assert isinstance(self.message['details']['nested'], TrackedDict)
+        assert self.message == {
+            'category': 'syslog',
+            'tags': ['Example'],
+            'details': {
+                'program': 'sshd',
+                'sourceipaddress': '1.2.3.4',
+                'port': 22,
+                'nested': {'Something': u'Else'},
+            },
+        }
+
+    def test_only_changes_tokenized(self, monkeypatch):
+        tokenized = list()
+
+        def leafTokens(key, value):
+            tokenized.append(key)
+            return original(key, value)
+        original = token_set.leafTokens
+        monkeypatch.setattr(token_set, 'leafTokens', leafTokens)
+        self.message['details']['program'] = 'su'
+        self.message.setdefault('summary', 'hello')
+        self.message['details'].pop('port')
+        self.tokens.update(self.message)
+        assert sorted(tokenized) == ['program', 'summary']
+        assert 22 not in self.tokens
+        self.assert_matches_dict2List()
+
+    def test_tracked_dicts_copy(self):
+        details = self.message['details']
+        details['program'] = 'su'
+        for duplicate in (copy.deepcopy(details), pickle.loads(pickle.dumps(details, 2))):
+            assert isinstance(duplicate, TrackedDict)
+            assert duplicate == details
+            assert duplicate.touched == set()
+
+    def test_nested_dict_added(self):
+        self.message['details']['nested']['deeper'] = {'Key': 'value'}
+        self.tokens.update(self.message)
+        assert 'key' in self.tokens
+        self.message['details']['nested']['deeper']['key2'] = 'value2'
+        self.tokens.update(self.message)
+        assert 'value2' in self.tokens
+        self.assert_matches_dict2List()
+
+    def test_details_replaced(self):
+        self.message['details'] = {'program': 'su'}
+        self.tokens.update(self.message)
+        assert 'sshd' not in self.tokens
+        assert 'something' not in self.tokens
+        assert 'su' in self.tokens
+        self.assert_matches_dict2List()
+
+    def test_new_message(self):
+        self.tokens.update({'category': 'bro'})
+        assert set(self.tokens) == set(['category', 'bro'])
@@ -0,0 +1,33 @@
+import time
+from datetime import datetime
+import pytz
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../lib'))
+
+from utilities.toUTC import toUTC
+from utilities.utcNow import utcNow, setTick
+
+
+class TestUTCNow():
+
+    def teardown(self):
+        setTick(0.001)
+
+    def test_iso_utc(self):
+        now = utcNow()
+        assert now.endswith('+00:00')
+        assert toUTC(now).isoformat() == now
+        assert abs((datetime.now(pytz.UTC) - toUTC(now)).total_seconds()) < 5
+
+    def test_reused_within_tick(self):
+        setTick(60)
+        first = utcNow()
+        assert utcNow() is first
+
+    def test_new_tick(self):
+        setTick(0.01)
+        first = utcNow()
+        time.sleep(0.05)
+        assert utcNow() != first
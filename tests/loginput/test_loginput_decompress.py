@@ -0,0 +1,84 @@
+import gzip
+import os
+import sys
+import zlib
+from StringIO import StringIO
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../loginput/"))
+import decompress
+from decompress import decompressedBody, DecompressionError, UnsupportedEncoding, BodyTooLarge
+
+
+def gzipped(data):
+    compressed = StringIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as f:
+        f.write(data)
+    return compressed.getvalue()
+
+
+BODY = ''.join('{{"summary": "event {0}"}}\n'.format(num) for num in range(10000))
+
+
+class TestDecompressedBody(object):
+
+    def test_identity(self):
+        body = StringIO(BODY)
+        assert decompressedBody(body, None, 10) is body
+        assert decompressedBody(body, 'identity', 10) is body
+
+    def test_gzip(self):
+        body = decompressedBody(StringIO(gzipped(BODY)), 'gzip', len(BODY))
+        assert body.read() == BODY
+
+    def test_gzip_members(self):
+        body = decompressedBody(StringIO(gzipped('{"a": 1}\n') + gzipped('{"b": 2}\n')), 'gzip', 100)
+        assert list(body) == ['{"a": 1}\n', '{"b": 2}\n']
+
+    def test_gzip_members_across_chunks(self, monkeypatch):
+        monkeypatch.setattr(decompress, 'CHUNK_SIZE', 7)
+        first = BODY[:len(BODY) / 2]
+        body = decompressedBody(StringIO(gzipped(first) + gzipped(BODY[len(first):])), 'gzip', len(BODY))
+        assert body.read() == BODY
+
+    def test_deflate(self):
+        body = decompressedBody(StringIO(zlib.compress(BODY)), 'Deflate', len(BODY))
+        assert body.read() == BODY
+
+    def test_lines(self):
+        body = decompressedBody(StringIO(gzipped(BODY)), 'gzip', len(BODY))
+        assert list(body) == BODY.splitlines(True)
+
+    def test_no_trailing_newline(self):
+        body = decompressedBody(StringIO(gzipped('{"a": 1}\n{"b": 2}')), 'gzip', 100)
+        assert list(body) == ['{"a": 1}\n', '{"b": 2}']
+
+    def test_too_large(self):
+        body = decompressedBody(StringIO(gzipped(BODY)), 'gzip', len(BODY) - 1)
+        with pytest.raises(BodyTooLarge):
+            body.read()
+
+    def test_bomb_read_a_chunk_at_a_time(self):
+        body = decompressedBody(StringIO(gzipped('\0' * 10 * 1024 * 1024)), 'gzip', 1024 * 1024)
+        assert len(body.read(100)) == 100
+        with pytest.raises(BodyTooLarge) as e:
+            list(body)
+        assert e.value.status == 413
+
+    def test_corrupt(self):
+        body = decompressedBody(StringIO('not gzip at all'), 'gzip', 100)
+        with pytest.raises(DecompressionError) as e:
+            body.read()
+        assert e.value.status == 400
+
+    def test_unsupported(self):
+        with pytest.raises(UnsupportedEncoding) as e:
+            decompressedBody(StringIO(BODY), 'br', 100)
+        assert e.value.status == 415
+
+    @pytest.mark.skipif(not decompress.hasZstd, reason='zstandard is not installed')
+    def test_zstd(self):
+        compressed = decompress.zstandard.ZstdCompressor().compress(BODY)
+        body = decompressedBody(StringIO(compressed), 'zstd', len(BODY))
+        assert list(body) == BODY.splitlines(True)
@@ -1,15 +1,89 @@
+import gzip
+from StringIO import StringIO
+
 from loginput_test_suite import LoginputTestSuite
 
 
+def gzipped(data):
+    compressed = StringIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as f:
+        f.write(data)
+    return compressed.getvalue()
+
+
 class TestTestRoute(LoginputTestSuite):
     routes = ['/test', '/test/']
 
     status_code = 200
     body = ''
 
+
+class TestBulkRoute(LoginputTestSuite):
+    routes = []
+
+    def test_bulk(self):
+        body = '\n'.join([
+            '{"index": {"_index": "events", "_type": "event"}}',
+            '{"summary": "first event"}',
+            '{"index": {"_index": "events", "_type": "event"}}',
+            '{"summary": "second event"}',
+        ]) + '\n'
+        for route in ['/_bulk', '/_bulk/']:
+            response = self.app.post(route, body)
+            assert response.status_code == 200
+            assert response.json['errors'] is False
+            assert response.json['items'] == [{'index': {'status': 201}}, {'index': {'status': 201}}]
+
+    def test_bulk_bad_lines(self):
+        body = '{"summary": "good event"}\nnot json\n[1, 2]\n\n{"summary": "another good event"}\n'
+        response = self.app.post('/_bulk', body)
+        assert response.status_code == 200
+        assert response.json['errors'] is True
+        statuses = [item['index']['status'] for item in response.json['items']]
+        assert statuses == [201, 400, 400, 201]
+        assert 'invalid json' in response.json['items'][1]['index']['error']
+
+
+class TestEventsBatchRoute(LoginputTestSuite):
+    routes = []
+
+    def test_batch(self):
+        body = '{"summary": "first event"}\n{"summary": "second event"}\n{"summary": "third event"}'
+        for route in ['/events/_batch', '/events/_batch/']:
+            response = self.app.post(route, body)
+            assert response.status_code == 200
+            assert response.json['errors'] is False
+            assert len(response.json['items']) == 3
+
+    def test_empty_batch(self):
+        response = self.app.post('/events/_batch', '')
+        assert response.status_code == 200
+        assert response.json['items'] == []
+
+
+class TestCompressedBodies(LoginputTestSuite):
+    routes = []
+
+    def test_gzip_bulk(self):
+        body = '{"index": {"_index": "events"}}\n{"summary": "first event"}\n{"summary": "second event"}\n'
+        response = self.app.post('/_bulk', gzipped(body), headers={'Content-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert response.json['items'] == [{'index': {'status': 201}}, {'index': {'status': 201}}]
+
+    def test_gzip_events(self):
+        for route in ['/events', '/cef', '/custom/compressed']:
+            response = self.app.post(route, gzipped('{"summary": "compressed event"}'), headers={'Content-Encoding': 'gzip'})
+            assert response.status_code == 200
+
+    def test_corrupt_body(self):
+        response = self.app.post('/events', 'not gzip', headers={'Content-Encoding': 'gzip'}, expect_errors=True)
+        assert response.status_code == 400
+
+    def test_unsupported_encoding(self):
+        response = self.app.post('/events/_batch', 'whatever', headers={'Content-Encoding': 'br'}, expect_errors=True)
+        assert response.status_code == 415
+
 # Routes left need to have unit tests written for:
-# @route('/_bulk',method='POST')
-# @route('/_bulk/',method='POST')
 # @route('/_status')
 # @route('/_status/')
 # @route('/nxlog/', method=['POST','PUT'])
@@ -0,0 +1,138 @@
+import os
+import sys
+from collections import defaultdict
+
+import gevent
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../loginput/"))
+from publisher import ConfirmTracker, ConfirmingPublisher
+
+
+class MockBroker(object):
+    '''stands in for the connection, channel and producer,
+       confirming (or nacking) everything published when drained
+    '''
+    def __init__(self, nack=()):
+        self.events = defaultdict(set)
+        self.published = []
+        self.nack = set(nack)
+        self.drained = 0
+
+    def publish(self, event, exchange=None, routing_key=None):
+        self.published.append(event)
+
+    def drain_events(self, timeout=None):
+        self.drained += 1
+        for tag, event in enumerate(self.published, 1):
+            if not isinstance(event, list) and event in self.nack:
+                for callback in self.events['basic_nack']:
+                    callback(tag, False, False)
+        for callback in self.events['basic_ack']:
+            callback(len(self.published), True)
+
+
+class MockPublisher(ConfirmingPublisher):
+    def __init__(self, broker, **kwargs):
+        super(MockPublisher, self).__init__('amqp://', 'eventtask', 'eventtask', **kwargs)
+        self.broker = broker
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        self.connection = self.channel = self.producer = self.broker
+        self.tracker = ConfirmTracker()
+        self.channel.events['basic_ack'].add(self.tracker.ack)
+        self.channel.events['basic_nack'].add(self.tracker.nack)
+        self.lastTag = 0
+
+
+class TestConfirmTracker(object):
+
+    def setup(self):
+        self.tracker = ConfirmTracker()
+        for tag in range(1, 6):
+            self.tracker.add(tag)
+
+    def test_ack(self):
+        self.tracker.ack(2, False)
+        assert self.tracker.unconfirmed == set([1, 3, 4, 5])
+        assert self.tracker.confirmed([2])
+        assert not self.tracker.confirmed([1, 2])
+
+    def test_ack_multiple(self):
+        self.tracker.ack(3, True)
+        assert self.tracker.unconfirmed == set([4, 5])
+        assert self.tracker.confirmed([1, 2, 3])
+
+    def test_nack(self):
+        self.tracker.nack(2, False)
+        assert self.tracker.unconfirmed == set([1, 3, 4, 5])
+        assert self.tracker.failed == set([2])
+        assert not self.tracker.confirmed([2])
+
+    def test_nack_multiple(self):
+        self.tracker.ack(1, False)
+        self.tracker.nack(3, True)
+        assert self.tracker.unconfirmed == set([4, 5])
+        assert self.tracker.failed == set([2, 3])
+        assert self.tracker.confirmed([1])
+
+
+class TestConfirmingPublisher(object):
+
+    def test_publish(self):
+        broker = MockBroker()
+        publisher = MockPublisher(broker)
+        publisher.start()
+        publisher.publish(['a', 'b'])
+        assert broker.published == ['a', 'b']
+        assert publisher.connects == 1
+
+    def test_concurrent_requests_share_confirms(self):
+        broker = MockBroker()
+        publisher = MockPublisher(broker)
+        publisher.start()
+        requests = [gevent.spawn(publisher.publish, [str(num)]) for num in range(10)]
+        gevent.joinall(requests, raise_error=True)
+        assert sorted(broker.published) == [str(num) for num in range(10)]
+        # everything queued while the first publish was in flight
+        # is confirmed together
+        assert broker.drained <= 2
+
+    def test_window(self):
+        broker = MockBroker()
+        publisher = MockPublisher(broker, window=2)
+        publisher.start()
+        requests = [gevent.spawn(publisher.publish, [str(num)]) for num in range(6)]
+        gevent.joinall(requests, raise_error=True)
+        assert len(broker.published) == 6
+        assert broker.drained >= 3
+
+    def test_nacked(self):
+        broker = MockBroker(nack=['bad'])
+        publisher = MockPublisher(broker)
+        publisher.start()
+        good = gevent.spawn(publisher.publish, ['good'])
+        bad = gevent.spawn(publisher.publish, ['bad'])
+        gevent.joinall([good, bad])
+        assert good.successful()
+        assert not bad.successful()
+
+    def test_gives_up_after_retries(self):
+        broker = MockBroker()
+
+        def fail(*args, **kwargs):
+            raise IOError('connection reset')
+        broker.publish = fail
+        publisher = MockPublisher(broker, retries=0)
+        publisher.start()
+        with pytest.raises(IOError):
+            publisher.publish(['a'])
+
+    def test_packs_events(self):
+        broker = MockBroker()
+        publisher = MockPublisher(broker, pack=lambda events: [events[0:2], events[2:]])
+        publisher.start()
+        publisher.publish(['a', 'b', 'c'])
+        assert broker.published == [['a', 'b'], ['c']]
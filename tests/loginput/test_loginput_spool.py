@@ -0,0 +1,88 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../loginput/"))
+from spool import Spool
+
+
+class TestSpool(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = Spool(self.directory, segmentSize=100)
+        self.published = []
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def publish(self, events):
+        self.published.extend(events)
+
+    def drainAll(self):
+        while self.spool.segments:
+            self.spool.drain(self.publish, batchSize=2)
+
+    def test_append(self):
+        assert self.spool.spooling is False
+        self.spool.append([{'summary': 'first'}, {'summary': 'second'}])
+        assert self.spool.status() == dict(depth=2, segments=1, spooling=True)
+
+    def test_rotates_segments(self):
+        for num in range(10):
+            self.spool.append([{'summary': 'event {0}'.format(num), 'padding': 'x' * 50}])
+        assert len(self.spool.segments) == 5
+        assert self.spool.depth == 10
+
+    def test_drain_in_order(self):
+        for num in range(10):
+            self.spool.append([{'num': num, 'padding': 'x' * 50}])
+        self.drainAll()
+        assert [event['num'] for event in self.published] == range(10)
+        assert self.spool.status() == dict(depth=0, segments=0, spooling=False)
+        assert os.listdir(self.spool.directory) == ['lock']
+
+    def test_drain_resumes_after_failure(self):
+        self.spool.append([{'num': num} for num in range(5)])
+
+        def failing(events):
+            if events[0]['num'] == 2:
+                raise IOError('broker is down')
+            self.publish(events)
+
+        with pytest.raises(IOError):
+            self.spool.drain(failing, batchSize=2)
+        assert self.spool.depth == 3
+        self.drainAll()
+        assert [event['num'] for event in self.published] == range(5)
+
+    def test_appends_while_draining(self):
+        self.spool.append([{'num': 0}])
+        # the segment being drained is closed, new events start a new one
+        self.spool.drain(lambda events: self.spool.append([{'num': 1}]) or self.publish(events))
+        assert self.spool.status() == dict(depth=1, segments=1, spooling=True)
+        self.drainAll()
+        assert [event['num'] for event in self.published] == [0, 1]
+
+    def test_processes_claim_their_own_directory(self):
+        other = Spool(self.directory)
+        assert other.directory != self.spool.directory
+        other.lockFile.close()
+
+    def test_picks_up_previous_spool_skipping_corrupt_lines(self):
+        self.spool.append([{'num': 0}, {'num': 1}])
+        self.spool.writer.write('{"num": 2, "trunc')
+        self.spool.closeWriter()
+        self.spool.lockFile.close()
+        restarted = Spool(self.directory)
+        assert restarted.directory == self.spool.directory
+        assert restarted.status() == dict(depth=3, segments=1, spooling=True)
+        restarted.append([{'num': 3}])
+        assert len(restarted.segments) == 2
+        while restarted.segments:
+            restarted.drain(self.publish)
+        assert [event['num'] for event in self.published] == [0, 1, 3]
+        assert restarted.depth == 0
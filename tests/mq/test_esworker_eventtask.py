@@ -22,6 +22,7 @@ import os
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
 from mq import esworker_eventtask
+from mq.lib.envelope import Envelope
 
 
 class MockOptions():
@@ -75,3 +76,215 @@ class TestKeyMapping():
         }
         result = self.key_mapping(tags_dict)
         assert result['tags'] == ['example1']
+
+
+class MockChannel():
+    def __init__(self):
+        self.acks = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append((delivery_tag, multiple))
+
+
+class MockMessage():
+    def __init__(self, channel, delivery_tag):
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+
+
+class MockAckMessage(MockMessage):
+    acked = False
+    requeued = False
+
+    def ack(self):
+        self.acked = True
+
+    def requeue(self):
+        self.requeued = True
+
+
+class MockMQConnection():
+    def Producer(self, serializer):
+        return None
+
+
+class MockESConnection():
+    def __init__(self):
+        self.confirmed = -1
+        self.flushes = 0
+        self.saved = []
+
+    def bulk_confirmed(self):
+        return self.confirmed
+
+    def flush_bulk(self):
+        self.flushes += 1
+        self.confirmed += 1
+
+    def finish_bulk(self):
+        self.finished = True
+
+    def save_event(self, index, doc_type, body, doc_id=None, bulk=False):
+        if body.get('fail'):
+            raise ValueError('unserializable event')
+        self.saved.append(body)
+
+    def start_bulk_timer(self):
+        pass
+
+
+class MockAckOptions():
+    esbulksize = 0
+    prefetch = 10
+    batchtimeout = 1
+    pluginstatsinterval = 0
+
+
+class TestDeferredAcks():
+    def setup(self):
+        esworker_eventtask.options = MockAckOptions()
+        self.es_connection = MockESConnection()
+        self.consumer = esworker_eventtask.taskConsumer(MockMQConnection(), None, None, self.es_connection)
+        self.channel = MockChannel()
+
+    def test_ack_confirmed(self):
+        self.consumer.pendingAcks = [
+            (MockMessage(self.channel, 3), 1),
+            (MockMessage(self.channel, 1), 0),
+            (MockMessage(self.channel, 2), 0),
+        ]
+        self.consumer.ack_confirmed()
+        assert self.channel.acks == []
+        self.es_connection.confirmed = 0
+        self.consumer.ack_confirmed()
+        assert self.channel.acks == [(2, True)]
+        assert len(self.consumer.pendingAcks) == 1
+        self.es_connection.confirmed = 1
+        self.consumer.ack_confirmed()
+        assert self.channel.acks == [(2, True), (3, True)]
+        assert self.consumer.pendingAcks == []
+
+    def test_flush_when_idle(self):
+        self.consumer.pendingAcks = [(MockMessage(self.channel, 1), 0)]
+        self.consumer.received = 1
+        self.consumer.on_iteration()
+        assert self.es_connection.flushes == 0
+        assert self.channel.acks == []
+        self.consumer.on_iteration()
+        assert self.es_connection.flushes == 1
+        assert self.channel.acks == [(1, True)]
+
+    def test_ack_confirmed_envelope(self):
+        envelope_message = MockAckMessage(self.channel, 2)
+        first, second = Envelope(envelope_message, 2).parts()
+        self.consumer.pendingAcks = [
+            (MockMessage(self.channel, 1), 0),
+            (first, 0),
+            (second, 1),
+            (MockMessage(self.channel, 3), 0),
+        ]
+        self.es_connection.confirmed = 0
+        self.consumer.ack_confirmed()
+        # the envelope waits for its second event, holding back what's after it
+        assert self.channel.acks == [(1, True)]
+        assert not envelope_message.acked
+        self.es_connection.confirmed = 1
+        self.consumer.ack_confirmed()
+        # the envelope acks itself
+        assert envelope_message.acked
+        assert self.channel.acks == [(1, True), (3, True)]
+        assert self.consumer.pendingAcks == []
+
+    def test_ack_confirmed_requeued_envelope(self):
+        envelope_message = MockAckMessage(self.channel, 1)
+        first, second, third = Envelope(envelope_message, 3).parts()
+        self.consumer.pendingAcks = [(first, 0), (third, 1), (MockMessage(self.channel, 2), 0)]
+        # the second event couldn't be saved
+        second.requeue()
+        assert not envelope_message.requeued
+        self.es_connection.confirmed = 0
+        self.consumer.ack_confirmed()
+        assert self.channel.acks == []
+        self.es_connection.confirmed = 1
+        self.consumer.ack_confirmed()
+        # requeued once every event has settled, never acked
+        assert envelope_message.requeued
+        assert not envelope_message.acked
+        assert self.channel.acks == [(2, True)]
+
+    def test_reconnect(self, monkeypatch):
+        esworker_eventtask.options.esbulksize = 10
+        new_connection = MockESConnection()
+        monkeypatch.setattr(esworker_eventtask, "esConnect", lambda: new_connection)
+        sent = MockAckMessage(self.channel, 1)
+        queued = MockAckMessage(self.channel, 2)
+        self.consumer.pendingAcks = [(sent, 0), (queued, 1)]
+        self.es_connection.confirmed = 0
+        self.consumer.reconnect()
+        assert self.es_connection.finished
+        # what the old client sent is acked, the rest goes back to the queue
+        assert self.channel.acks == [(1, True)]
+        assert not sent.requeued
+        assert queued.requeued
+        assert self.consumer.pendingAcks == []
+        assert self.consumer.esConnection is new_connection
+
+
+class TestProcessBatch():
+    def setup(self):
+        esworker_eventtask.options = MockAckOptions()
+        self.es_connection = MockESConnection()
+        self.consumer = esworker_eventtask.taskConsumer(MockMQConnection(), None, None, self.es_connection)
+        self.channel = MockChannel()
+
+    def test_plugin_failure_requeues_batch(self, monkeypatch):
+        def sendEventsToPlugins(events, pluginList):
+            raise RuntimeError('plugins broke')
+        monkeypatch.setattr(esworker_eventtask, 'sendEventsToPlugins', sendEventsToPlugins)
+        monkeypatch.setattr(esworker_eventtask, 'pluginList', [], raising=False)
+        messages = [MockAckMessage(self.channel, num) for num in range(2)]
+        self.consumer.batch = [({'customendpoint': True, 'num': num}, message) for num, message in enumerate(messages)]
+        self.consumer.process_batch()
+        assert all(message.requeued for message in messages)
+        assert not any(message.acked for message in messages)
+
+    def test_bad_event_dropped_alone(self, monkeypatch):
+        monkeypatch.setattr(esworker_eventtask, 'pluginList', [], raising=False)
+        good = MockAckMessage(self.channel, 1)
+        bad = MockAckMessage(self.channel, 2)
+        self.consumer.batch = [({'customendpoint': True, 'fail': True}, bad), ({'customendpoint': True}, good)]
+        self.consumer.process_batch()
+        assert self.es_connection.saved == [{'customendpoint': True}]
+        assert good.acked
+        assert bad.acked
+        assert self.consumer.stats.get('dropped') == 1
+
+
+class TestEnvelopes():
+    def setup(self):
+        esworker_eventtask.options = MockAckOptions()
+        self.consumer = esworker_eventtask.taskConsumer(MockMQConnection(), None, None, MockESConnection())
+        self.channel = MockChannel()
+
+    def test_unpacks_envelope(self):
+        message = MockMessage(self.channel, 1)
+        self.consumer.on_message([{'summary': 'first'}, {'summary': 'second'}], message)
+        assert [body for (body, part) in self.consumer.batch] == [{'summary': 'first'}, {'summary': 'second'}]
+        assert self.consumer.stats.get('received') == 2
+
+    def test_envelope_processed_as_a_batch(self):
+        self.consumer.process_batch = lambda: self.processed.append(len(self.consumer.batch))
+        self.processed = []
+        self.consumer.on_message([{'summary': str(num)} for num in range(10)], MockMessage(self.channel, 1))
+        assert self.processed == [10]
+
+    def test_pending_messages(self):
+        parts = Envelope(MockMessage(self.channel, 2), 3).parts()
+        self.consumer.pendingAcks = [(MockMessage(self.channel, 1), 0)] + [(part, 0) for part in parts]
+        assert self.consumer.pending_messages() == 2
+
+    def test_empty_envelope(self):
+        message = MockAckMessage(self.channel, 1)
+        self.consumer.on_message([], message)
+        assert message.acked
+        assert self.consumer.batch == []
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import calendar
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq import esworker_papertrail
+from mq.esworker_papertrail import PTRequestor, taskConsumer, backfillWindows
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../lib"))
+from utilities.dot_dict import DotDict
+from state import State
+
+
+def epoch(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+class MockPapertrail(PTRequestor):
+    '''a papertrail account with an event every minute, returning at most
+       pagesize events a search, newest first like the real thing
+    '''
+    def __init__(self, stime, etime, pagesize=5):
+        super(MockPapertrail, self).__init__('apikey')
+        self.pagesize = pagesize
+        self.searches = list()
+        self.allEvents = list()
+        minute = stime
+        while minute <= etime:
+            self.allEvents.append({
+                'id': str(epoch(minute)),
+                'generated_at': minute.isoformat(),
+                'message': 'event at {0}'.format(minute.isoformat()),
+            })
+            minute += timedelta(minutes=1)
+
+    def search(self, query, stime, etime, maxid):
+        self.searches.append((stime, etime, maxid))
+        # give the other windows' threads a look in
+        time.sleep(0.001)
+        events = [
+            event for event in self.allEvents
+            if epoch(stime) <= int(event['id']) <= epoch(etime) and (maxid is None or int(event['id']) <= int(maxid))
+        ]
+        page = events[-self.pagesize:]
+        return {
+            'events': page,
+            'min_id': page[0]['id'] if page else None,
+            'reached_record_limit': len(events) > self.pagesize,
+        }
+
+
+class MockEsConnection():
+    '''a bulk that sends everything straight away unless told to hold on'''
+    def __init__(self):
+        self.generation = 0
+        self.holding = False
+        self.sent = 0
+
+    def start_bulk_timer(self):
+        pass
+
+    def save_event(self):
+        self.generation += 1
+        if not self.holding:
+            self.sent = self.generation
+        return self.generation
+
+    def bulk_confirmed(self):
+        return self.sent
+
+
+class RecordingConsumer(taskConsumer):
+    def __init__(self, *args, **kwargs):
+        super(RecordingConsumer, self).__init__(*args, **kwargs)
+        self.indexed = list()
+
+    def on_message(self, body, message):
+        self.indexed.append(message['id'])
+        self.lastGeneration = self.esConnection.save_event()
+
+
+class TestBackfillWindows():
+    def test_windows(self):
+        stime = datetime(2017, 5, 25, 0, 0, tzinfo=pytz.utc)
+        windows = list(backfillWindows(stime, stime + timedelta(minutes=150), 3600))
+        assert windows == [
+            (stime, stime + timedelta(minutes=60)),
+            (stime + timedelta(minutes=60), stime + timedelta(minutes=120)),
+            (stime + timedelta(minutes=120), stime + timedelta(minutes=150)),
+        ]
+
+    def test_empty(self):
+        stime = datetime(2017, 5, 25, 0, 0, tzinfo=pytz.utc)
+        assert list(backfillWindows(stime, stime, 3600)) == []
+
+
+class TestPapertrailBackfill():
+    def setup(self):
+        self.statefile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'papertrail_test.state')
+        if os.path.exists(self.statefile):
+            os.remove(self.statefile)
+        esworker_papertrail.options = DotDict({
+            'esbulksize': 100,
+            'ptinterval': 60,
+            'ptbackoff': 0,
+            'ptquery': '',
+            'ptacctname': 'unittest',
+            'ptbackfillstart': '',
+            'ptbackfillwindow': 600,
+            'ptbackfillthreads': 3,
+        })
+        self.etime = datetime.now(pytz.utc).replace(second=0, microsecond=0)
+        self.stime = self.etime - timedelta(hours=2)
+        self.papertrail = MockPapertrail(self.stime, self.etime)
+        self.es = MockEsConnection()
+
+    def teardown(self):
+        if os.path.exists(self.statefile):
+            os.remove(self.statefile)
+
+    def test_fetch_pages_through_a_window(self):
+        events = self.papertrail.fetch('', self.stime, self.stime + timedelta(minutes=20))
+        assert [event['id'] for event in events] == [event['id'] for event in self.papertrail.allEvents[:21]]
+        assert len(self.papertrail.searches) > 1
+
+    def test_fetch_stops_at_evmax(self):
+        self.papertrail._evmax = 7
+        events = self.papertrail.fetch('', self.stime, self.stime + timedelta(minutes=20))
+        # the newest pages, up to the first one past evmax
+        assert 7 < len(events) < 21
+        assert [event['id'] for event in events] == [event['id'] for event in self.papertrail.allEvents[21 - len(events):21]]
+
+    def test_backfill_in_order_without_duplicates(self):
+        consumer = RecordingConsumer(self.papertrail, self.es, State(self.statefile))
+        lastIds = consumer.backfill(self.stime, self.etime)
+        assert consumer.indexed == [event['id'] for event in self.papertrail.allEvents]
+        assert self.papertrail.allEvents[-1]['id'] in lastIds
+        assert State(self.statefile).data['lastrequesttime'] == self.etime.isoformat()
+
+    def test_checkpoint_waits_for_bulk(self):
+        consumer = RecordingConsumer(self.papertrail, self.es, State(self.statefile))
+        self.es.holding = True
+        consumer.backfill(self.stime, self.etime)
+        assert 'lastrequesttime' not in State(self.statefile).data
+        # the bulk sends the first hour, the next checkpoint catches up that far
+        self.es.sent = consumer.indexed.index(self.papertrail.allEvents[60]['id']) + 1
+        consumer.checkpoint(self.etime + timedelta(minutes=1))
+        assert State(self.statefile).data['lastrequesttime'] == (self.stime + timedelta(hours=1)).isoformat()
+        self.es.sent = self.es.generation
+        consumer.checkpoint(self.etime + timedelta(minutes=1))
+        assert State(self.statefile).data['lastrequesttime'] == (self.etime + timedelta(minutes=1)).isoformat()
+
+    def test_resume_from_checkpoint(self):
+        state = State(self.statefile)
+        state.data['lastrequesttime'] = (self.etime - timedelta(minutes=30)).isoformat()
+        state.save()
+        consumer = RecordingConsumer(self.papertrail, self.es, State(self.statefile))
+        consumer.resume()
+        assert consumer.indexed == [event['id'] for event in self.papertrail.allEvents[-31:]]
+        assert consumer.lastRequestTime >= self.etime
+        # the first poll shouldn't index the last window again
+        assert self.papertrail.allEvents[-1]['id'] in consumer.ptrequestor._evidcache
+
+    def test_backfill_start(self):
+        esworker_papertrail.options.ptbackfillstart = (self.etime - timedelta(minutes=15)).isoformat()
+        consumer = RecordingConsumer(self.papertrail, self.es, State(self.statefile))
+        consumer.resume()
+        assert consumer.indexed == [event['id'] for event in self.papertrail.allEvents[-16:]]
+
+    def test_nothing_to_resume(self):
+        consumer = RecordingConsumer(self.papertrail, self.es, State(self.statefile))
+        lastRequestTime = consumer.lastRequestTime
+        consumer.resume()
+        assert consumer.indexed == []
+        assert consumer.lastRequestTime == lastRequestTime
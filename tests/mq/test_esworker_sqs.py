@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import os
+import sys
+import time
+from threading import Thread
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq import esworker_sqs
+from mq.lib.sqs import SQSConsumer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../lib"))
+from utilities.dot_dict import DotDict
+
+
+class MockSQSMessage():
+    def __init__(self, body):
+        self.body = body
+
+    def get_body(self):
+        return self.body
+
+
+class MockSQSQueue():
+    def __init__(self):
+        self.deleted = list()
+
+    def delete_message_batch(self, messages):
+        self.deleted.extend(message.get_body() for message in messages)
+
+
+class MockESConnection():
+    def __init__(self):
+        self.generation = 0
+        self.confirmed = -1
+        self.finished = False
+        self.timerStarted = False
+
+    def start_bulk_timer(self):
+        self.timerStarted = True
+
+    def finish_bulk(self):
+        self.finished = True
+
+    def flush_bulk(self):
+        self.confirmed = self.generation
+
+    def bulk_confirmed(self):
+        return self.confirmed
+
+
+class TestEsworkerSQSReconnect():
+    def setup(self):
+        esworker_sqs.options = DotDict({'esbulksize': 10, 'taskexchange': 'eventtask'})
+        self.oldConnection = MockESConnection()
+        self.newConnection = MockESConnection()
+        self.esConnect = esworker_sqs.esConnect
+        esworker_sqs.esConnect = lambda: self.newConnection
+        self.queue = MockSQSQueue()
+        self.worker = esworker_sqs.taskConsumer(None, self.queue, self.oldConnection)
+        self.worker.consumer = SQSConsumer(
+            self.queue,
+            self.worker.process_message,
+            confirmed=lambda: self.worker.esConnection.bulk_confirmed())
+
+    def teardown(self):
+        esworker_sqs.esConnect = self.esConnect
+
+    def test_pending_deletes_are_forgotten(self):
+        self.oldConnection.confirmed = 1
+        self.worker.consumer.pending = [(MockSQSMessage('written'), 1), (MockSQSMessage('queued'), 2)]
+        self.worker.reconnect()
+        assert self.queue.deleted == ['written']
+        assert self.worker.consumer.pending == []
+        assert self.oldConnection.finished
+        assert self.newConnection.timerStarted
+        assert self.worker.esConnection is self.newConnection
+
+    def test_confirmed_asks_the_new_client(self):
+        self.worker.reconnect()
+        self.newConnection.confirmed = 5
+        self.worker.consumer.pending = [(MockSQSMessage('new'), 5)]
+        self.worker.consumer.deleteConfirmed()
+        assert self.queue.deleted == ['new']
+
+    def test_saved_to_the_old_client_comes_back(self):
+        def on_message(event, message, esConnection=None):
+            self.worker.reconnect()
+            return 1
+        self.worker.on_message = on_message
+        assert self.worker.process_message(MockSQSMessage('{"summary": "test"}')) is SQSConsumer.RETRY
+
+    def test_reconnect_once_for_the_same_failure(self):
+        connects = []
+
+        def esConnect():
+            connects.append(MockESConnection())
+            return connects[-1]
+        esworker_sqs.esConnect = esConnect
+        self.worker.reconnect(self.oldConnection)
+        self.worker.reconnect(self.oldConnection)
+        assert len(connects) == 1
+        assert self.worker.esConnection is connects[0]
+
+    def test_concurrent_reconnects(self):
+        connects = []
+
+        def esConnect():
+            # give the other threads a chance to get in the way
+            time.sleep(0.01)
+            connects.append(MockESConnection())
+            return connects[-1]
+        esworker_sqs.esConnect = esConnect
+        threads = [Thread(target=self.worker.reconnect, args=(self.oldConnection,)) for num in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(connects) == 1
+        assert self.worker.esConnection is connects[0]
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../lib"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq.lib.cloudtrail import CloudTrailNormalizer
+from event import Event
+
+
+def cloudtrailRecord(eventName='RunInstances'):
+    return {
+        'eventVersion': '1.05',
+        'eventTime': '2017-05-25T07:14:15Z',
+        'eventSource': 'ec2.amazonaws.com',
+        'eventName': eventName,
+        'awsRegion': 'us-west-2',
+        'sourceIPAddress': '1.2.3.4',
+        'userAgent': 'aws-cli/1.11',
+    }
+
+
+class TestCloudTrailNormalizer():
+    def setup(self):
+        self.normalizer = CloudTrailNormalizer(hostname='unittest.hostname')
+
+    def test_normalize(self):
+        (event, index) = self.normalizer.normalize(cloudtrailRecord())
+        assert index == 'events'
+        assert event['category'] == 'cloudtrail'
+        assert event['utctimestamp'] == '2017-05-25T07:14:15+00:00'
+        assert event['mozdefhostname'] == 'unittest.hostname'
+        assert event['hostname'] == 'ec2.amazonaws.com'
+        assert event['processid'] == os.getpid()
+        assert event['summary'] == '1.2.3.4 performed RunInstances in ec2.amazonaws.com'
+        assert event['eventVerb'] == 'Run'
+        assert event['eventReadOnly'] is False
+
+    def test_has_the_required_fields(self):
+        (event, index) = self.normalizer.normalize(cloudtrailRecord())
+        required = Event(event)
+        required.add_required_fields()
+        assert required == event
+
+    def test_verbs_are_cached(self):
+        self.normalizer.normalize(cloudtrailRecord('DescribeInstances'))
+        self.normalizer.normalize(cloudtrailRecord('DescribeInstances'))
+        assert self.normalizer.verbs == {'DescribeInstances': ('Describe', True)}
+
+    def test_odd_event_names(self):
+        (event, index) = self.normalizer.normalize(cloudtrailRecord('describe'))
+        assert event['eventVerb'] == 'describe'
+        assert event['eventReadOnly'] is False
+
+    def test_read_only_indexed(self):
+        (event, index) = self.normalizer.normalize(cloudtrailRecord('ListBuckets'))
+        assert index == 'events'
+        assert event['eventReadOnly'] is True
+
+    def test_read_only_routed(self):
+        normalizer = CloudTrailNormalizer(readOnly='route', readOnlyIndex='readonly')
+        assert normalizer.normalize(cloudtrailRecord('GetObject'))[1] == 'readonly'
+        assert normalizer.normalize(cloudtrailRecord('PutObject'))[1] == 'events'
+
+    def test_read_only_dropped(self):
+        normalizer = CloudTrailNormalizer(readOnly='drop')
+        assert normalizer.normalize(cloudtrailRecord('DescribeInstances')) is None
+        assert normalizer.normalize(cloudtrailRecord('TerminateInstances')) is not None
+        assert normalizer.dropped == 1
+
+    def test_bad_read_only_action(self):
+        with pytest.raises(ValueError):
+            CloudTrailNormalizer(readOnly='ignore')
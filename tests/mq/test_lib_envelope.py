@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq.lib.envelope import Envelope
+
+
+class MockMessage():
+    delivery_tag = 7
+    channel = 'channel'
+
+    def __init__(self):
+        self.acks = 0
+        self.requeues = 0
+
+    def ack(self):
+        self.acks += 1
+
+    def requeue(self):
+        self.requeues += 1
+
+
+class TestEnvelope():
+    def setup(self):
+        self.message = MockMessage()
+        self.parts = Envelope(self.message, 3).parts()
+
+    def test_parts_look_like_the_message(self):
+        assert len(self.parts) == 3
+        assert self.parts[0].delivery_tag == 7
+        assert self.parts[0].channel == 'channel'
+
+    def test_acked_once_all_parts_are(self):
+        self.parts[0].ack()
+        self.parts[1].ack()
+        assert self.message.acks == 0
+        self.parts[2].ack()
+        assert self.message.acks == 1
+        assert self.message.requeues == 0
+
+    def test_requeued_if_any_part_is(self):
+        self.parts[0].ack()
+        self.parts[1].requeue()
+        self.parts[2].ack()
+        assert self.message.acks == 0
+        assert self.message.requeues == 1
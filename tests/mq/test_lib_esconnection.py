@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq.lib import esconnection
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../lib"))
+from utilities.dot_dict import DotDict
+
+
+class MockElasticsearchClient():
+    def __init__(self, servers, **kwargs):
+        self.servers = servers
+        self.kwargs = kwargs
+
+
+class TestEsConnection():
+    def setup(self):
+        self.options = DotDict({'configfile': os.path.join(os.path.dirname(__file__), 'nonexistent.conf')})
+        esconnection.initConfig(self.options)
+
+    def test_defaults(self):
+        assert self.options.esservers == ['http://localhost:9200']
+        assert self.options.esbulksize == 0
+        assert self.options.esbulkretries == 3
+        assert self.options.esdeadletterfile == ''
+
+    def test_connect_passes_every_option(self, monkeypatch):
+        monkeypatch.setattr(esconnection, 'ElasticsearchClient', MockElasticsearchClient)
+        self.options.esbulksize = 100
+        self.options.esbulksenders = 2
+        es = esconnection.esConnect(self.options)
+        assert es.servers == ['http://localhost:9200']
+        assert es.kwargs['bulk_amount'] == 100
+        assert es.kwargs['bulk_refresh_time'] == 30
+        assert es.kwargs['bulk_senders'] == 2
+        assert es.kwargs['bulk_retry_backoff'] == 1.0
+        assert es.kwargs['dead_letter_index'] == ''
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq.lib.keymapping import keyMapping, basicKeyHandlers
+
+
+class TestKeyMapping(object):
+
+    def test_at_keys(self):
+        result = keyMapping({'@Message': 'hello', '@source_host': 'host1'}, 'sample')
+        assert result['summary'] == 'hello'
+        assert result['hostname'] == 'host1'
+        assert result['mozdefhostname'] == 'sample'
+
+    def test_timestamp(self):
+        result = keyMapping({'eventtime': '2017-10-27T14:01:12+00:00'}, 'sample')
+        assert result['utctimestamp'] == '2017-10-27T14:01:12+00:00'
+        assert result['timestamp'] == '2017-10-27T14:01:12+00:00'
+
+    def test_default_utctimestamp(self):
+        result = keyMapping({'summary': 'hello'}, 'sample')
+        assert 'utctimestamp' in result
+        assert 'timestamp' not in result
+
+    def test_payload_without_summary(self):
+        result = keyMapping({'payload': 'the payload'}, 'sample')
+        assert result['summary'] == 'the payload'
+        assert 'details' not in result
+
+    def test_payload_with_summary(self):
+        result = keyMapping({'payload': 'the payload', 'summary': 'the summary'}, 'sample')
+        assert result['summary'] == 'the summary'
+        assert result['details']['payload'] == 'the payload'
+
+    def test_facility(self):
+        result = keyMapping({'facility': 'auth'}, 'sample')
+        assert result['source'] == 'auth'
+        assert result['facility'] == 'auth'
+
+    def test_tags(self):
+        result = keyMapping({'tags': 'one'}, 'sample')
+        assert result['tags'] == ['one']
+        result = keyMapping({'tags': ['one', 'two']}, 'sample')
+        assert result['tags'] == ['one', 'two']
+
+    def test_detail_fields(self):
+        result = keyMapping({'fields.count_int': '3', 'details.ratio_float': '0.5', 'details.name': 'x', 'sourceip': '1.2.3.4'}, 'sample')
+        assert result['details'] == {
+            'count_int': 3,
+            'ratio_float': 0.5,
+            'name': u'x',
+            'sourceipaddress': '1.2.3.4',
+        }
+
+    def test_severity(self):
+        result = keyMapping({'priority': 'info'}, 'sample')
+        assert result['severity'] == 'INFO'
+
+    def test_bad_value(self):
+        assert keyMapping({'fields.count_int': 'abc'}, 'sample') is None
+
+
+class TestBasicKeyMapping(object):
+    '''what esworker_sqs and esworker_papertrail map'''
+
+    def test_tags_as_sent(self):
+        result = keyMapping({'tags': 'one'}, 'sample', basicKeyHandlers)
+        assert result['tags'] == 'one'
+        result = keyMapping({'tags': ['one', 'two']}, 'sample', basicKeyHandlers)
+        assert result['tags'] == ['one', 'two']
+        assert 'tags' not in keyMapping({'tags': ''}, 'sample', basicKeyHandlers)
+
+    def test_facility_not_source(self):
+        result = keyMapping({'facility': 'auth'}, 'sample', basicKeyHandlers)
+        assert result['facility'] == 'auth'
+        assert 'source' not in result
+
+    def test_unmapped_keys(self):
+        result = keyMapping({'priority': 'info', 'program': 'sshd', 'date': '2017-10-27T14:01:12+00:00', 'sourceip': '1.2.3.4'}, 'sample', basicKeyHandlers)
+        assert 'severity' not in result
+        assert 'processname' not in result
+        assert 'timestamp' not in result
+        assert 'details' not in result
+
+    def test_common_keys(self):
+        result = keyMapping({'@message': 'hello', 'host': 'host1', 'severity': 'info', 'eventtime': '2017-10-27T14:01:12+00:00'}, 'sample', basicKeyHandlers)
+        assert result['summary'] == 'hello'
+        assert result['hostname'] == 'host1'
+        assert result['severity'] == 'INFO'
+        assert result['utctimestamp'] == '2017-10-27T14:01:12+00:00'
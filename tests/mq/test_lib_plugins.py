@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq.lib.plugins import sendEventToPlugins, sendEventsToPlugins, PluginIndex, pluginStats
+
+
+class RecordingPlugin(object):
+    def __init__(self, name, registration, priority, add_fields=None, drop=False):
+        self.name = name
+        self.registration = registration
+        self.priority = priority
+        self.add_fields = add_fields or {}
+        self.drop = drop
+        self.calls = []
+
+    def onMessage(self, message, metadata):
+        self.calls.append(dict(message))
+        if self.drop:
+            return (None, metadata)
+        message.update(self.add_fields)
+        return (message, metadata)
+
+
+class BatchPlugin(RecordingPlugin):
+    def __init__(self, *args, **kwargs):
+        super(BatchPlugin, self).__init__(*args, **kwargs)
+        self.batches = []
+
+    def onMessageBatch(self, batch):
+        self.batches.append(len(batch))
+        return [self.onMessage(message, metadata) for (message, metadata) in batch]
+
+
+def plugin_tuple(plugin):
+    return (plugin, plugin.registration, plugin.priority)
+
+
+class TestPluginIndex(object):
+    def setup(self):
+        self.apples = RecordingPlugin('apples', ['apples'], 20)
+        self.bananas = RecordingPlugin('bananas', ['bananas', 'apples'], 5)
+        self.index = PluginIndex([plugin_tuple(self.apples), plugin_tuple(self.bananas)])
+
+    def test_sorted_by_priority(self):
+        assert [p[0].name for p in self.index] == ['bananas', 'apples']
+
+    def test_term_index(self):
+        assert self.index.termIndex['apples'] == set([0, 1])
+        assert self.index.termIndex['bananas'] == set([0])
+
+    def test_matching_plugins(self):
+        assert self.index.matchingPlugins(['apples']) == [0, 1]
+        assert self.index.matchingPlugins(['apples'], 1) == [1]
+        assert self.index.matchingPlugins(['pears']) == []
+
+
+class TestSendEventToPlugins(object):
+    def setup(self):
+        self.metadata = {'index': 'events', 'doc_type': 'event', 'id': None}
+
+    def test_only_matching_plugins_run(self):
+        sshd = RecordingPlugin('sshd', ['sshd'], 5)
+        bro = RecordingPlugin('bro', ['bro'], 5)
+        pluginList = PluginIndex([plugin_tuple(sshd), plugin_tuple(bro)])
+        event = {'details': {'program': 'sshd'}}
+        result, metadata = sendEventToPlugins(event, self.metadata, pluginList)
+        assert result == event
+        assert len(sshd.calls) == 1
+        assert len(bro.calls) == 0
+
+    def test_matches_on_keys_and_lowercased_values(self):
+        plugin = RecordingPlugin('ip', ['sourceipaddress', 'bro'], 5)
+        pluginList = PluginIndex([plugin_tuple(plugin)])
+        sendEventToPlugins({'details': {'SourceIPAddress': '1.2.3.4'}}, self.metadata, pluginList)
+        sendEventToPlugins({'category': 'BRO'}, self.metadata, pluginList)
+        assert len(plugin.calls) == 2
+
+    def test_later_plugin_sees_added_field(self):
+        fixup = RecordingPlugin('fixup', ['sshd'], 5, add_fields={'sourceipaddress': '1.2.3.4'})
+        geoip = RecordingPlugin('geoip', ['sourceipaddress'], 20)
+        pluginList = PluginIndex([plugin_tuple(geoip), plugin_tuple(fixup)])
+        result, metadata = sendEventToPlugins({'program': 'sshd'}, self.metadata, pluginList)
+        assert result['sourceipaddress'] == '1.2.3.4'
+        assert len(fixup.calls) == 1
+        assert len(geoip.calls) == 1
+
+    def test_earlier_plugin_not_rerun_for_added_field(self):
+        geoip = RecordingPlugin('geoip', ['sourceipaddress'], 1)
+        fixup = RecordingPlugin('fixup', ['sshd'], 5, add_fields={'sourceipaddress': '1.2.3.4'})
+        pluginList = PluginIndex([plugin_tuple(geoip), plugin_tuple(fixup)])
+        sendEventToPlugins({'program': 'sshd'}, self.metadata, pluginList)
+        assert len(geoip.calls) == 0
+        assert len(fixup.calls) == 1
+
+    def test_drop_stops_chain(self):
+        dropper = RecordingPlugin('dropper', ['sshd'], 1, drop=True)
+        after = RecordingPlugin('after', ['sshd'], 5)
+        pluginList = PluginIndex([plugin_tuple(dropper), plugin_tuple(after)])
+        result, metadata = sendEventToPlugins({'program': 'sshd'}, self.metadata, pluginList)
+        assert result is None
+        assert len(after.calls) == 0
+
+    def test_plain_list_is_indexed(self):
+        plugin = RecordingPlugin('sshd', ['sshd'], 5)
+        result, metadata = sendEventToPlugins({'program': 'sshd'}, self.metadata, [plugin_tuple(plugin)])
+        assert len(plugin.calls) == 1
+
+
+class TestSendEventsToPlugins(object):
+    def setup(self):
+        self.metadata = {'index': 'events', 'doc_type': 'event', 'id': None}
+
+    def batch(self, *events):
+        return [(event, dict(self.metadata)) for event in events]
+
+    def test_batch_plugin_gets_matching_events_together(self):
+        plugin = BatchPlugin('sshd', ['sshd'], 5)
+        pluginList = PluginIndex([plugin_tuple(plugin)])
+        results = sendEventsToPlugins(self.batch({'program': 'sshd'}, {'program': 'bro'}, {'program': 'sshd'}), pluginList)
+        assert plugin.batches == [2]
+        assert len(results) == 3
+        assert results[1] == ({'program': 'bro'}, self.metadata)
+
+    def test_falls_back_to_on_message(self):
+        plugin = RecordingPlugin('sshd', ['sshd'], 5, add_fields={'parsed': True})
+        pluginList = PluginIndex([plugin_tuple(plugin)])
+        results = sendEventsToPlugins(self.batch({'program': 'sshd'}, {'program': 'sshd'}), pluginList)
+        assert len(plugin.calls) == 2
+        assert [event['parsed'] for (event, metadata) in results] == [True, True]
+
+    def test_dropped_events_skip_later_plugins(self):
+        dropper = BatchPlugin('dropper', ['drop'], 1, drop=True)
+        after = BatchPlugin('after', ['sshd'], 5)
+        pluginList = PluginIndex([plugin_tuple(dropper), plugin_tuple(after)])
+        results = sendEventsToPlugins(self.batch({'program': 'sshd', 'action': 'drop'}, {'program': 'sshd'}), pluginList)
+        assert results[0][0] is None
+        assert results[1][0] == {'program': 'sshd'}
+        assert after.batches == [1]
+
+    def test_later_plugin_sees_added_field(self):
+        fixup = BatchPlugin('fixup', ['sshd'], 5, add_fields={'sourceipaddress': '1.2.3.4'})
+        geoip = BatchPlugin('geoip', ['sourceipaddress'], 20)
+        pluginList = PluginIndex([plugin_tuple(geoip), plugin_tuple(fixup)])
+        sendEventsToPlugins(self.batch({'program': 'sshd'}, {'program': 'bro'}), pluginList)
+        assert fixup.batches == [1]
+        assert geoip.batches == [1]
+
+    def test_failing_plugin_drops_only_its_event(self):
+        class FailingPlugin(BatchPlugin):
+            def onMessage(self, message, metadata):
+                if message.get('bad'):
+                    raise KeyError('bad')
+                return super(FailingPlugin, self).onMessage(message, metadata)
+        plugin = FailingPlugin('failing', ['sshd'], 5, add_fields={'parsed': True})
+        pluginList = PluginIndex([plugin_tuple(plugin)])
+        results = sendEventsToPlugins(self.batch({'program': 'sshd', 'bad': True}, {'program': 'sshd'}), pluginList)
+        assert results[0][0] is None
+        assert results[1][0] == {'program': 'sshd', 'parsed': True}
+
+    def test_empty_batch(self):
+        assert sendEventsToPlugins([], PluginIndex()) == []
+
+
+class TestPluginStats(object):
+    def setup(self):
+        pluginStats.snapshot(reset=True)
+
+    def test_counts_calls_and_drops(self):
+        keeper = RecordingPlugin('keeper', ['apples'], 1)
+        dropper = BatchPlugin('dropper', ['bananas'], 2, drop=True)
+        events = [({'apples': 1}, {}), ({'bananas': 1}, {}), ({'apples': 1, 'bananas': 1}, {})]
+        sendEventsToPlugins(events, [plugin_tuple(keeper), plugin_tuple(dropper)])
+        # both test plugins share this module's name
+        stats = pluginStats.snapshot()['plugins'][0]
+        assert stats['plugin'] == RecordingPlugin.__module__
+        # keeper is called per event, dropper once for its batch
+        assert stats['invocations'] == 3
+        assert stats['events'] == 4
+        assert stats['drops'] == 2
+
+    def test_single_event(self):
+        dropper = RecordingPlugin('dropper', ['apples'], 1, drop=True)
+        sendEventToPlugins({'apples': 1}, {}, [plugin_tuple(dropper)])
+        stats = pluginStats.snapshot()['plugins'][0]
+        assert stats['invocations'] == 1
+        assert stats['drops'] == 1
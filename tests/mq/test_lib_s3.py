@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import gzip
+import json
+import os
+import sys
+from StringIO import StringIO
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq.lib.s3 import gunzipChunks, jsonArrayItems, S3Fetcher
+
+
+def gzipped(data):
+    buf = StringIO()
+    gzip_file = gzip.GzipFile(fileobj=buf, mode='wb')
+    gzip_file.write(data)
+    gzip_file.close()
+    return buf.getvalue()
+
+
+def cloudtrailLog(count):
+    records = [{'eventName': 'DescribeInstances', 'eventID': num, 'userAgent': u'caf\xe9'} for num in range(count)]
+    return json.dumps({'Records': records}, ensure_ascii=False).encode('utf-8')
+
+
+class MockKey(StringIO):
+    def __init__(self, data):
+        StringIO.__init__(self, data)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class MockBucket():
+    def __init__(self, keys):
+        self.keys = keys
+        self.opened = list()
+
+    def new_key(self, name):
+        key = MockKey(self.keys[name])
+        self.opened.append(key)
+        return key
+
+
+class MockS3Connection():
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lookups = 0
+
+    def get_bucket(self, name, validate=True):
+        self.lookups += 1
+        return self.buckets[name]
+
+
+class TestGunzipChunks():
+    def test_small_chunks(self):
+        data = cloudtrailLog(50)
+        chunks = list(gunzipChunks(StringIO(gzipped(data)), chunkSize=16))
+        assert ''.join(chunks) == data
+        assert len(chunks) > 1
+
+    def test_concatenated_members(self):
+        data = gzipped('first ') + gzipped('second')
+        assert ''.join(gunzipChunks(StringIO(data), chunkSize=7)) == 'first second'
+
+
+class TestJsonArrayItems():
+    def test_items_split_across_chunks(self):
+        data = cloudtrailLog(20)
+        for size in (1, 7, 100, len(data)):
+            chunks = [data[pos:pos + size] for pos in range(0, len(data), size)]
+            records = list(jsonArrayItems(chunks))
+            assert [record['eventID'] for record in records] == range(20)
+            assert records[3]['userAgent'] == u'caf\xe9'
+
+    def test_other_keys_and_whitespace(self):
+        data = '{"version": 1,\n "Records" : [ {"a": "]"} ,\n {"b": [1, 2]} ] }'
+        assert list(jsonArrayItems([data[:20], data[20:]])) == [{'a': ']'}, {'b': [1, 2]}]
+
+    def test_empty(self):
+        assert list(jsonArrayItems(['{"Records": []}'])) == []
+
+    def test_missing_array(self):
+        with pytest.raises(ValueError):
+            list(jsonArrayItems(['{"Events": [1]}']))
+
+    def test_truncated(self):
+        data = cloudtrailLog(3)[:-10]
+        with pytest.raises(ValueError):
+            list(jsonArrayItems([data]))
+
+
+class TestS3Fetcher():
+    def setup(self):
+        self.bucket = MockBucket({
+            'log1.json.gz': gzipped(cloudtrailLog(5)),
+            'log2.json.gz': gzipped(cloudtrailLog(3)),
+        })
+        self.connection = MockS3Connection({'cloudtrail': self.bucket})
+        self.fetcher = S3Fetcher(self.connection, chunkSize=32)
+
+    def test_records(self):
+        records = list(self.fetcher.records('cloudtrail', 'log1.json.gz'))
+        assert [record['eventID'] for record in records] == range(5)
+        assert self.bucket.opened[0].closed
+
+    def test_buckets_are_cached(self):
+        list(self.fetcher.records('cloudtrail', 'log1.json.gz'))
+        list(self.fetcher.records('cloudtrail', 'log2.json.gz'))
+        assert self.connection.lookups == 1
+
+    def test_closed_when_abandoned(self):
+        records = self.fetcher.records('cloudtrail', 'log1.json.gz')
+        next(records)
+        records.close()
+        assert self.bucket.opened[0].closed
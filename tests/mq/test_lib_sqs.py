@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import os
+import sys
+import time
+from threading import Lock, Thread
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq.lib.sqs import SQSConsumer
+
+
+class MockSQSMessage():
+    def __init__(self, body):
+        self.body = body
+
+    def get_body(self):
+        return self.body
+
+
+class MockBatchResults():
+    def __init__(self, errors):
+        self.errors = errors
+
+
+class MockSQSQueue():
+    '''an in process stand in for a boto sqs queue'''
+    def __init__(self, bodies, failDeletes=()):
+        self.lock = Lock()
+        self.messages = [MockSQSMessage(body) for body in bodies]
+        self.receives = list()
+        self.deleteBatches = list()
+        self.failDeletes = set(failDeletes)
+
+    def get_messages(self, num_messages=1, wait_time_seconds=None):
+        with self.lock:
+            self.receives.append((num_messages, wait_time_seconds))
+            messages = self.messages[:num_messages]
+            self.messages = self.messages[num_messages:]
+        if not messages:
+            # an empty long poll
+            time.sleep(0.01)
+        return messages
+
+    def delete_message_batch(self, messages):
+        with self.lock:
+            self.deleteBatches.append([message.get_body() for message in messages])
+        return MockBatchResults([message.get_body() for message in messages if message.get_body() in self.failDeletes])
+
+    def deleted(self):
+        return sorted(body for batch in self.deleteBatches for body in batch)
+
+
+def waitFor(condition, timeout=10):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestSQSConsumer():
+    def runConsumer(self, consumer, condition):
+        thread = Thread(target=consumer.run)
+        thread.start()
+        try:
+            assert waitFor(condition)
+        finally:
+            consumer.stop()
+            thread.join()
+
+    def test_processes_and_deletes_in_batches(self):
+        queue = MockSQSQueue(range(25))
+        processed = list()
+        consumer = SQSConsumer(queue, lambda message: processed.append(message.get_body()), receivers=2, processors=3, waitTime=5, deleteInterval=0.01)
+        self.runConsumer(consumer, lambda: consumer.deleted == 25)
+        assert sorted(processed) == range(25)
+        assert queue.deleted() == range(25)
+        assert max(len(batch) for batch in queue.deleteBatches) <= 10
+        assert all(receive == (10, 5) for receive in queue.receives)
+
+    def test_waits_for_the_bulk(self):
+        queue = MockSQSQueue(range(5))
+        confirmed = [-1]
+        consumer = SQSConsumer(queue, lambda message: 0, confirmed=lambda: confirmed[0], deleteInterval=0.01)
+        thread = Thread(target=consumer.run)
+        thread.start()
+        try:
+            assert waitFor(lambda: consumer.processed == 5)
+            time.sleep(0.05)
+            assert queue.deleted() == []
+            confirmed[0] = 0
+            assert waitFor(lambda: consumer.deleted == 5)
+        finally:
+            consumer.stop()
+            thread.join()
+
+    def test_flushes_when_idle(self):
+        queue = MockSQSQueue(range(3))
+        confirmed = [-1]
+
+        def flush():
+            confirmed[0] = 0
+        consumer = SQSConsumer(queue, lambda message: 0, confirmed=lambda: confirmed[0], flush=flush, deleteInterval=0.01)
+        self.runConsumer(consumer, lambda: consumer.deleted == 3)
+        assert queue.deleted() == [0, 1, 2]
+
+    def test_failed_messages_are_not_deleted(self):
+        queue = MockSQSQueue(range(4))
+
+        def process(message):
+            if message.get_body() % 2:
+                raise ValueError('bad event')
+        consumer = SQSConsumer(queue, process, deleteInterval=0.01)
+        self.runConsumer(consumer, lambda: consumer.deleted == 2)
+        assert queue.deleted() == [0, 2]
+
+    def test_failed_deletes(self):
+        queue = MockSQSQueue(range(3), failDeletes=[1])
+        consumer = SQSConsumer(queue, lambda message: None, deleteInterval=0.01)
+        self.runConsumer(consumer, lambda: len(queue.deleted()) == 3)
+        assert consumer.deleted == 2
+
+    def test_stop_deletes_whats_been_processed(self):
+        queue = MockSQSQueue(range(3))
+        consumer = SQSConsumer(queue, lambda message: None, deleteInterval=60)
+        thread = Thread(target=consumer.run)
+        thread.start()
+        assert waitFor(lambda: consumer.processed == 3)
+        consumer.stop()
+        thread.join()
+        assert queue.deleted() == [0, 1, 2]
+
+    def test_retry_is_not_deleted(self):
+        queue = MockSQSQueue(range(4))
+
+        def process(message):
+            if message.get_body() % 2:
+                return SQSConsumer.RETRY
+        consumer = SQSConsumer(queue, process, deleteInterval=0.01)
+        self.runConsumer(consumer, lambda: consumer.deleted == 2)
+        assert queue.deleted() == [0, 2]
+
+    def test_forget(self):
+        consumer = SQSConsumer(MockSQSQueue([]), lambda message: None)
+        consumer.pending = [(MockSQSMessage(0), None), (MockSQSMessage(1), 3)]
+        consumer.forget()
+        assert [message.get_body() for (message, generation) in consumer.pending] == [0]
+
+    def test_periodic(self):
+        calls = list()
+        consumer = SQSConsumer(MockSQSQueue([]), lambda message: None, deleteInterval=0.01, periodic=lambda: calls.append(1))
+        self.runConsumer(consumer, lambda: len(calls) >= 2)
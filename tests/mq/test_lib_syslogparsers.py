@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq.lib.syslogparsers import SyslogParsers
+
+
+def syslogEvent(program, summary):
+    return {'summary': summary, 'details': {'program': program}}
+
+
+class CountingRegex(object):
+    '''wraps a compiled regex, counting the times it's tried'''
+    def __init__(self, regex):
+        self.regex = regex
+        self.tries = 0
+
+    def match(self, text):
+        self.tries += 1
+        return self.regex.match(text)
+
+
+class TestSyslogParsers():
+    def setup(self):
+        self.parsers = SyslogParsers()
+        self.parsers.register('sshd', 'Accepted ', r'^Accepted (?P<authmethod>\w+) for (?P<username>\w+)$')
+        self.parsers.register('sshd', 'Postponed ', r'^Postponed (?P<authmethod>\w+) for (?P<username>\w+)$', fields=['username'])
+        self.parsers.register('su', 'pam_unix(su', r'^pam_unix\(su(?:-l)?:session\): session (?P<status>\w+)')
+
+    def test_parse(self):
+        event = syslogEvent('sshd', 'Accepted publickey for user1')
+        assert self.parsers.parse(event)
+        assert event['details'] == {'program': 'sshd', 'authmethod': 'publickey', 'username': 'user1'}
+
+    def test_only_the_fields_asked_for(self):
+        event = syslogEvent('sshd', 'Postponed publickey for user1')
+        assert self.parsers.parse(event)
+        assert event['details'] == {'program': 'sshd', 'username': 'user1'}
+
+    def test_program_must_match(self):
+        event = syslogEvent('su', 'Accepted publickey for user1')
+        assert not self.parsers.parse(event)
+        assert event['details'] == {'program': 'su'}
+
+    def test_prefix_must_match(self):
+        assert not self.parsers.parse(syslogEvent('sshd', 'Disconnected from 1.2.3.4'))
+
+    def test_pattern_must_match(self):
+        assert not self.parsers.parse(syslogEvent('sshd', 'Accepted publickey for user1 from somewhere'))
+
+    def test_missing_fields(self):
+        assert not self.parsers.parse({'summary': 'Accepted publickey for user1'})
+        assert not self.parsers.parse({'details': {'program': 'sshd'}})
+        assert not self.parsers.parse({'summary': 'Accepted publickey for user1', 'details': 'sshd'})
+
+    def test_unicode_summary(self):
+        event = syslogEvent(u'su', u'pam_unix(su-l:session): session opened')
+        assert self.parsers.parse(event)
+        assert event['details']['status'] == u'opened'
+
+    def test_only_candidates_are_tried(self):
+        parsers = SyslogParsers()
+        parsers.register('sshd', 'Accepted ', r'^Accepted (?P<username>\w+)$')
+        parsers.register('sshd', 'Postponed ', r'^Postponed (?P<username>\w+)$')
+        regexes = dict()
+        for prefixes in parsers.programs['sshd'].values():
+            for prefix, patterns in prefixes.items():
+                regexes[prefix] = CountingRegex(patterns[0][0])
+                patterns[0] = (regexes[prefix], None)
+        parsers.parse(syslogEvent('sshd', 'Accepted user1'))
+        assert regexes['Accepted '].tries == 1
+        assert regexes['Postponed '].tries == 0
+
+    def test_longest_prefix_first(self):
+        parsers = SyslogParsers()
+        parsers.register('sshd', 'pam_unix', r'^pam_unix(?P<which>)')
+        parsers.register('sshd', 'pam_unix(sshd:session)', r'^pam_unix\(sshd:session\)(?P<which>)')
+        (match, fields) = parsers.match('sshd', 'pam_unix(sshd:session): session opened')
+        assert match.re.pattern.startswith(r'^pam_unix\(sshd')
+        (match, fields) = parsers.match('sshd', 'pam_unix(cron:session): session opened')
+        assert match.re.pattern == r'^pam_unix(?P<which>)'
+
+    def test_falls_back_to_shorter_prefixes(self):
+        parsers = SyslogParsers()
+        parsers.register('sshd', 'pam_unix', r'^pam_unix(?P<which>.*)$')
+        parsers.register('sshd', 'pam_unix(sshd', r'^never$')
+        assert parsers.match('sshd', 'pam_unix(sshd:session)') is not None
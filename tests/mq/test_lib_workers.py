@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+# Copyright (c) 2017 Mozilla Corporation
+
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../mq"))
+from mq.lib.workers import WorkerStats, WorkerSupervisor
+
+
+def countAndExit(stats):
+    stats.increment('runs')
+    stats.increment('events', 10)
+
+
+def countAndWait(stats):
+    stats.increment('runs')
+    time.sleep(30)
+
+
+def waitFor(condition, timeout=10):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.05)
+    return condition()
+
+
+class TestWorkerStats(object):
+    def test_local(self):
+        stats = WorkerStats(['received', 'saved'])
+        stats.increment('received')
+        stats.increment('received')
+        stats.increment('saved', 5)
+        assert stats.totals() == {'received': 2, 'saved': 5}
+
+    def test_slices(self):
+        counters = [0] * 4
+        first = WorkerStats(['received', 'saved'], counters, 0)
+        second = WorkerStats(['received', 'saved'], counters, 2)
+        first.increment('saved')
+        second.increment('received', 3)
+        assert counters == [0, 1, 3, 0]
+        assert first.get('saved') == 1
+        assert second.get('received') == 3
+
+
+class TestWorkerSupervisor(object):
+    def test_totals_across_workers(self):
+        supervisor = WorkerSupervisor(3, countAndWait, ['runs'], restartDelay=0.05)
+        supervisor.start()
+        try:
+            assert waitFor(lambda: supervisor.totals()['runs'] == 3)
+            supervisor.check()
+            assert supervisor.restarts == 0
+        finally:
+            supervisor.stop()
+        assert not any(process.is_alive() for process in supervisor.processes)
+
+    def test_restarts_exited_workers(self):
+        supervisor = WorkerSupervisor(2, countAndExit, ['runs', 'events'], restartDelay=0.05)
+        supervisor.start()
+        try:
+            for process in supervisor.processes:
+                process.join()
+            supervisor.check()
+            assert supervisor.restarts == 2
+            assert waitFor(lambda: supervisor.totals()['runs'] == 4)
+            assert supervisor.totals()['events'] == 40
+        finally:
+            supervisor.stop()